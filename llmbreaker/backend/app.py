@@ -8,12 +8,17 @@ from datetime import datetime, timezone
 from flask import Flask, request, jsonify
 from flask_socketio import SocketIO, emit, join_room
 from flask_cors import CORS
-import torch
+from eventlet import tpool
 
 from models import SessionStatus
+from step_scheduler import speed_mode
 from training_manager import TrainingManager
 import trainer as _trainer
 import checkpoint_manager as _ckpt
+import corpus_cache as _corpus
+from dataset_catalogue import DatasetCatalogue
+from dataset_store import DatasetStore
+from history_store import DEFAULT_REPLAY_POINTS
 
 # ---------------------------------------------------------------------------
 # App setup
@@ -21,25 +26,35 @@ import checkpoint_manager as _ckpt
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'llmbreaker-dev-secret'
-app.config['MAX_CONTENT_LENGTH'] = 10 * 1024 * 1024  # 10 MB
+# Uploads are streamed into the corpus cache, so only the request size is capped
+app.config['MAX_CONTENT_LENGTH'] = 512 * 1024 * 1024  # 512 MB
 
 CORS(app, origins=['http://localhost:3000', 'http://localhost:5173'])
 socketio = SocketIO(app, cors_allowed_origins='*', async_mode='eventlet')
 
-manager = TrainingManager()
-
 DATASETS_DIR = os.path.join(os.path.dirname(__file__), 'datasets')
 UPLOADS_DIR  = os.path.join(os.path.dirname(__file__), 'uploads')
 os.makedirs(UPLOADS_DIR, exist_ok=True)
 
-# Give the trainer module its datasets path
+# Each session trains in its own worker process (see training_worker.py)
+manager = TrainingManager(socketio, datasets_dir=DATASETS_DIR)
+
+# Give the trainer module its datasets path (in-process mode)
 _trainer.DATASETS_DIR = DATASETS_DIR
 
-# In-memory store for user-uploaded dataset text keyed by dataset_id
-user_datasets: dict = {}
+# Metadata for bundled and uploaded dataset files, persisted next to datasets/
+catalogue = DatasetCatalogue(os.path.join(os.path.dirname(__file__), 'datasets_index.json'))
+
+# User-uploaded datasets, deduped by content and pinned by the sessions using
+# them (the text stays on disk; metadata lives in the catalogue)
+user_datasets = DatasetStore(UPLOADS_DIR, _trainer.CORPUS_CACHE_DIR)
 
 ALLOWED_EXTENSIONS = {'txt', 'docx'}
 
+# History replay for clients that join mid-run (see history_store.py)
+REPLAY_SAMPLES = 20   # latest generated samples in a replay
+MAX_FRAME_PAGE = 32   # eval frames per /history/frames request
+
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
@@ -58,14 +73,37 @@ def _read_file_text(filepath: str) -> str:
         return f.read()
 
 
-def _dataset_metadata(text: str, name: str, display_name: str) -> dict:
-    chars = set(text)
+def _ingest_upload(filepath: str) -> dict:
+    """Tokenize an uploaded .txt into the corpus cache, off the event loop."""
+    return tpool.execute(_corpus.ingest_file, filepath, _trainer.CORPUS_CACHE_DIR)
+
+
+def _add_upload(filepath: str, corpus: dict, display_name: str) -> dict:
+    """Store an ingested upload (deduped by content); returns its listing metadata."""
+    dataset_id = user_datasets.add(filepath, corpus, display_name)
+    filepath = user_datasets.get(dataset_id)['filepath']
+    catalogue.record(filepath, corpus)
+    return _dataset_metadata(catalogue.metadata(filepath), dataset_id, display_name)
+
+
+def _attach_dataset(session, dataset_id: str) -> None:
+    """Point the session at its dataset file, pinning uploads while it lives."""
+    if dataset_id in user_datasets:
+        session.dataset_path = user_datasets.acquire(dataset_id, session.session_id)
+        return
+    for name, _, filename in BUNDLED_DATASETS:
+        if name == dataset_id:
+            session.dataset_path = os.path.join(DATASETS_DIR, filename)
+            return
+
+
+def _dataset_metadata(meta: dict, name: str, display_name: str) -> dict:
     return {
         'name': name,
         'display_name': display_name,
-        'char_count': len(text),
-        'vocab_size': len(chars),
-        'word_count': len(text.split()),
+        'char_count': meta['char_count'],
+        'vocab_size': meta['vocab_size'],
+        'word_count': meta['word_count'],
     }
 
 
@@ -73,6 +111,25 @@ def _ts() -> int:
     return int(datetime.now(timezone.utc).timestamp())
 
 
+def _history_replay(session, max_points: int = DEFAULT_REPLAY_POINTS,
+                    samples: int = REPLAY_SAMPLES) -> dict:
+    """What a client that joins mid-run missed; frames are paged separately."""
+    history = session.history
+    replay = {
+        'session_id':   session.session_id,
+        'status':       session.status.value,
+        'current_iter': session.current_iter,
+        'error':        session.error_message,
+        'loss':         history.loss_curve(max_points),
+        'samples':      history.samples(samples),
+        'frame_steps':  history.frame_steps(),
+        'timestamp':    _ts(),
+    }
+    if session.vocab:
+        replay['vocab_info'] = {'vocab': session.vocab, 'char_to_idx': session.char_to_idx}
+    return replay
+
+
 # ---------------------------------------------------------------------------
 # REST: Health
 # ---------------------------------------------------------------------------
@@ -104,12 +161,16 @@ def list_datasets():
         filepath = os.path.join(DATASETS_DIR, filename)
         if not os.path.exists(filepath):
             continue
-        with open(filepath, 'r', encoding='utf-8', errors='replace') as f:
-            text = f.read()
-        meta = _dataset_metadata(text, name, display_name)
+        meta = _dataset_metadata(catalogue.metadata(filepath), name, display_name)
         meta['file_path'] = f'/datasets/{filename}'
         datasets.append(meta)
-    return jsonify({'datasets': datasets})
+
+    uploads = []
+    for dataset_id, entry in user_datasets.entries().items():
+        if os.path.exists(entry['filepath']):
+            meta = catalogue.metadata(entry['filepath'])
+            uploads.append(_dataset_metadata(meta, dataset_id, entry['display_name']))
+    return jsonify({'datasets': datasets, 'uploads': uploads})
 
 
 @app.route('/api/datasets/upload', methods=['POST'])
@@ -129,26 +190,32 @@ def upload_dataset():
     file.save(filepath)
 
     try:
-        text = _read_file_text(filepath)
+        if ext == 'docx':
+            # python-docx needs the whole document; keep its text as a .txt
+            text = _read_file_text(filepath)
+            os.remove(filepath)
+            filepath = filepath[:-len('docx')] + 'txt'
+            with open(filepath, 'w', encoding='utf-8') as f:
+                f.write(text)
+        # Checked on a scan pass, so a rejected upload never writes corpus shards
+        char_count = tpool.execute(_corpus.scan_file, filepath)['char_count']
+        if char_count >= 100:
+            corpus = _ingest_upload(filepath)
     except Exception as e:
         os.remove(filepath)
         return jsonify({'error': f'File processing error: {str(e)}'}), 500
 
-    if len(text) < 100:
+    if char_count < 100:
         os.remove(filepath)
         return jsonify({'error': 'Text too short. Minimum 100 characters.'}), 400
-    if len(text) > 5_000_000:
-        os.remove(filepath)
-        return jsonify({'error': 'Text too long. Maximum 5M characters.'}), 400
 
-    dataset_id = f'user_{uuid.uuid4()}'
-    user_datasets[dataset_id] = {'text': text, 'filepath': filepath}
+    meta = _add_upload(filepath, corpus, file.filename)
 
-    preview = text[:200].replace('\n', ' ')
+    preview = corpus['preview'][:200].replace('\n', ' ')
     return jsonify({
-        'dataset_id': dataset_id,
+        'dataset_id': meta['name'],
         'filename': file.filename,
-        **_dataset_metadata(text, dataset_id, file.filename),
+        **meta,
         'text_preview': preview,
     })
 
@@ -160,17 +227,24 @@ def dataset_from_text():
 
     if len(text) < 100:
         return jsonify({'error': 'Text too short. Minimum 100 characters.'}), 400
-    if len(text) > 5_000_000:
-        return jsonify({'error': 'Text too long. Maximum 5M characters.'}), 400
 
-    dataset_id = f'user_{uuid.uuid4()}'
-    user_datasets[dataset_id] = {'text': text, 'filepath': None}
+    # Stored like an upload so sessions stream it from disk
+    filepath = os.path.join(UPLOADS_DIR, f'{uuid.uuid4()}.txt')
+    with open(filepath, 'w', encoding='utf-8') as f:
+        f.write(text)
+    try:
+        corpus = _ingest_upload(filepath)
+    except Exception as e:
+        os.remove(filepath)
+        return jsonify({'error': f'Text processing error: {str(e)}'}), 500
+
+    meta = _add_upload(filepath, corpus, 'Pasted Text')
 
     preview = text[:200].replace('\n', ' ')
     return jsonify({
-        'dataset_id': dataset_id,
+        'dataset_id': meta['name'],
         'filename': 'pasted_text.txt',
-        **_dataset_metadata(text, dataset_id, 'Pasted Text'),
+        **meta,
         'text_preview': preview,
     })
 
@@ -195,16 +269,7 @@ def create_session():
     session_id = manager.create_session(feature_type, dataset_id, hyperparameters)
     session = manager.get_session(session_id)
 
-    # Attach dataset text to session
-    if dataset_id in user_datasets:
-        session.text_corpus = user_datasets[dataset_id]['text']
-        session.dataset_path = user_datasets[dataset_id].get('filepath', '')
-    else:
-        for name, _, filename in BUNDLED_DATASETS:
-            if name == dataset_id:
-                filepath = os.path.join(DATASETS_DIR, filename)
-                session.dataset_path = filepath
-                break
+    _attach_dataset(session, dataset_id)
 
     return jsonify({
         'session_id': session_id,
@@ -230,10 +295,37 @@ def get_session(session_id):
         'current_iter': session.current_iter,
         'max_iters': max_iters,
         'progress': round(progress, 4),
+        'speed_multiplier': session.speed_multiplier,
+        'speed_mode': speed_mode(session.speed_multiplier),
+        'steps_per_second': session.steps_per_second,
+        'emit_queue': session.emit_stats,
         'started_at': session.started_at.isoformat() + 'Z' if session.started_at else None,
     })
 
 
+@app.route('/api/sessions/<session_id>/history', methods=['GET'])
+def get_session_history(session_id):
+    """Loss curve (LTTB-downsampled to ?max_points), recent samples and frame steps."""
+    session = manager.get_session(session_id)
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    max_points = request.args.get('max_points', DEFAULT_REPLAY_POINTS, type=int)
+    samples    = request.args.get('samples', REPLAY_SAMPLES, type=int)
+    return jsonify(_history_replay(session, max(3, max_points), max(0, samples)))
+
+
+@app.route('/api/sessions/<session_id>/history/frames', methods=['GET'])
+def get_session_history_frames(session_id):
+    """One page of stored eval frames: ?after_step= (exclusive) and ?limit=."""
+    session = manager.get_session(session_id)
+    if not session:
+        return jsonify({'error': 'Session not found'}), 404
+    after_step = request.args.get('after_step', -1, type=int)
+    limit      = request.args.get('limit', 8, type=int)
+    frames = session.history.frames(after_step, min(max(1, limit), MAX_FRAME_PAGE))
+    return jsonify({'session_id': session_id, 'frames': frames})
+
+
 @app.route('/api/sessions/<session_id>', methods=['DELETE'])
 def delete_session(session_id):
     session = manager.get_session(session_id)
@@ -242,13 +334,18 @@ def delete_session(session_id):
 
     manager.stop_training(session_id)
     manager.cleanup_session(session_id)
+    user_datasets.release(session_id)
 
     return jsonify({'message': 'Session terminated', 'session_id': session_id})
 
 
 @app.route('/api/sessions', methods=['GET'])
 def list_sessions():
-    return jsonify({'sessions': manager.get_all_sessions()})
+    return jsonify({
+        'sessions': manager.get_all_sessions(),
+        **manager.get_thread_allocation(),
+        'dataset_store': user_datasets.stats(),
+    })
 
 
 # ---------------------------------------------------------------------------
@@ -267,20 +364,13 @@ def save_model(session_id):
     session = manager.get_session(session_id)
     if not session:
         return jsonify({'error': 'Session not found'}), 404
-    if not session.model_instance or not session.optimizer:
+    if not manager.model_ready(session_id):
         return jsonify({'error': 'No model in session yet'}), 400
 
-    last_loss = session.loss_history[-1].get('train_loss') if session.loss_history else None
-    entry = _ckpt.save_checkpoint(
-        model           = session.model_instance,
-        optimizer       = session.optimizer,
-        model_config    = dict(session.model_config),
-        training_config = dict(session.training_config),
-        feature_type    = session.feature_type.value,
-        step            = session.current_iter,
-        train_loss      = last_loss,
-        name            = name,
-    )
+    try:
+        entry = manager.call(session_id, 'save_checkpoint', name=name)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 400
     return jsonify(entry), 201
 
 
@@ -329,6 +419,7 @@ def load_model_as_session(record_id):
             hyperparameters = hp,
         )
         session = manager.get_session(session_id)
+        _attach_dataset(session, dataset)
         session._resume_checkpoint = ckpt
         session._resume_from_step  = ckpt.get('step', 0)
 
@@ -369,6 +460,18 @@ def on_join_session(data):
     if session_id:
         join_room(session_id)
         emit('joined', {'session_id': session_id})
+        # A (re)joining client holds no delta-frame state
+        manager.resync(session_id)
+        # ... nor anything from before it joined
+        session = manager.get_session(session_id)
+        if session and (session.history.last_metrics or session.history.frame_steps()):
+            emit('history_replay', _history_replay(session))
+
+
+@socketio.on('request_keyframe')
+def on_request_keyframe(data):
+    """A client lost track of a delta-encoded stream."""
+    manager.resync(data.get('session_id'))
 
 
 @socketio.on('start_training')
@@ -383,17 +486,16 @@ def on_start_training(data):
     if session.status == SessionStatus.RUNNING:
         return  # already running
 
-    manager.start_training(session_id)
     join_room(session_id)
 
+    # Launch the training worker
+    manager.launch_training(session_id)
+
     socketio.emit('training_started', {
         'session_id': session_id,
         'timestamp': _ts(),
     }, room=session_id)
 
-    # Launch background training task
-    socketio.start_background_task(_run_training, session_id)
-
 
 @socketio.on('pause_training')
 def on_pause_training(data):
@@ -430,12 +532,7 @@ def on_stop_training(data):
 @socketio.on('step_training')
 def on_step_training(data):
     session_id = data.get('session_id')
-    session = manager.get_session(session_id)
-    if not session or session.status != SessionStatus.PAUSED:
-        return
-    # Signal the training loop to execute one step then re-pause
-    session.status = SessionStatus.RUNNING
-    session._step_once = True
+    manager.step_training(session_id)
 
 
 @socketio.on('set_speed')
@@ -456,9 +553,14 @@ def generate_next_token():
     session_id = data.get('session_id')
     context = data.get('context', '')
     temperature = data.get('temperature', 1.0)
+    top_k = data.get('top_k')
+    top_p = data.get('top_p')
+    repetition_penalty = data.get('repetition_penalty', 1.0)
 
     if not session_id:
         return jsonify({'error': 'session_id required'}), 400
+    if not context:
+        return jsonify({'error': 'context required'}), 400
 
     # Get session from manager
     session = manager.get_session(session_id)
@@ -466,62 +568,25 @@ def generate_next_token():
         return jsonify({'error': 'Session not found'}), 404
 
     # Check if model is initialized
-    if not session.model_instance:
+    if not manager.model_ready(session_id):
         return jsonify({'error': 'Model not initialized'}), 400
 
     try:
-        # Get vocabulary mappings
-        char_to_idx = session.char_to_idx
-        idx_to_char = session.idx_to_char
-
-        # Check for unknown characters
-        unknown_chars = [c for c in context if c not in char_to_idx]
+        # Check for unknown characters (vocab is mirrored from the worker)
+        unknown_chars = session.tokenizer.unknown_chars(context)
         if unknown_chars:
-            unique_unknown = list(set(unknown_chars))
-            return jsonify({'error': f'Unknown characters: {unique_unknown}'}), 400
-
-        # Convert to tensor
-        idx = torch.tensor([char_to_idx[c] for c in context], dtype=torch.long).unsqueeze(0)
-
-        # Generate next token
-        device = next(session.model_instance.parameters()).device
-        idx = idx.to(device)
-
-        # Get logits for next token
-        with torch.no_grad():
-            idx_result, logits = session.model_instance.generate(
-                idx,
-                max_new_tokens=1,
-                temperature=temperature,
-                return_last_logits=True
-            )
-
-        # Get next token
-        next_token_idx = idx_result[0, -1].item()
-        next_token = idx_to_char[next_token_idx]
-
-        # Compute probabilities
-        probs = torch.softmax(logits / temperature, dim=0)
-
-        # Get top 10 probabilities
-        top_probs, top_indices = torch.topk(probs, min(10, len(probs)))
-        probabilities = [
-            {
-                'token': idx_to_char[idx.item()],
-                'prob': float(prob.item())
-            }
-            for prob, idx in zip(top_probs, top_indices)
-        ]
-
-        # Get context used (last block_size chars)
-        block_size = session.model_instance.block_size
-        context_used = context[-block_size:] if len(context) > block_size else context
-
-        return jsonify({
-            'next_token': next_token,
-            'probabilities': probabilities,
-            'context_used': context_used
-        })
+            return jsonify({'error': f'Unknown characters: {unknown_chars}'}), 400
+
+        # One forward for the next-token logits, then sample + top-10 in one call
+        result = manager.call(
+            session_id, 'next_token',
+            context=context,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            repetition_penalty=repetition_penalty,
+        )
+        return jsonify(result)
 
     except Exception as e:
         import traceback
@@ -529,15 +594,49 @@ def generate_next_token():
         return jsonify({'error': f'Generation failed: {str(e)}'}), 500
 
 
-# ---------------------------------------------------------------------------
-# Background training loop — delegates to trainer.py
-# ---------------------------------------------------------------------------
+@app.route('/api/generate-next-token/batch', methods=['POST'])
+def generate_next_token_batch():
+    """Score several candidate contexts in one batched forward pass."""
+    data = request.json
+    session_id = data.get('session_id')
+    contexts = data.get('contexts', [])
+    temperature = data.get('temperature', 1.0)   # one value, or one per context
+    top_k = data.get('top_k')
+    top_p = data.get('top_p')
+
+    if not session_id:
+        return jsonify({'error': 'session_id required'}), 400
+    if not isinstance(contexts, list) or not contexts:
+        return jsonify({'error': 'contexts must be a non-empty list'}), 400
+    if not all(isinstance(c, str) and c for c in contexts):
+        return jsonify({'error': 'contexts must be non-empty strings'}), 400
+    if isinstance(temperature, list) and len(temperature) != len(contexts):
+        return jsonify({'error': 'temperature list must match contexts'}), 400
 
-def _run_training(session_id: str):
     session = manager.get_session(session_id)
     if not session:
-        return
-    _trainer.run_training(session, socketio)
+        return jsonify({'error': 'Session not found'}), 404
+    if not manager.model_ready(session_id):
+        return jsonify({'error': 'Model not initialized'}), 400
+
+    try:
+        unknown_chars = session.tokenizer.unknown_chars(''.join(contexts))
+        if unknown_chars:
+            return jsonify({'error': f'Unknown characters: {unknown_chars}'}), 400
+
+        results = manager.call(
+            session_id, 'next_token_batch',
+            contexts=contexts,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+        )
+        return jsonify({'results': results})
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({'error': f'Generation failed: {str(e)}'}), 500
 
 
 # ---------------------------------------------------------------------------
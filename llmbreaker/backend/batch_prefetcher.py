@@ -0,0 +1,102 @@
+"""
+batch_prefetcher.py — Samples training batches ahead of the training loop.
+
+A producer thread keeps a ring of `depth` ready (x, y) batches gathered by
+a BatchSampler into preallocated slots, so sampling overlaps with the
+forward / backward pass instead of adding to every step.
+
+    ring of depth + 1 slots:  producer fills free slots → ready queue
+                              next() hands one out and frees the previous one
+
+While training is paused the ring fills up and the producer simply blocks
+on the free queue; close() (on stop / completion) wakes and joins it.
+
+Reproducibility: batches are drawn from a private torch.Generator by the
+single producer and consumed in order, so a given `seed` always yields the
+same batch sequence.
+"""
+
+import queue
+import threading
+from typing import Optional, Tuple
+
+import torch
+
+from dataset_loader import BatchSampler
+
+_STOP = object()
+
+
+class BatchPrefetcher:
+    """Background ring of ready training batches for one split."""
+
+    def __init__(
+        self,
+        data: torch.Tensor,
+        block_size: int,
+        batch_size: int,
+        device: torch.device,
+        depth: int = 2,
+        seed: Optional[int] = None,
+    ):
+        generator = torch.Generator()
+        if seed is None:
+            generator.seed()
+        else:
+            generator.manual_seed(seed)
+        self._sampler = BatchSampler(data, block_size, batch_size, device, generator=generator)
+
+        depth = max(1, depth)
+        # One slot more than the ring depth: the batch in use by the loop
+        self._slots = [self._sampler.new_buffer() for _ in range(depth + 1)]
+        self._free:  queue.Queue = queue.Queue()
+        self._ready: queue.Queue = queue.Queue()
+        for i in range(len(self._slots)):
+            self._free.put(i)
+
+        self._in_use: Optional[int] = None
+        self._closed = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> 'BatchPrefetcher':
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+        return self
+
+    def next(self) -> Tuple[torch.Tensor, torch.Tensor]:
+        """
+        The next batch, in sampling order.  It stays valid until the
+        following next() call (its slot is then reused).
+        """
+        if self._in_use is not None:
+            self._free.put(self._in_use)
+            self._in_use = None
+
+        item = self._ready.get()
+        if isinstance(item, BaseException):
+            raise item
+        slot, batch = item
+        self._in_use = slot
+        return batch
+
+    def close(self, timeout: float = 1.0) -> None:
+        """Stop the producer and wait for it to exit."""
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._free.put(_STOP)
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    # ── producer ───────────────────────────────────────────────────────────
+
+    def _produce(self) -> None:
+        try:
+            while True:
+                slot = self._free.get()
+                if slot is _STOP or self._closed.is_set():
+                    return
+                batch = self._sampler.sample(out=self._slots[slot])
+                self._ready.put((slot, batch))
+        except Exception as e:
+            self._ready.put(e)
@@ -0,0 +1,457 @@
+"""
+benchmark.py — Micro-benchmarks for the MicroGPT hot paths.
+
+Not used by the server.  Run from the backend directory:
+
+    python benchmark.py generate [--presets small large] [--tokens 100]
+    python benchmark.py train-step [--presets large] [--batch-size 64]
+    python benchmark.py attention  [--presets medium]
+    python benchmark.py get-batch  [--presets small] [--batch-size 64]
+    python benchmark.py tokenizer
+    python benchmark.py bpe        [--bpe-vocab-size 512]
+    python benchmark.py parity     [--presets small]
+
+Every benchmark prints one line per model-size preset from
+training_manager.MODEL_SIZE_CONFIGS (tokenizer, bpe: one per bundled dataset).
+generate, train-step and attention first run the parity checks for the
+fast path they time, and stop with an AssertionError (non-zero exit) if the
+outputs differ; `parity` runs only the checks.
+"""
+
+import argparse
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+import torch
+
+from dataset_loader import BatchSampler, build_vocab, load_text_from_file
+from micro_gpt import KVCache, MicroGPT, MultiHeadAttention, convert_legacy_state_dict
+from tokenizer import DEFAULT_BPE_VOCAB_SIZE, BPETokenizer, CharTokenizer, word_aligned
+from training_manager import MODEL_SIZE_CONFIGS
+
+VOCAB_SIZE  = 65          # Shakespeare-sized character vocab
+CORPUS_SIZE = 1_000_000   # tokens, roughly shakespeare.txt
+
+DATASETS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'datasets')
+
+
+# ---------------------------------------------------------------------------
+# Helpers
+# ---------------------------------------------------------------------------
+
+def _build_model(preset: str) -> MicroGPT:
+    config = {'vocab_size': VOCAB_SIZE, 'dropout': 0.0, **MODEL_SIZE_CONFIGS[preset]}
+    model = MicroGPT(config)
+    model.eval()
+    return model
+
+
+def _time(fn, repeats: int) -> float:
+    """Mean wall time of `fn()` in seconds, after one warm-up call."""
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+@contextmanager
+def _explicit_attention():
+    """Force the hand-written mask → softmax → matmul attention path."""
+    MultiHeadAttention.use_fused_kernel = False
+    try:
+        yield
+    finally:
+        MultiHeadAttention.use_fused_kernel = True
+
+
+# ---------------------------------------------------------------------------
+# Parity checks
+# ---------------------------------------------------------------------------
+
+# float32 tolerances for two orderings of the same arithmetic
+ATOL = 1e-5
+RTOL = 1e-4
+
+
+def _check(ok: bool, message: str) -> None:
+    # Not `assert`: the checks must also run under python -O
+    if not ok:
+        raise AssertionError(message)
+
+
+def _max_diff(a: torch.Tensor, b: torch.Tensor) -> float:
+    return (a - b).abs().max().item()
+
+
+def _check_close(name: str, a: torch.Tensor, b: torch.Tensor) -> float:
+    _check(a.shape == b.shape, f'{name}: shape {tuple(a.shape)} != {tuple(b.shape)}')
+    _check(torch.allclose(a, b, atol=ATOL, rtol=RTOL),
+           f'{name}: max |diff| {_max_diff(a, b):.2e} exceeds atol {ATOL} / rtol {RTOL}')
+    return _max_diff(a, b)
+
+
+def check_generate(model: MicroGPT, tokens: int) -> float:
+    """
+    KV-cached decoding vs full-window recompute: the same token sequence for
+    the same seed, and the same logits at every position of one window.
+    """
+    seed = torch.zeros((1, 1), dtype=torch.long)
+    outputs = {}
+    for use_cache in (False, True):
+        torch.manual_seed(0)
+        outputs[use_cache] = model.generate(seed, tokens, use_cache=use_cache)
+    _check(torch.equal(outputs[False], outputs[True]),
+           'generate: cached and uncached decoding produced different tokens')
+
+    # Teacher-forced: one token at a time through the cache vs one full forward
+    window = outputs[False][:, :model.block_size]
+    with torch.no_grad():
+        full, _ = model(window)
+        cache = KVCache(model.n_layer)
+        stepped = torch.cat([
+            model(window[:, t:t + 1], kv_cache=cache)[0]
+            for t in range(window.shape[1])
+        ], dim=1)
+    return _check_close('generate: cached vs full logits', stepped, full)
+
+
+def _logits_and_grads(model: MicroGPT, x, y, explicit: bool):
+    model.zero_grad(set_to_none=True)
+    if explicit:
+        with _explicit_attention():
+            logits, loss = model(x, y)
+    else:
+        logits, loss = model(x, y)
+    loss.backward()
+    return logits.detach(), [p.grad.clone() for p in model.parameters()]
+
+
+def check_attention(model: MicroGPT, x, y) -> tuple[float, float]:
+    """Fused scaled_dot_product_attention vs the explicit path: logits and grads."""
+    fused_logits, fused_grads = _logits_and_grads(model, x, y, explicit=False)
+    expl_logits,  expl_grads  = _logits_and_grads(model, x, y, explicit=True)
+    model.zero_grad(set_to_none=True)
+    logit_diff = _check_close('attention: fused vs explicit logits', fused_logits, expl_logits)
+    grad_diff = max(
+        _check_close(f'attention: fused vs explicit grad of {name}', a, b)
+        for (name, _), a, b in zip(model.named_parameters(), fused_grads, expl_grads)
+    )
+    return logit_diff, grad_diff
+
+
+def check_capture(model: MicroGPT, x) -> float:
+    """
+    Attention capture on vs off: the same logits, and every layer records
+    (B, n_head, T, T) causal weights whose rows sum to 1.
+    """
+    with torch.no_grad():
+        plain, _ = model(x)
+        with model.capture_attention():
+            captured, _ = model(x)
+    B, T = x.shape
+    for i, block in enumerate(model.blocks):
+        weights = block.sa.last_attention
+        _check(weights is not None, f'capture: layer {i} recorded nothing')
+        _check(weights.shape == (B, block.sa.n_head, T, T),
+               f'capture: layer {i} weights have shape {tuple(weights.shape)}')
+        _check(torch.allclose(weights.sum(-1), torch.ones(()), atol=ATOL),
+               f'capture: layer {i} rows do not sum to 1')
+        _check(not weights.triu(1).any(), f'capture: layer {i} attends to future positions')
+    _check(all(block.sa.last_attention is not None and not block.sa.capture
+               for block in model.blocks), 'capture: still on after the block')
+    return _check_close('capture: on vs off logits', captured, plain)
+
+
+def _split_head_attention(sa: MultiHeadAttention, x: torch.Tensor) -> torch.Tensor:
+    """
+    The pre-fusion layout: a separate query / key / value projection per
+    head (rows of the fused weight, as convert_legacy_state_dict stacks
+    them), explicit causal softmax, head outputs concatenated into proj.
+    """
+    B, T, C = x.shape
+    hs = sa.head_size
+    w = sa.qkv.weight
+    outs = []
+    for h in range(sa.n_head):
+        q = x @ w[h * hs:(h + 1) * hs].T
+        k = x @ w[C + h * hs:C + (h + 1) * hs].T
+        v = x @ w[2 * C + h * hs:2 * C + (h + 1) * hs].T
+        scores = q @ k.transpose(-2, -1) * hs ** -0.5
+        scores = scores.masked_fill(sa.tril[:T, :T] == 0, float('-inf'))
+        outs.append(torch.softmax(scores, dim=-1) @ v)
+    return sa.proj(torch.cat(outs, dim=-1))
+
+
+def check_fused_qkv(model: MicroGPT, x: torch.Tensor) -> float:
+    """Fused QKV attention (both kernels) vs split per-head projections, every layer."""
+    diff = 0.0
+    with torch.no_grad():
+        h = model.token_embedding_table(x) + model.position_embedding_table(torch.arange(x.shape[1]))
+        for i, block in enumerate(model.blocks):
+            normed = block.ln1(h)
+            reference = _split_head_attention(block.sa, normed)
+            diff = max(diff, _check_close(f'qkv: layer {i} fused', block.sa(normed), reference))
+            with _explicit_attention():
+                diff = max(diff, _check_close(f'qkv: layer {i} explicit', block.sa(normed), reference))
+            h = block(h)
+    return diff
+
+
+def _legacy_state_dict(model: MicroGPT) -> dict:
+    """The model's weights in the pre-fusion layout: one Head module per head."""
+    legacy = {}
+    for key, value in model.state_dict().items():
+        if not key.endswith('.sa.qkv.weight'):
+            legacy[key] = value
+            continue
+        prefix = key[:-len('.qkv.weight')]
+        for name, weight in zip(('query', 'key', 'value'), value.chunk(3, dim=0)):
+            for h, rows in enumerate(weight.chunk(model.n_head, dim=0)):
+                legacy[f'{prefix}.heads.{h}.{name}.weight'] = rows.clone()
+        for h in range(model.n_head):
+            legacy[f'{prefix}.heads.{h}.tril'] = torch.tril(
+                torch.ones(model.block_size, model.block_size))
+    return legacy
+
+
+def check_legacy_checkpoint(model: MicroGPT, x: torch.Tensor) -> float:
+    """A per-head checkpoint, converted and loaded strictly, gives the same logits."""
+    converted = convert_legacy_state_dict(_legacy_state_dict(model))
+    _check(converted.keys() == model.state_dict().keys(),
+           'legacy: converted keys do not match the model')
+    restored = MicroGPT({
+        'vocab_size': model.vocab_size, 'n_embd': model.n_embd, 'n_layer': model.n_layer,
+        'n_head': model.n_head, 'block_size': model.block_size,
+    })
+    restored.load_state_dict(converted)
+    restored.eval()
+    with torch.no_grad():
+        return _check_close('legacy: converted vs original logits', restored(x)[0], model(x)[0])
+
+
+# ---------------------------------------------------------------------------
+# Benchmarks
+# ---------------------------------------------------------------------------
+
+def bench_generate(args: argparse.Namespace) -> None:
+    """Full-window recompute vs KV-cached decoding (same seed, same output)."""
+    seed = torch.zeros((1, 1), dtype=torch.long)
+
+    def run(model, use_cache):
+        torch.manual_seed(0)
+        return model.generate(seed, args.tokens, use_cache=use_cache)
+
+    for preset in args.presets:
+        model  = _build_model(preset)
+        diff   = check_generate(model, args.tokens)
+        full   = _time(lambda: run(model, False), args.repeats)
+        cached = _time(lambda: run(model, True),  args.repeats)
+        print(
+            f'{preset:<7} full {full * 1e3:8.1f} ms   cached {cached * 1e3:8.1f} ms   '
+            f'speedup {full / cached:5.2f}x   same tokens, max |Δlogits| {diff:.2e}'
+        )
+
+
+def bench_train_step(args: argparse.Namespace) -> None:
+    """Training step time with attention capture off (default) vs forced on."""
+    for preset in args.presets:
+        model = _build_model(preset)
+        model.train()
+        optimizer  = torch.optim.AdamW(model.parameters(), lr=1e-3)
+        block_size = model.block_size
+        x = torch.randint(VOCAB_SIZE, (args.batch_size, block_size))
+        y = torch.randint(VOCAB_SIZE, (args.batch_size, block_size))
+
+        def step():
+            _, loss = model(x, y)
+            optimizer.zero_grad(set_to_none=True)
+            loss.backward()
+            optimizer.step()
+
+        def step_with_capture():
+            with model.capture_attention():
+                step()
+
+        model.eval()
+        diff = check_capture(model, x)
+        model.train()
+        plain    = _time(step, args.repeats)
+        captured = _time(step_with_capture, args.repeats)
+        print(
+            f'{preset:<7} capture off {plain * 1e3:8.1f} ms/step   '
+            f'capture on {captured * 1e3:8.1f} ms/step   '
+            f'saved {(captured - plain) / captured * 100:5.1f}%   '
+            f'max |Δlogits| {diff:.2e}'
+        )
+
+
+def bench_attention(args: argparse.Namespace) -> None:
+    """Fused scaled_dot_product_attention vs the explicit path: parity + speed."""
+    for preset in args.presets:
+        model = _build_model(preset)
+        block_size = model.block_size
+        x = torch.randint(VOCAB_SIZE, (args.batch_size, block_size))
+        y = torch.randint(VOCAB_SIZE, (args.batch_size, block_size))
+        seed = torch.zeros((1, 1), dtype=torch.long)
+
+        # Parity: logits and gradients from both paths on the same batch
+        logit_diff, grad_diff = check_attention(model, x, y)
+
+        def train_step():
+            _, loss = model(x, y)
+            model.zero_grad(set_to_none=True)
+            loss.backward()
+
+        def generate():
+            torch.manual_seed(0)
+            model.generate(seed, args.tokens)
+
+        fused_train, fused_gen = _time(train_step, args.repeats), _time(generate, args.repeats)
+        with _explicit_attention():
+            expl_train, expl_gen = _time(train_step, args.repeats), _time(generate, args.repeats)
+
+        print(
+            f'{preset:<7} max |Δlogits| {logit_diff:.2e}  max |Δgrad| {grad_diff:.2e}   '
+            f'train {expl_train * 1e3:7.1f} → {fused_train * 1e3:7.1f} ms/step   '
+            f'generate {expl_gen * 1e3:7.1f} → {fused_gen * 1e3:7.1f} ms'
+        )
+
+
+def _stacked_batch(data, ix, block_size):
+    """The previous get_batch: 2 × batch_size slices, then torch.stack."""
+    x = torch.stack([data[i    : i + block_size    ] for i in ix])
+    y = torch.stack([data[i + 1: i + block_size + 1] for i in ix])
+    return x, y
+
+
+def bench_get_batch(args: argparse.Namespace) -> None:
+    """Per-window slicing + stack vs one gather over the strided view."""
+    data = torch.randint(VOCAB_SIZE, (CORPUS_SIZE,))
+    for preset in args.presets:
+        block_size = MODEL_SIZE_CONFIGS[preset]['block_size']
+        cpu    = torch.device('cpu')
+        fresh  = BatchSampler(data, block_size, args.batch_size, cpu)
+        reused = BatchSampler(data, block_size, args.batch_size, cpu, reuse_buffers=True)
+        ix = torch.randint(CORPUS_SIZE - block_size, (args.batch_size,))
+
+        match = all(
+            torch.equal(a, b)
+            for a, b in zip(_stacked_batch(data, ix, block_size), reused.gather(ix))
+        )
+        repeats = args.repeats * 200
+        stacked  = _time(lambda: _stacked_batch(data, ix, block_size), repeats)
+        gathered = _time(lambda: fresh.gather(ix), repeats)
+        buffered = _time(lambda: reused.gather(ix), repeats)
+        print(
+            f'{preset:<7} stack {stacked * 1e6:8.1f} µs   gather {gathered * 1e6:8.1f} µs   '
+            f'gather+buffer {buffered * 1e6:8.1f} µs   '
+            f'speedup {stacked / buffered:5.1f}x   same batch: {match}'
+        )
+
+
+def bench_tokenizer(args: argparse.Namespace) -> None:
+    """Per-character dict encode / decode vs CharTokenizer lookup tables."""
+    for filename in sorted(os.listdir(DATASETS_DIR)):
+        if not filename.endswith('.txt'):
+            continue
+        text = load_text_from_file(os.path.join(DATASETS_DIR, filename))
+        vocab, char_to_idx, idx_to_char = build_vocab(text)
+        tokenizer = CharTokenizer(vocab)
+        ids = tokenizer.encode(text)
+
+        match = (ids.tolist() == [char_to_idx[ch] for ch in text if ch in char_to_idx]
+                 and tokenizer.decode(ids) == text)
+        id_list = ids.tolist()
+        dict_enc = _time(lambda: [char_to_idx[ch] for ch in text if ch in char_to_idx],
+                         args.repeats)
+        dict_dec = _time(lambda: ''.join(idx_to_char.get(i, '') for i in id_list),
+                         args.repeats)
+        tok_enc = _time(lambda: tokenizer.encode(text), args.repeats)
+        tok_dec = _time(lambda: tokenizer.decode(ids), args.repeats)
+        print(
+            f'{filename:<16} {len(text) / 1e6:5.2f}M chars   '
+            f'encode {dict_enc * 1e3:7.1f} → {tok_enc * 1e3:6.1f} ms   '
+            f'decode {dict_dec * 1e3:7.1f} → {tok_dec * 1e3:6.1f} ms   '
+            f'round trip ok: {match}'
+        )
+
+
+def bench_bpe(args: argparse.Namespace) -> None:
+    """BPE training / encode / decode cost, and characters packed per token."""
+    for filename in sorted(os.listdir(DATASETS_DIR)):
+        if not filename.endswith('.txt'):
+            continue
+        text = load_text_from_file(os.path.join(DATASETS_DIR, filename))
+        start = time.perf_counter()
+        tokenizer = BPETokenizer.train([text], args.bpe_vocab_size)
+        trained = time.perf_counter() - start
+        ids = tokenizer.encode(text)
+        # The corpus cache encodes files chunk by chunk; it must match
+        chunks = word_aligned(text[i:i + 4096] for i in range(0, len(text), 4096))
+        chunked = [t for chunk in chunks for t in tokenizer.encode(chunk).tolist()]
+        _check(chunked == ids.tolist(),
+               f'{filename}: chunked BPE encoding differs from the whole-text encoding')
+
+        match = tokenizer.decode(ids) == text
+        # Fresh tokenizer per repeat so the word cache starts cold
+        enc = _time(lambda: BPETokenizer(tokenizer.merges).encode(text), args.repeats)
+        dec = _time(lambda: tokenizer.decode(ids), args.repeats)
+        print(
+            f'{filename:<16} {len(text) / 1e6:5.2f}M chars   vocab {len(tokenizer):5d}   '
+            f'train {trained:5.2f} s   encode {enc * 1e3:7.1f} ms   decode {dec * 1e3:6.1f} ms   '
+            f'{len(text) / max(1, len(ids)):4.2f} chars/token   round trip ok: {match}'
+        )
+
+
+def run_parity(args: argparse.Namespace) -> None:
+    """Every parity check, per preset, without timing anything."""
+    for preset in args.presets:
+        model = _build_model(preset)
+        x = torch.randint(VOCAB_SIZE, (4, model.block_size))
+        y = torch.randint(VOCAB_SIZE, (4, model.block_size))
+        results = {
+            'qkv':       check_fused_qkv(model, x),
+            'legacy':    check_legacy_checkpoint(model, x),
+            'generate':  check_generate(model, args.tokens),
+            'capture':   check_capture(model, x),
+            'attention': max(check_attention(model, x, y)),
+        }
+        print(f'{preset:<7} ok   ' + '   '.join(
+            f'{name} {diff:.2e}' for name, diff in results.items()))
+
+
+BENCHMARKS = {
+    'generate':   bench_generate,
+    'train-step': bench_train_step,
+    'attention':  bench_attention,
+    'get-batch':  bench_get_batch,
+    'tokenizer':  bench_tokenizer,
+    'bpe':        bench_bpe,
+    'parity':     run_parity,
+}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('benchmark', choices=sorted(BENCHMARKS))
+    parser.add_argument('--presets', nargs='+', default=list(MODEL_SIZE_CONFIGS),
+                        choices=list(MODEL_SIZE_CONFIGS))
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--tokens',  type=int, default=100,
+                        help='tokens to generate per call (generate, attention)')
+    parser.add_argument('--batch-size', type=int, default=64,
+                        help='batch size per step (train-step, attention, get-batch)')
+    parser.add_argument('--bpe-vocab-size', type=int, default=DEFAULT_BPE_VOCAB_SIZE,
+                        help='BPE vocabulary size, bytes included (bpe)')
+    args = parser.parse_args()
+    try:
+        BENCHMARKS[args.benchmark](args)
+    except AssertionError as e:
+        sys.exit(f'parity check failed: {e}')
+
+
+if __name__ == '__main__':
+    main()
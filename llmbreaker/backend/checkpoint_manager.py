@@ -12,6 +12,8 @@ from typing import Dict, List, Optional
 
 import torch
 
+from micro_gpt import convert_legacy_state_dict
+
 CHECKPOINTS_DIR = os.path.join(os.path.dirname(__file__), 'checkpoints')
 REGISTRY_PATH   = os.path.join(CHECKPOINTS_DIR, 'models_registry.json')
 
@@ -100,6 +102,9 @@ def load_checkpoint(record_id: str) -> Optional[Dict]:
     """
     Returns the full checkpoint dict (model_state, optimizer_state, configs, step).
     Returns None if not found.
+
+    Checkpoints saved before attention heads were fused have their
+    model_state converted to the current layout on load.
     """
     records = load_registry()
     entry   = next((r for r in records if r['id'] == record_id), None)
@@ -109,9 +114,11 @@ def load_checkpoint(record_id: str) -> Optional[Dict]:
     if not os.path.exists(filepath):
         return None
     try:
-        return torch.load(filepath, map_location='cpu', weights_only=False)
+        ckpt = torch.load(filepath, map_location='cpu', weights_only=False)
     except Exception as e:
         return None  # corrupt or incompatible checkpoint
+    ckpt['model_state'] = convert_legacy_state_dict(ckpt['model_state'])
+    return ckpt
 
 
 def rename_checkpoint(record_id: str, new_name: str) -> bool:
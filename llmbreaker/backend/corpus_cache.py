@@ -0,0 +1,342 @@
+"""
+corpus_cache.py — Content-addressed cache of tokenized corpora.
+
+prepare_dataset() rebuilds the vocab and re-encodes the whole text for
+every session.  Here the result is stored once per distinct text, keyed by
+the SHA-256 of its UTF-8 bytes:
+
+    corpus_cache/<key>/meta.json            {'version', 'tokenizer', 'dtype', 'shards', ...}
+    corpus_cache/<key>/shard-00000.tokens   raw token arrays, smallest dtype for the
+    corpus_cache/<key>/shard-00001.tokens   vocab, SHARD_TOKENS tokens per file
+    corpus_cache/<key>-bpe512/...           same corpus under a 512-token BPE tokenizer
+
+Ingestion streams: text is read in chunks (iter_text_chunks for files),
+one pass hashes it and builds the vocab, and — only on a cache miss — a
+second pass encodes the chunks straight into shard files.  Chunks are
+re-cut on word boundaries first (tokenizer.word_aligned), so BPE merges
+come out as they would on the whole text.  Memory use is a few chunks
+regardless of corpus size.  In BPE mode the merges are learned from the
+first BPE_TRAIN_CHARS characters in between, and stored in the meta as
+the tokenizer spec, so they are trained once per corpus too.  A corpus is
+written into a temporary directory and renamed into place, so a present
+directory is always complete.  If the cache directory is not writable,
+the prepare_* functions tokenize in memory instead.
+
+Sessions memory-map the shards copy-on-write, so repeated sessions on the
+same dataset start without re-encoding and share the page cache.  A corpus
+that fits in one shard is a plain tensor; larger ones are ShardedTokens,
+which the batch sampler reads across shard boundaries.
+
+Public API
+----------
+corpus_key(text)                            →  str     content hash
+ingest_text(text, cache_dir, tokenizer)     →  meta    tokenize + cache (no-op on hit)
+ingest_file(path, cache_dir)                →  meta    same, streaming from a .txt file
+scan_file(path)                             →  key, vocab and counts only (no tokens)
+load_tokens(meta, cache_dir)                →  token tensor / ShardedTokens
+prepare_cached_dataset(text, ...)           →  same dict as prepare_dataset()
+prepare_cached_file_dataset(path, ...)      →  same, streaming from a .txt file
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import uuid
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+import torch
+
+from dataset_loader import (
+    READ_CHUNK_CHARS,
+    ShardedTokens,
+    TokenData,
+    iter_text_chunks,
+    load_text_from_file,
+    prepare_dataset,
+    token_dtype,
+)
+from tokenizer import (
+    DEFAULT_BPE_VOCAB_SIZE,
+    BPETokenizer,
+    CharTokenizer,
+    tokenizer_from_spec,
+    word_aligned,
+)
+
+CACHE_VERSION     = 4   # 4: BPE shards encoded from word-aligned chunks
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus_cache')
+SHARD_TOKENS      = 1 << 24   # tokens per shard file (16 MB at uint8)
+PREVIEW_CHARS     = 500
+BPE_TRAIN_CHARS   = 8 * 1024 * 1024   # corpus prefix the BPE merges are learned from
+
+_NUMPY_DTYPES = {torch.uint8: np.uint8, torch.int16: np.int16, torch.int32: np.int32}
+
+Chunks = Callable[[], Iterable[str]]
+
+
+def _encode_utf8(text: str) -> bytes:
+    return text.encode('utf-8', errors='surrogatepass')
+
+
+def corpus_key(text: str) -> str:
+    """Hex SHA-256 of the text's UTF-8 encoding."""
+    return hashlib.sha256(_encode_utf8(text)).hexdigest()
+
+
+def _text_chunks(text: str) -> Chunks:
+    return lambda: (text[i:i + READ_CHUNK_CHARS] for i in range(0, len(text), READ_CHUNK_CHARS))
+
+
+# ---------------------------------------------------------------------------
+# Pass 1: hash, vocab and counts
+# ---------------------------------------------------------------------------
+
+def _scan(chunks: Chunks) -> Dict:
+    sha     = hashlib.sha256()
+    chars   = set()
+    preview = ''
+    char_count = word_count = 0
+    prev_in_word = False
+    for chunk in chunks():
+        sha.update(_encode_utf8(chunk))
+        chars.update(chunk)
+        char_count += len(chunk)
+        word_count += len(chunk.split())
+        # A word split across two chunks was counted twice
+        if prev_in_word and not chunk[0].isspace():
+            word_count -= 1
+        prev_in_word = not chunk[-1].isspace()
+        if len(preview) < PREVIEW_CHARS:
+            preview += chunk[:PREVIEW_CHARS - len(preview)]
+    return {
+        'key':        sha.hexdigest(),
+        'vocab':      sorted(chars),
+        'char_count': char_count,
+        'word_count': word_count,
+        'preview':    preview,
+    }
+
+
+def scan_file(path: str) -> Dict:
+    """Hash, vocab, char / word counts and preview of a .txt file, streamed."""
+    return _scan(lambda: iter_text_chunks(path))
+
+
+# ---------------------------------------------------------------------------
+# Pass 2: encode into shard files
+# ---------------------------------------------------------------------------
+
+def _shard_name(i: int) -> str:
+    return f'shard-{i:05d}.tokens'
+
+
+def _write_shards(chunks: Chunks, tokenizer, dtype, directory: str) -> List[int]:
+    """Encode the chunks into shard files of SHARD_TOKENS tokens; returns shard lengths."""
+    lengths: List[int] = []
+    f = None
+    try:
+        for chunk in word_aligned(chunks()):
+            tokens = tokenizer.encode(chunk).astype(dtype)
+            while tokens.size:
+                if f is None or lengths[-1] == SHARD_TOKENS:
+                    if f is not None:
+                        f.close()
+                    f = open(os.path.join(directory, _shard_name(len(lengths))), 'wb')
+                    lengths.append(0)
+                take = min(SHARD_TOKENS - lengths[-1], tokens.size)
+                f.write(tokens[:take].tobytes())
+                lengths[-1] += take
+                tokens = tokens[take:]
+    finally:
+        if f is not None:
+            f.close()
+    return lengths
+
+
+def _read_meta(directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get('version') != CACHE_VERSION:
+        return None
+    return meta
+
+
+def _cache_name(key: str, tokenizer: str, bpe_vocab_size: int) -> str:
+    if tokenizer == 'char':
+        return key
+    if tokenizer == 'bpe':
+        return f'{key}-bpe{bpe_vocab_size}'
+    raise ValueError(f'Unknown tokenizer: {tokenizer}')
+
+
+def _train_sample(chunks: Chunks) -> Iterable[str]:
+    seen = 0
+    for chunk in word_aligned(chunks()):
+        if seen >= BPE_TRAIN_CHARS:
+            return
+        yield chunk
+        seen += len(chunk)
+
+
+def _ingest(chunks: Chunks, cache_dir: str, tokenizer: str, bpe_vocab_size: int) -> Dict:
+    scan = _scan(chunks)
+    name = _cache_name(scan['key'], tokenizer, bpe_vocab_size)
+    directory = os.path.join(cache_dir, name)
+    meta = _read_meta(directory)
+    if meta is not None:
+        return meta
+
+    if tokenizer == 'bpe':
+        tok = BPETokenizer.train(_train_sample(chunks), bpe_vocab_size)
+    else:
+        tok = CharTokenizer(scan['vocab'])
+    dtype = _NUMPY_DTYPES[token_dtype(len(tok))]
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = f'{directory}.{os.getpid()}.{uuid.uuid4().hex}.tmp'
+    os.makedirs(tmp)
+    try:
+        shards = _write_shards(chunks, tok, dtype, tmp)
+        meta = {
+            'version':    CACHE_VERSION,
+            'key':        scan['key'],
+            'name':       name,
+            'tokenizer':  tok.spec,
+            'vocab':      scan['vocab'],   # the corpus's characters, whatever the tokenizer
+            'dtype':      np.dtype(dtype).str,
+            'shards':     shards,
+            'num_tokens': sum(shards),
+            'char_count': scan['char_count'],
+            'word_count': scan['word_count'],
+            'preview':    scan['preview'],
+        }
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        if os.path.isdir(directory):
+            shutil.rmtree(directory)   # written by an older cache version
+        os.rename(tmp, directory)
+    except OSError:
+        # Lost a race with another session writing the same corpus
+        meta = _read_meta(directory)
+        if meta is None:
+            raise
+    finally:
+        if os.path.isdir(tmp):
+            shutil.rmtree(tmp, ignore_errors=True)
+    return meta
+
+
+def ingest_text(
+    text: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    tokenizer: str = 'char',
+    bpe_vocab_size: int = DEFAULT_BPE_VOCAB_SIZE,
+) -> Dict:
+    """Tokenize `text` into the cache (no-op if already there); returns its meta."""
+    return _ingest(_text_chunks(text), cache_dir, tokenizer, bpe_vocab_size)
+
+
+def ingest_file(
+    path: str,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    tokenizer: str = 'char',
+    bpe_vocab_size: int = DEFAULT_BPE_VOCAB_SIZE,
+) -> Dict:
+    """ingest_text for a .txt file, streamed in chunks rather than read whole."""
+    return _ingest(lambda: iter_text_chunks(path), cache_dir, tokenizer, bpe_vocab_size)
+
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+
+def load_tokens(meta: Dict, cache_dir: str = DEFAULT_CACHE_DIR) -> TokenData:
+    """Memory-map a cached corpus: a tensor for one shard, else ShardedTokens."""
+    dtype = np.dtype(meta['dtype'])
+    directory = os.path.join(cache_dir, meta.get('name', meta['key']))
+    shards = [
+        # Copy-on-write: pages stay shared with every other session on this corpus
+        torch.from_numpy(np.memmap(os.path.join(directory, _shard_name(i)),
+                                   dtype=dtype, mode='c', shape=(length,)))
+        for i, length in enumerate(meta['shards'])
+    ]
+    if not shards:
+        return torch.from_numpy(np.empty(0, dtype=dtype))
+    if len(shards) == 1:
+        return shards[0]
+    return ShardedTokens(shards)
+
+
+def _dataset(meta: Dict, tokens: TokenData, val_fraction: float) -> Dict:
+    if 'tokenizer' in meta:
+        tokenizer = tokenizer_from_spec(meta['tokenizer'])
+    else:
+        tokenizer = CharTokenizer(meta['vocab'])   # written before BPE mode
+    n = int(len(tokens) * (1.0 - val_fraction))
+    return {
+        'tokenizer':    tokenizer,
+        'vocab':        tokenizer.vocab,
+        'char_to_idx':  tokenizer.char_to_idx,
+        'idx_to_char':  tokenizer.idx_to_char,
+        'vocab_size':   len(tokenizer),
+        'train_data':   tokens[:n],
+        'val_data':     tokens[n:],
+        'char_count':   meta['char_count'],
+        'word_count':   meta['word_count'],
+        'preview':      meta['preview'],
+    }
+
+
+def _in_memory_dataset(text: str, block_size: int, val_fraction: float,
+                       tokenizer: str, bpe_vocab_size: int) -> Dict:
+    ds = prepare_dataset(text, block_size, val_fraction, tokenizer, bpe_vocab_size)
+    ds['preview'] = text[:PREVIEW_CHARS]
+    return ds
+
+
+def prepare_cached_dataset(
+    text: str,
+    block_size: int = 64,
+    val_fraction: float = 0.1,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    tokenizer: str = 'char',
+    bpe_vocab_size: int = DEFAULT_BPE_VOCAB_SIZE,
+) -> Dict:
+    """
+    prepare_dataset() backed by the corpus cache.
+
+    train_data / val_data are views of the memory-mapped tokens.  If the
+    cache directory is not writable the corpus is tokenized in memory.
+    """
+    try:
+        meta = ingest_text(text, cache_dir, tokenizer, bpe_vocab_size)
+        tokens = load_tokens(meta, cache_dir)
+    except OSError:
+        return _in_memory_dataset(text, block_size, val_fraction, tokenizer, bpe_vocab_size)
+    return _dataset(meta, tokens, val_fraction)
+
+
+def prepare_cached_file_dataset(
+    path: str,
+    block_size: int = 64,
+    val_fraction: float = 0.1,
+    cache_dir: str = DEFAULT_CACHE_DIR,
+    tokenizer: str = 'char',
+    bpe_vocab_size: int = DEFAULT_BPE_VOCAB_SIZE,
+) -> Dict:
+    """
+    prepare_cached_dataset for a .txt file, ingested in streaming chunks.
+
+    Without a writable cache the file is read whole and tokenized in memory.
+    """
+    try:
+        meta = ingest_file(path, cache_dir, tokenizer, bpe_vocab_size)
+        tokens = load_tokens(meta, cache_dir)
+    except OSError:
+        text = load_text_from_file(path)
+        return _in_memory_dataset(text, block_size, val_fraction, tokenizer, bpe_vocab_size)
+    return _dataset(meta, tokens, val_fraction)
@@ -0,0 +1,97 @@
+"""
+dataset_catalogue.py — Cached metadata for dataset files.
+
+GET /api/datasets used to read every bundled file and recompute its vocab
+and word count on each request.  The catalogue computes that metadata once
+per file (streaming, via corpus_cache.scan_file) and keeps it in memory,
+persisted as a small JSON index so restarts are instant too:
+
+    {"version": 1, "files": {"<abs path>": {"mtime_ns", "size", "meta"}}}
+
+An entry is reused while the file's mtime and size are unchanged.  User
+uploads are recorded with the metadata produced when they were ingested,
+so they never need a second scan.
+
+Public API
+----------
+DatasetCatalogue(index_path)
+    .metadata(path)          →  {char_count, word_count, vocab_size, preview}
+    .record(path, corpus)    →  store metadata from a corpus_cache meta
+    .forget(path)
+"""
+
+import json
+import os
+import uuid
+from typing import Dict
+
+from corpus_cache import scan_file
+
+INDEX_VERSION = 1
+
+
+def _stat(path: str) -> Dict:
+    st = os.stat(path)
+    return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+def _summary(corpus: Dict) -> Dict:
+    return {
+        'char_count': corpus['char_count'],
+        'word_count': corpus['word_count'],
+        'vocab_size': len(corpus['vocab']),
+        'preview':    corpus['preview'],
+    }
+
+
+class DatasetCatalogue:
+    """Per-file dataset metadata, invalidated by mtime / size."""
+
+    def __init__(self, index_path: str):
+        self._index_path = index_path
+        self._files: Dict[str, Dict] = self._load()
+
+    def metadata(self, path: str) -> Dict:
+        """Metadata for a .txt dataset file; scans it only if it changed."""
+        path = os.path.abspath(path)
+        stat = _stat(path)
+        entry = self._files.get(path)
+        if entry is None or entry['mtime_ns'] != stat['mtime_ns'] or entry['size'] != stat['size']:
+            entry = {**stat, 'meta': _summary(scan_file(path))}
+            self._files[path] = entry
+            self._save()
+        return entry['meta']
+
+    def record(self, path: str, corpus: Dict) -> None:
+        """Store metadata for `path` computed elsewhere (e.g. at upload ingest)."""
+        path = os.path.abspath(path)
+        self._files[path] = {**_stat(path), 'meta': _summary(corpus)}
+        self._save()
+
+    def forget(self, path: str) -> None:
+        if self._files.pop(os.path.abspath(path), None) is not None:
+            self._save()
+
+    # ── persistence ────────────────────────────────────────────────────────
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if index.get('version') != INDEX_VERSION:
+            return {}
+        return index.get('files', {})
+
+    def _save(self) -> None:
+        tmp = f'{self._index_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': INDEX_VERSION, 'files': self._files}, f)
+            os.replace(tmp, self._index_path)
+        except OSError:
+            pass   # the index is only a cache; keep serving from memory
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
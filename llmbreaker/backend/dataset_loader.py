@@ -1,27 +1,39 @@
 """
-Dataset loader: character-level tokenisation, train/val split, batch generation.
+Dataset loader: tokenisation (character-level, or optional byte-level BPE),
+train/val split, batch generation.
 
 Public API
 ----------
 load_dataset(name, datasets_dir)   →  str           pre-bundled dataset
+bundled_dataset_path(name, dir)    →  str           path of a pre-bundled dataset
 load_from_file(path)               →  str           user .txt / .docx upload
 load_from_text(text)               →  str           pasted text (identity, validated)
+iter_text_chunks(path)             →  Iterator[str] streaming read of a .txt file
 
 build_vocab(text)                  →  vocab, char_to_idx, idx_to_char
-encode(text, char_to_idx)          →  List[int]
-decode(indices, idx_to_char)       →  str
-
-train_val_split(encoded)           →  (train, val) tensors
+build_tokenizer(text, kind)        →  CharTokenizer / BPETokenizer trained on text
+encode(text, char_to_idx)          →  List[int]      (either argument may also be a
+decode(indices, idx_to_char)       →  str             tokenizer; use one for bulk use)
+
+token_dtype(vocab_size)            →  smallest torch dtype for the token ids
+train_val_split(encoded)           →  (train, val) compact tensors
+ShardedTokens(shards)              →  one token sequence over several shard tensors
+strided_windows(data, block_size)  →  (n, block_size + 1) view, no copy
+window_rows(data, ix, block_size)  →  (len(ix), block_size + 1) gathered windows
+BatchSampler(data, block_size, …)  →  .sample() → (x, y), one gather per batch
 get_batch(data, block_size, ...)   →  (x, y) tensors
 
-prepare_dataset(text)              →  full dict (used by trainer.py)
+prepare_dataset(text, tokenizer)   →  full dict, in memory (trainer.py goes through
+                                      corpus_cache, which streams and caches)
 dataset_metadata(text)             →  {char_count, word_count, vocab_size}
 """
 
 import os
 import random
 import torch
-from typing import Dict, List, Tuple
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from tokenizer import DEFAULT_BPE_VOCAB_SIZE, BPETokenizer, CharTokenizer
 
 
 # ---------------------------------------------------------------------------
@@ -43,14 +55,34 @@ def build_vocab(text: str) -> Tuple[List[str], Dict[str, int], Dict[int, str]]:
     return vocab, char_to_idx, idx_to_char
 
 
-def encode(text: str, char_to_idx: Dict[str, int]) -> List[int]:
-    """Map each character to its index; skip unknown chars."""
-    return [char_to_idx[ch] for ch in text if ch in char_to_idx]
+def build_tokenizer(
+    text: str,
+    kind: str = 'char',
+    vocab_size: int = DEFAULT_BPE_VOCAB_SIZE,
+):
+    """
+    Tokenizer for `text`: its character vocab ('char'), or byte-level BPE
+    merges learned from it up to `vocab_size` tokens ('bpe').
+    """
+    if kind == 'char':
+        return CharTokenizer(build_vocab(text)[0])
+    if kind == 'bpe':
+        return BPETokenizer.train([text], vocab_size)
+    raise ValueError(f'Unknown tokenizer: {kind}')
+
+
+def encode(text: str, char_to_idx) -> List[int]:
+    """Map each character (or BPE token) to its index; skip unknown chars."""
+    if isinstance(char_to_idx, dict):
+        char_to_idx = CharTokenizer.from_char_to_idx(char_to_idx)
+    return char_to_idx.encode(text).tolist()
 
 
-def decode(indices: List[int], idx_to_char: Dict[int, str]) -> str:
-    """Map indices back to a string."""
-    return ''.join(idx_to_char.get(i, '') for i in indices)
+def decode(indices: List[int], idx_to_char) -> str:
+    """Map indices back to a string; skip unknown indices."""
+    if isinstance(idx_to_char, dict):
+        idx_to_char = CharTokenizer([idx_to_char[i] for i in range(len(idx_to_char))])
+    return idx_to_char.decode(indices)
 
 
 # ---------------------------------------------------------------------------
@@ -70,11 +102,27 @@ def load_text_from_docx(path: str) -> str:
     return '\n'.join(p.text for p in doc.paragraphs)
 
 
-def load_dataset(
-    name: str,
-    datasets_dir: str,
-) -> str:
-    """Load a pre-bundled dataset by name (shakespeare / poems / childrens)."""
+# Characters per read when streaming a corpus from disk
+READ_CHUNK_CHARS = 1 << 22
+
+
+def iter_text_chunks(path: str, chunk_chars: int = READ_CHUNK_CHARS) -> Iterator[str]:
+    """
+    Stream a .txt file in chunks of decoded text.
+
+    Decoding and newline handling match load_text_from_file, so the chunks
+    concatenate to exactly the string it would return.
+    """
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        while True:
+            chunk = f.read(chunk_chars)
+            if not chunk:
+                return
+            yield chunk
+
+
+def bundled_dataset_path(name: str, datasets_dir: str) -> str:
+    """Path of a pre-bundled dataset (shakespeare / poems / childrens / ...)."""
     filename_map = {
         'shakespeare': 'shakespeare.txt',
         'poems':       'poems.txt',
@@ -87,8 +135,15 @@ def load_dataset(
     filename = filename_map.get(name)
     if filename is None:
         raise ValueError(f'Unknown dataset: {name}')
-    path = os.path.join(datasets_dir, filename)
-    return load_text_from_file(path)
+    return os.path.join(datasets_dir, filename)
+
+
+def load_dataset(
+    name: str,
+    datasets_dir: str,
+) -> str:
+    """Load a pre-bundled dataset by name (shakespeare / poems / childrens)."""
+    return load_text_from_file(bundled_dataset_path(name, datasets_dir))
 
 
 def load_from_file(path: str) -> str:
@@ -129,14 +184,31 @@ def dataset_metadata(text: str) -> Dict:
 # Train / val split
 # ---------------------------------------------------------------------------
 
+def token_dtype(vocab_size: int) -> torch.dtype:
+    """
+    Smallest dtype that holds every token id: uint8 for character vocabs,
+    int16 (torch's indexable 2-byte type) up to 32768, int32 beyond.
+    Corpora are stored compact and widened to int64 per batch.
+    """
+    if vocab_size <= 256:
+        return torch.uint8
+    if vocab_size <= 32768:
+        return torch.int16
+    return torch.int32
+
+
 def train_val_split(
     encoded: List[int],
     val_fraction: float = 0.1,
+    vocab_size: Optional[int] = None,
 ) -> Tuple[torch.Tensor, torch.Tensor]:
-    """Split encoded data into train and val tensors (90/10 by default)."""
+    """Split encoded data into compact train and val tensors (90/10 by default)."""
+    if vocab_size is None:
+        vocab_size = max(encoded, default=0) + 1
+    dtype = token_dtype(vocab_size)
     n = int(len(encoded) * (1.0 - val_fraction))
-    train_data = torch.tensor(encoded[:n], dtype=torch.long)
-    val_data   = torch.tensor(encoded[n:], dtype=torch.long)
+    train_data = torch.tensor(encoded[:n], dtype=dtype)
+    val_data   = torch.tensor(encoded[n:], dtype=dtype)
     return train_data, val_data
 
 
@@ -144,8 +216,144 @@ def train_val_split(
 # Batch generation
 # ---------------------------------------------------------------------------
 
+class ShardedTokens:
+    """
+    One read-only token sequence stored as several shard tensors (typically
+    memory-mapped token files).  Supports len(), slicing and window gathers
+    that cross shard boundaries; a slice lying inside a single shard comes
+    back as a plain tensor view.
+    """
+
+    def __init__(self, shards: Sequence[torch.Tensor], start: int = 0,
+                 stop: Optional[int] = None):
+        self._shards  = list(shards)
+        lengths = torch.tensor([len(s) for s in self._shards], dtype=torch.long)
+        self._offsets = torch.cat([torch.zeros(1, dtype=torch.long), lengths.cumsum(0)])
+        total = int(self._offsets[-1])
+        self._start = start
+        self._stop  = total if stop is None else stop
+
+    @property
+    def dtype(self) -> torch.dtype:
+        return self._shards[0].dtype
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def __getitem__(self, key: slice) -> Union['ShardedTokens', torch.Tensor]:
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError('ShardedTokens supports contiguous slices only')
+        start, stop, _ = key.indices(len(self))
+        start, stop = self._start + start, self._start + max(start, stop)
+        first = int(torch.searchsorted(self._offsets, start, right=True)) - 1
+        if stop <= self._offsets[first + 1]:
+            base = int(self._offsets[first])
+            return self._shards[first][start - base:stop - base]
+        return ShardedTokens(self._shards, start, stop)
+
+    def gather_windows(self, ix: torch.Tensor, width: int) -> torch.Tensor:
+        """(len(ix), width) rows: row i is self[ix[i] : ix[i] + width]."""
+        positions = self._start + ix.unsqueeze(1) + torch.arange(width)
+        shard_ids = torch.searchsorted(self._offsets, positions, right=True) - 1
+        rows = torch.empty(positions.shape, dtype=self.dtype)
+        # One gather per shard touched (a batch rarely spans more than two)
+        for s in torch.unique(shard_ids).tolist():
+            mask = shard_ids == s
+            rows[mask] = self._shards[s][positions[mask] - self._offsets[s]]
+        return rows
+
+
+TokenData = Union[torch.Tensor, ShardedTokens]
+
+
+def _check_length(data: TokenData, block_size: int) -> int:
+    n = len(data) - block_size
+    if n <= 0:
+        raise ValueError(
+            f'Dataset too short ({len(data)} tokens) for block_size={block_size}. '
+            f'Need at least {block_size + 1} tokens.'
+        )
+    return n
+
+
+def window_rows(data: TokenData, ix: torch.Tensor, block_size: int) -> torch.Tensor:
+    """Rows data[i : i + block_size + 1] for every start i in `ix` (compact dtype)."""
+    if isinstance(data, ShardedTokens):
+        _check_length(data, block_size)
+        return data.gather_windows(ix, block_size + 1)
+    return strided_windows(data, block_size)[ix]
+
+
+def strided_windows(data: torch.Tensor, block_size: int) -> torch.Tensor:
+    """
+    (n, block_size + 1) view of every window of `data`, without copying.
+
+    Row i is data[i : i + block_size + 1]: the input is row[:-1] and the
+    target row[1:], so one gather of rows yields both halves of a batch.
+    """
+    _check_length(data, block_size)
+    return data.unfold(0, block_size + 1, 1)
+
+
+class BatchSampler:
+    """
+    Random (input, target) batches from one split.
+
+    Each batch is a single gather over the strided window view (or, for
+    sharded corpora, one gather per shard touched), widened from the
+    corpus' compact dtype to int64 for the model.  With `reuse_buffers` the
+    rows land in one preallocated int64 tensor, so a batch is only valid
+    until the next sample() call.
+    """
+
+    def __init__(
+        self,
+        data: TokenData,
+        block_size: int,
+        batch_size: int,
+        device: torch.device,
+        reuse_buffers: bool = False,
+        generator: Optional[torch.Generator] = None,
+    ):
+        self._data        = data
+        self._block_size  = block_size
+        self._num_windows = _check_length(data, block_size)
+        self._windows = None if isinstance(data, ShardedTokens) else strided_windows(data, block_size)
+        self._batch_size = batch_size
+        self._device     = device
+        self._generator  = generator
+        self._buffer = self.new_buffer() if reuse_buffers else None
+
+    def new_buffer(self) -> torch.Tensor:
+        """An empty int64 tensor shaped for one batch of rows (see gather's `out`)."""
+        return torch.empty((self._batch_size, self._block_size + 1), dtype=torch.long)
+
+    def sample(self, out: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        ix = torch.randint(self._num_windows, (self._batch_size,), generator=self._generator)
+        return self.gather(ix, out)
+
+    def gather(
+        self,
+        ix: torch.Tensor,
+        out: Optional[torch.Tensor] = None,
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        """Batch made of the windows starting at positions `ix` (rows land in `out`)."""
+        if out is None:
+            out = self._buffer
+        if len(ix) != self._batch_size:
+            out = None
+        if out is not None and self._windows is not None and self._windows.dtype == torch.long:
+            rows = torch.index_select(self._windows, 0, ix, out=out)
+        else:
+            rows = window_rows(self._data, ix, self._block_size)
+            # compact → int64, in place when there is a buffer
+            rows = out.copy_(rows) if out is not None else rows.long()
+        rows = rows.to(self._device)
+        return rows[:, :-1], rows[:, 1:]
+
+
 def get_batch(
-    data: torch.Tensor,
+    data: TokenData,
     block_size: int,
     batch_size: int,
     device: torch.device,
@@ -153,18 +361,11 @@ def get_batch(
     """
     Sample a random batch of (input, target) pairs.
 
-    Each target is the input shifted one position to the right.
+    Each target is the input shifted one position to the right.  For
+    repeated sampling from one split, BatchSampler avoids rebuilding the
+    window view on every call.
     """
-    n = len(data) - block_size
-    if n <= 0:
-        raise ValueError(
-            f'Dataset too short ({len(data)} tokens) for block_size={block_size}. '
-            f'Need at least {block_size + 1} tokens.'
-        )
-    ix = torch.randint(n, (batch_size,))
-    x  = torch.stack([data[i    : i + block_size    ] for i in ix])
-    y  = torch.stack([data[i + 1: i + block_size + 1] for i in ix])
-    return x.to(device), y.to(device)
+    return BatchSampler(data, block_size, batch_size, device).sample()
 
 
 # ---------------------------------------------------------------------------
@@ -175,20 +376,23 @@ def prepare_dataset(
     text: str,
     block_size: int = 64,
     val_fraction: float = 0.1,
+    tokenizer: str = 'char',
+    bpe_vocab_size: int = DEFAULT_BPE_VOCAB_SIZE,
 ) -> Dict:
     """
-    Full pipeline: text → vocab → encoded → train/val split.
+    Full pipeline: text → tokenizer → encoded → train/val split.
 
     Returns a dict with everything the trainer needs.
     """
-    vocab, char_to_idx, idx_to_char = build_vocab(text)
-    encoded = encode(text, char_to_idx)
-    train_data, val_data = train_val_split(encoded, val_fraction)
+    tok = build_tokenizer(text, tokenizer, bpe_vocab_size)
+    encoded = tok.encode(text).tolist()
+    train_data, val_data = train_val_split(encoded, val_fraction, vocab_size=len(tok))
     return {
-        'vocab':        vocab,
-        'char_to_idx':  char_to_idx,
-        'idx_to_char':  idx_to_char,
-        'vocab_size':   len(vocab),
+        'tokenizer':    tok,
+        'vocab':        tok.vocab,
+        'char_to_idx':  tok.char_to_idx,
+        'idx_to_char':  tok.idx_to_char,
+        'vocab_size':   len(tok),
         'train_data':   train_data,
         'val_data':     val_data,
         'char_count':   len(text),
@@ -0,0 +1,238 @@
+"""
+dataset_store.py — Content-addressed, ref-counted store for uploaded datasets.
+
+Each distinct upload is one entry, keyed by the corpus cache's content hash
+(corpus_cache.corpus_key), so uploading the same text twice yields the same
+dataset_id and a single file:
+
+    uploads/<key>.txt                the source text
+    corpus_cache/<key>/              its tokenized shards (the "hot" copy)
+    corpus_cache/<key>-bpe<n>/       ... and any BPE-tokenized copies
+
+Sessions acquire() the entry they train on and release() it when they are
+deleted.  The tokenized shards of all uploads are held under a byte budget
+(`max_cache_bytes`); when it is exceeded, the least recently used entries
+with no sessions are spilled: their shards are dropped and only the source
+text stays on disk.  The next session on a spilled entry re-ingests it from
+that text.  An entry referenced by any session is never spilled.
+
+Entries are persisted next to the uploads, so they survive a restart:
+
+    uploads/index.json   {"version": 1, "entries": {"<dataset_id>": {"key", "display_name", "cache_bytes"}}}
+
+On load, entries whose source text is gone are dropped, and any
+uploads/<key>.txt missing from the index (written before it existed, or
+lost with it) is re-registered, so no upload is left orphaned.
+
+Public API
+----------
+DatasetStore(uploads_dir, cache_dir, max_cache_bytes)
+    .add(filepath, corpus, display_name)   →  dataset_id  (dedupes by content)
+    .get(dataset_id)                       →  entry dict or None
+    .acquire(dataset_id, session_id)       →  path of the source .txt
+    .release(session_id)
+    .entries()                             →  {dataset_id: entry}
+    .stats()                               →  {'cache_bytes', 'max_cache_bytes', ...}
+"""
+
+import glob
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_MAX_CACHE_BYTES = 1 << 30   # 1 GB of tokenized uploads
+
+ID_PREFIX = 'user_'
+
+INDEX_NAME    = 'index.json'
+INDEX_VERSION = 1
+
+_UPLOAD_NAME = re.compile(r'^(?P<key>[0-9a-f]{64})\.txt$')
+
+
+def _cache_bytes(corpus: Dict) -> int:
+    return corpus['num_tokens'] * np.dtype(corpus['dtype']).itemsize
+
+
+def _dataset_id(key: str) -> str:
+    return ID_PREFIX + key[:32]
+
+
+class DatasetStore:
+    """Upload entries keyed by content hash, with session refs and a cache budget."""
+
+    def __init__(self, uploads_dir: str, cache_dir: str,
+                 max_cache_bytes: int = DEFAULT_MAX_CACHE_BYTES):
+        self.uploads_dir     = uploads_dir
+        self.cache_dir       = cache_dir
+        self.max_cache_bytes = max_cache_bytes
+        self._index_path     = os.path.join(uploads_dir, INDEX_NAME)
+        self._entries: Dict[str, Dict] = self._load()
+        self._sessions: Dict[str, str] = {}   # session_id → dataset_id
+        self.spilled = 0
+        self._enforce_budget()
+
+    def add(self, filepath: str, corpus: Dict, display_name: str) -> str:
+        """
+        Register an ingested upload.  The file is moved to its content-
+        addressed path, or deleted if that content is already stored.
+        """
+        key = corpus['key']
+        dataset_id = _dataset_id(key)
+        path = os.path.join(self.uploads_dir, f'{key}.txt')
+        if os.path.exists(path):
+            os.remove(filepath)
+        else:
+            os.replace(filepath, path)
+
+        entry = self._entries.get(dataset_id)
+        if entry is None:
+            entry = self._entries[dataset_id] = self._new_entry(
+                key, display_name, _cache_bytes(corpus))
+        else:
+            entry['display_name'] = display_name
+        entry['last_used'] = time.monotonic()
+        self._save()
+        self._enforce_budget()
+        return dataset_id
+
+    def get(self, dataset_id: str) -> Optional[Dict]:
+        return self._entries.get(dataset_id)
+
+    def __contains__(self, dataset_id: str) -> bool:
+        return dataset_id in self._entries
+
+    def entries(self) -> Dict[str, Dict]:
+        return dict(self._entries)
+
+    # ── session refs ───────────────────────────────────────────────────────
+
+    def acquire(self, dataset_id: str, session_id: str) -> str:
+        """Pin the entry for `session_id`; returns the source file path."""
+        self.release(session_id)
+        entry = self._entries[dataset_id]
+        entry['sessions'].add(session_id)
+        entry['last_used'] = time.monotonic()
+        self._sessions[session_id] = dataset_id
+        return entry['filepath']
+
+    def release(self, session_id: str) -> None:
+        dataset_id = self._sessions.pop(session_id, None)
+        if dataset_id is None:
+            return
+        entry = self._entries.get(dataset_id)
+        if entry is not None:
+            entry['sessions'].discard(session_id)
+            entry['last_used'] = time.monotonic()
+        self._enforce_budget()
+
+    # ── cache budget ───────────────────────────────────────────────────────
+
+    def _cache_paths(self, entry: Dict) -> List[str]:
+        base = os.path.join(self.cache_dir, entry['key'])
+        return [p for p in [base, *glob.glob(base + '-*')] if os.path.isdir(p)]
+
+    def _is_cached(self, entry: Dict) -> bool:
+        # Sessions re-ingest spilled entries, so check rather than track
+        return bool(self._cache_paths(entry))
+
+    def _cached(self) -> Dict[str, Dict]:
+        return {did: e for did, e in self._entries.items() if self._is_cached(e)}
+
+    def _enforce_budget(self) -> None:
+        cached = self._cached()
+        total  = sum(e['cache_bytes'] for e in cached.values())
+        idle   = sorted((e for e in cached.values() if not e['sessions']),
+                        key=lambda e: e['last_used'])
+        for entry in idle:
+            if total <= self.max_cache_bytes:
+                break
+            for path in self._cache_paths(entry):
+                shutil.rmtree(path, ignore_errors=True)
+            total -= entry['cache_bytes']
+            self.spilled += 1
+
+    def stats(self) -> Dict:
+        cached = self._cached()
+        return {
+            'entries':         len(self._entries),
+            'cached_entries':  len(cached),
+            'cache_bytes':     sum(e['cache_bytes'] for e in cached.values()),
+            'max_cache_bytes': self.max_cache_bytes,
+            'pinned_entries':  sum(1 for e in self._entries.values() if e['sessions']),
+            'spilled':         self.spilled,
+        }
+
+    # ── persistence ────────────────────────────────────────────────────────
+
+    def _new_entry(self, key: str, display_name: str, cache_bytes: int) -> Dict:
+        return {
+            'key':          key,
+            'filepath':     os.path.join(self.uploads_dir, f'{key}.txt'),
+            'display_name': display_name,
+            'cache_bytes':  cache_bytes,
+            'sessions':     set(),
+            'last_used':    time.monotonic(),
+        }
+
+    def _orphan_cache_bytes(self, key: str, filepath: str) -> int:
+        """Shard bytes of an upload found without an index entry."""
+        try:
+            with open(os.path.join(self.cache_dir, key, 'meta.json'), 'r', encoding='utf-8') as f:
+                return _cache_bytes(json.load(f))
+        except (OSError, ValueError, KeyError, TypeError):
+            return os.path.getsize(filepath)   # ~1 byte per char-level token
+
+    def _load(self) -> Dict[str, Dict]:
+        try:
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            index = {}
+        saved = index.get('entries', {}) if index.get('version') == INDEX_VERSION else {}
+
+        entries: Dict[str, Dict] = {}
+        for dataset_id, saved_entry in saved.items():
+            entry = self._new_entry(saved_entry['key'], saved_entry['display_name'],
+                                    saved_entry['cache_bytes'])
+            if os.path.exists(entry['filepath']):
+                entries[dataset_id] = entry
+        try:
+            names = os.listdir(self.uploads_dir)
+        except OSError:
+            names = []
+        for name in sorted(names):
+            m = _UPLOAD_NAME.match(name)
+            if m is None or _dataset_id(m.group('key')) in entries:
+                continue
+            key = m.group('key')
+            filepath = os.path.join(self.uploads_dir, name)
+            entries[_dataset_id(key)] = self._new_entry(
+                key, 'Uploaded text', self._orphan_cache_bytes(key, filepath))
+        return entries
+
+    def _save(self) -> None:
+        index = {
+            dataset_id: {
+                'key':          entry['key'],
+                'display_name': entry['display_name'],
+                'cache_bytes':  entry['cache_bytes'],
+            }
+            for dataset_id, entry in self._entries.items()
+        }
+        tmp = f'{self._index_path}.{uuid.uuid4().hex}.tmp'
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump({'version': INDEX_VERSION, 'entries': index}, f)
+            os.replace(tmp, self._index_path)
+        except OSError:
+            pass   # entries not in the index are rebuilt from uploads/ on load
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
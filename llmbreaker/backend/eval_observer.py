@@ -0,0 +1,141 @@
+"""
+eval_observer.py — Runs eval-interval work beside the training loop.
+
+At each eval step the training loop hands over a cheap copy of the weights
+and carries on.  A background task loads the snapshot into a private model,
+computes the artifacts (loss estimate, sample, embeddings, attention) on a
+native worker thread so neither the eventlet hub nor the training loop
+waits, then publishes the results tagged with the step they came from.
+
+Stale work: at most `max_pending` snapshots wait in the queue.  When the
+observer falls behind, the oldest waiting snapshot is dropped (never the
+one being computed) — the UI wants the freshest picture, and the loss
+history simply gets coarser spacing.
+
+The queue and busy flag are guarded by a Condition: in a training worker
+the observer runs on a real OS thread beside the training loop (under the
+server's monkey-patched eventlet the same Condition is green).
+"""
+
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+import torch
+
+
+def _offload(fn: Callable, *args):
+    """
+    Run `fn` on a native thread under eventlet, so the hub keeps serving.
+
+    Without monkey-patching (e.g. inside a training worker process) the
+    observer already runs on its own OS thread, so `fn` is called directly.
+    """
+    try:
+        from eventlet import patcher, tpool
+    except ImportError:
+        return fn(*args)
+    if not patcher.is_monkey_patched('thread'):
+        return fn(*args)
+    return tpool.execute(fn, *args)
+
+
+class EvalObserver:
+    """
+    Asynchronous eval pipeline for one training session.
+
+        model_factory() → fresh model with the session's config (built once)
+        compute(model, job) → result        runs off the hub, on the snapshot
+        publish(job, result)                runs on the hub, emits / records
+        on_error(job, exc)                  optional, called if compute fails
+
+    `job` is the dict passed to submit() plus 'step'.
+    """
+
+    def __init__(
+        self,
+        socketio: Any,
+        model_factory: Callable[[], torch.nn.Module],
+        compute: Callable[[torch.nn.Module, Dict], Any],
+        publish: Callable[[Dict, Any], None],
+        on_error: Optional[Callable[[Dict, Exception], None]] = None,
+        max_pending: int = 1,
+    ):
+        self._socketio      = socketio
+        self._model_factory = model_factory
+        self._compute       = compute
+        self._publish       = publish
+        self._on_error      = on_error
+        self._max_pending   = max(1, max_pending)
+
+        self._queue: deque = deque()
+        self._cond   = threading.Condition()
+        self._model: Optional[torch.nn.Module] = None
+        self._busy   = False
+        self._closed = False
+
+        # Counters (for logging / debugging)
+        self.submitted = 0
+        self.completed = 0
+        self.dropped   = 0
+
+    def start(self) -> None:
+        self._socketio.start_background_task(self._run)
+
+    def submit(self, step: int, model: torch.nn.Module, **extra) -> None:
+        """Snapshot `model`'s weights for evaluation at `step`."""
+        state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+        with self._cond:
+            if len(self._queue) >= self._max_pending:
+                self._queue.popleft()
+                self.dropped += 1
+            self._queue.append({'step': step, 'state': state, **extra})
+            self.submitted += 1
+            self._cond.notify_all()
+
+    def drain(self, poll: float = 0.02) -> None:
+        """Wait until every queued snapshot has been published."""
+        with self._cond:
+            while self._queue or self._busy:
+                self._cond.wait(poll)
+
+    def close(self, drain: bool = True) -> None:
+        """Stop the worker, optionally finishing queued work first."""
+        if drain:
+            self.drain()
+        with self._cond:
+            if not drain:
+                self._queue.clear()
+            self._closed = True
+            self._cond.notify_all()
+
+    # ── worker ─────────────────────────────────────────────────────────────
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue:
+                    if self._closed:
+                        return
+                    self._cond.wait(0.02)
+                # Popped and marked busy together, so drain() never sees neither
+                job = self._queue.popleft()
+                self._busy = True
+            try:
+                result = _offload(self._evaluate, job)
+                self._publish(job, result)
+                self.completed += 1
+            except Exception as e:
+                if self._on_error:
+                    self._on_error(job, e)
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _evaluate(self, job: Dict) -> Any:
+        if self._model is None:
+            self._model = self._model_factory()
+        self._model.load_state_dict(job['state'])
+        self._model.eval()
+        return self._compute(self._model, job)
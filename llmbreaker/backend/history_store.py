@@ -0,0 +1,253 @@
+"""
+history_store.py — Bounded per-session history of training metrics.
+
+A session's loss curve, generated samples and eval frames (attention
+matrices, embedding coordinates, token probabilities) live here instead of
+in unbounded lists, so long runs hold a fixed amount of memory and a client
+that joins mid-run can be replayed what it missed:
+
+    loss points     up to max_points; when full, compacted with LTTB to half
+                    of that, after which every stored point stands for twice
+                    as many evals (the LTTB pick of each group), so the curve
+                    keeps its shape at evenly lower resolution
+    samples         the last max_samples (ring buffer)
+    eval frames     the most recent frames within max_frame_bytes (ring buffer
+                    by size); matrices are stored as float16, the precision
+                    the binary wire format sends anyway
+
+Replay: loss_curve(n) downsamples the stored curve to n points with LTTB
+(largest-triangle-three-buckets, over train and val loss together), so a
+50k-step run replays as a few hundred points; frames(after_step, limit)
+pages through the stored frames, oldest first, for the timeline.
+
+Public API
+----------
+HistoryStore(max_points, max_samples, max_frame_bytes)
+    .record_metrics(step, train_loss, val_loss)
+    .record_sample(step, text, prompt)
+    .record_attention(step, layer, head, matrix, tokens)
+    .record_embedding(step, coords, labels)
+    .record_token_probs(step, probs)   probs: token_probabilities payload fields
+    .last_metrics                   →  latest loss point or None
+    .loss_curve(max_points)         →  [{step, train_loss, val_loss}]  (LTTB)
+    .samples(limit)                 →  latest samples, oldest first
+    .frame_steps()                  →  steps that have a stored eval frame
+    .frames(after_step, limit)      →  JSON-ready frames, oldest first
+lttb_indices(x, ys, n_out)          →  indices of the points LTTB keeps
+"""
+
+from collections import deque
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+DEFAULT_MAX_POINTS      = 10_000
+DEFAULT_MAX_SAMPLES     = 200
+DEFAULT_MAX_FRAME_BYTES = 64 * 1024 * 1024
+DEFAULT_REPLAY_POINTS   = 300
+
+_TOKEN_PROB_FIELDS = ('tokens', 'probs', 'logits', 'generated_token', 'temperature')
+
+
+def lttb_indices(x: np.ndarray, ys: np.ndarray, n_out: int) -> np.ndarray:
+    """
+    Largest-triangle-three-buckets over one or more series sharing `x`.
+
+    ys is (k, n); a point's triangle area is summed over the k series, so a
+    spike in any of them is kept.  Always keeps the first and last point.
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    ys = np.atleast_2d(ys)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(int)   # n_out - 2 buckets
+    keep = [0]
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], max(edges[i + 1], edges[i] + 1)
+        nlo = hi
+        nhi = max(edges[i + 2] if i + 2 < len(edges) else n, nlo + 1)
+        a = lo + _largest_triangle(x, ys, a, lo, hi, nlo, nhi)
+        keep.append(a)
+    keep.append(n - 1)
+    return np.asarray(keep)
+
+
+def _largest_triangle(x, ys, a, lo, hi, nlo, nhi) -> int:
+    """Offset in [lo, hi) of the point forming the largest triangle with
+    point `a` and the mean of [nlo, nhi)."""
+    avg_x = x[nlo:nhi].mean()
+    avg_y = ys[:, nlo:nhi].mean(axis=1, keepdims=True)
+    area = np.abs(
+        (x[a] - avg_x) * (ys[:, lo:hi] - ys[:, a:a + 1])
+        - (x[a] - x[lo:hi]) * (avg_y - ys[:, a:a + 1])
+    ).sum(axis=0)
+    return int(np.argmax(area))
+
+
+def _as_f16(values: Any) -> np.ndarray:
+    return np.asarray(values, dtype=np.float16)
+
+
+def _frame_bytes(frame: Dict) -> int:
+    size = sum(h['matrix'].nbytes for h in frame['attention'].values())
+    if frame['embedding'] is not None:
+        size += frame['embedding']['coords'].nbytes
+    return size
+
+
+class HistoryStore:
+    """Bounded loss curve, samples and eval frames for one session."""
+
+    def __init__(
+        self,
+        max_points: int = DEFAULT_MAX_POINTS,
+        max_samples: int = DEFAULT_MAX_SAMPLES,
+        max_frame_bytes: int = DEFAULT_MAX_FRAME_BYTES,
+    ):
+        self.max_points      = max(4, max_points)
+        self.max_frame_bytes = max_frame_bytes
+        self._steps: List[int]   = []
+        self._train: List[float] = []
+        self._val:   List[float] = []
+        self._stride  = 1      # evals per stored point; doubles on each compaction
+        self._pending: List[tuple] = []
+        self._last: Optional[Dict] = None
+        self._samples: deque = deque(maxlen=max_samples)
+        self._frames:  deque = deque()
+        self._frame_bytes = 0
+
+    # ── loss curve ─────────────────────────────────────────────────────────
+
+    def record_metrics(self, step: int, train_loss: float, val_loss: float) -> None:
+        if self._last is not None and self._last['step'] == step:
+            return
+        self._last = {'step': step, 'train_loss': float(train_loss), 'val_loss': float(val_loss)}
+        self._pending.append((step, float(train_loss), float(val_loss)))
+        if len(self._pending) < self._stride:
+            return
+        self._commit(self._pending)
+        self._pending = []
+        if len(self._steps) > self.max_points:
+            # Halve the curve; from now on each stored point stands for twice
+            # as many evals, so the stored points stay evenly spread
+            keep = lttb_indices(*self._arrays(), self.max_points // 2).tolist()
+            self._steps = [self._steps[i] for i in keep]
+            self._train = [self._train[i] for i in keep]
+            self._val   = [self._val[i] for i in keep]
+            self._stride *= 2
+
+    def _commit(self, bucket: List[tuple]) -> None:
+        """Store the point of `bucket` LTTB would keep (next bucket: its own mean)."""
+        point = bucket[0]
+        if len(bucket) > 1 and self._steps:
+            arr = np.asarray([(self._steps[-1], self._train[-1], self._val[-1]), *bucket])
+            n = len(arr)
+            point = bucket[_largest_triangle(arr[:, 0], arr[:, 1:].T, 0, 1, n, 1, n)]
+        self._steps.append(point[0])
+        self._train.append(point[1])
+        self._val.append(point[2])
+
+    def _arrays(self):
+        x = np.asarray(self._steps, dtype=np.float64)
+        return x, np.asarray([self._train, self._val], dtype=np.float64)
+
+    @property
+    def last_metrics(self) -> Optional[Dict]:
+        return self._last
+
+    def loss_curve(self, max_points: Optional[int] = DEFAULT_REPLAY_POINTS) -> List[Dict]:
+        """The loss curve, LTTB-downsampled to at most `max_points` (None = all)."""
+        points = list(zip(self._steps, self._train, self._val))
+        if self._last is not None and (not points or points[-1][0] != self._last['step']):
+            points.append(tuple(self._last.values()))   # end on the latest eval
+        if max_points is not None and len(points) > max_points:
+            x = np.asarray([p[0] for p in points], dtype=np.float64)
+            ys = np.asarray([[p[1] for p in points], [p[2] for p in points]], dtype=np.float64)
+            points = [points[i] for i in lttb_indices(x, ys, max_points)]
+        return [
+            {'step': step, 'train_loss': round(train, 4), 'val_loss': round(val, 4)}
+            for step, train, val in points
+        ]
+
+    # ── samples ────────────────────────────────────────────────────────────
+
+    def record_sample(self, step: int, text: str, prompt: str = '') -> None:
+        if self._samples and self._samples[-1]['step'] == step:
+            return
+        self._samples.append({'step': step, 'text': text, 'prompt': prompt})
+
+    def samples(self, limit: Optional[int] = None) -> List[Dict]:
+        """The latest `limit` samples (None = all), oldest first."""
+        samples = list(self._samples)
+        if limit is None:
+            return samples
+        return samples[-limit:] if limit > 0 else []
+
+    # ── eval frames ────────────────────────────────────────────────────────
+
+    def _frame(self, step: int) -> Dict:
+        """The frame for `step`, starting a new one if it is not the latest."""
+        if self._frames and self._frames[-1]['step'] == step:
+            return self._frames[-1]
+        frame = {'step': step, 'attention': {}, 'tokens': [],
+                 'embedding': None, 'token_probabilities': None}
+        self._frames.append(frame)
+        return frame
+
+    def _resize(self, frame: Dict, before: int) -> None:
+        self._frame_bytes += _frame_bytes(frame) - before
+        while self._frames and self._frame_bytes > self.max_frame_bytes:
+            self._frame_bytes -= _frame_bytes(self._frames.popleft())
+
+    def record_attention(self, step: int, layer: int, head: int,
+                         matrix: Any, tokens: Sequence[str]) -> None:
+        if self.max_frame_bytes <= 0:
+            return
+        frame = self._frame(step)
+        before = _frame_bytes(frame)
+        frame['attention'][(layer, head)] = {'layer': layer, 'head': head, 'matrix': _as_f16(matrix)}
+        frame['tokens'] = list(tokens)
+        self._resize(frame, before)
+
+    def record_embedding(self, step: int, coords: Any, labels: Sequence[str]) -> None:
+        if self.max_frame_bytes <= 0:
+            return
+        frame = self._frame(step)
+        before = _frame_bytes(frame)
+        frame['embedding'] = {'coords': _as_f16(coords), 'labels': list(labels)}
+        self._resize(frame, before)
+
+    def record_token_probs(self, step: int, probs: Dict) -> None:
+        if self.max_frame_bytes <= 0:
+            return
+        self._frame(step)['token_probabilities'] = {
+            key: probs[key].tolist() if isinstance(probs[key], np.ndarray) else probs[key]
+            for key in _TOKEN_PROB_FIELDS
+        }
+
+    def frame_steps(self) -> List[int]:
+        return [frame['step'] for frame in list(self._frames)]
+
+    def frames(self, after_step: int = -1, limit: int = 8) -> List[Dict]:
+        """
+        Up to `limit` stored frames with step > after_step, oldest first, as
+        plain lists.  Paging by step stays consistent while old frames are evicted.
+        """
+        page = [frame for frame in list(self._frames) if frame['step'] > after_step][:limit]
+        return [
+            {
+                'step': frame['step'],
+                'attention': [
+                    {'layer': h['layer'], 'head': h['head'], 'matrix': h['matrix'].tolist()}
+                    for h in frame['attention'].values()
+                ],
+                'tokens': frame['tokens'],
+                'embedding': frame['embedding'] and {
+                    'coords': frame['embedding']['coords'].tolist(),
+                    'labels': frame['embedding']['labels'],
+                },
+                'token_probabilities': frame['token_probabilities'],
+            }
+            for frame in page
+        ]
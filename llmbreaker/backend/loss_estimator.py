@@ -0,0 +1,87 @@
+"""
+loss_estimator.py — Train / val loss on a fixed evaluation set.
+
+The windows are chosen once per session (evenly spaced across each split),
+so every eval interval scores the model on exactly the same text and the
+curve moves only because the model changed.  Scoring runs as a handful of
+large no-grad forwards capped at `max_tokens` tokens each; per-split loss
+sums stay on-tensor and are read back with a single sync at the end.
+
+Public API
+----------
+EvalSet(data, block_size, num_windows)        fixed (x, y) windows for one split
+build_eval_sets(train, val, block_size, n)    {'train': EvalSet, 'val': EvalSet}
+estimate_loss(model, eval_sets, max_tokens)   {'train': float, 'val': float}
+"""
+
+from typing import Dict
+
+import torch
+
+from dataset_loader import TokenData, window_rows
+
+# Tokens per eval forward (bounds logits / activation memory)
+DEFAULT_MAX_TOKENS = 64 * 1024
+
+
+class EvalSet:
+    """`num_windows` fixed (input, target) windows from one split."""
+
+    def __init__(self, data: TokenData, block_size: int, num_windows: int):
+        n = max(1, len(data) - block_size)   # window_rows raises if data is too short
+        num_windows = max(1, min(num_windows, n))
+        starts = torch.linspace(0, n - 1, num_windows).long()
+        rows   = window_rows(data, starts, block_size).long()   # widened once, reused every interval
+        self.x = rows[:, :-1]
+        self.y = rows[:, 1:]
+
+    def __len__(self) -> int:
+        return self.x.shape[0]
+
+    @property
+    def num_tokens(self) -> int:
+        return self.x.numel()
+
+    def to(self, device: torch.device) -> 'EvalSet':
+        self.x = self.x.to(device)
+        self.y = self.y.to(device)
+        return self
+
+
+def build_eval_sets(
+    train_data: TokenData,
+    val_data:   TokenData,
+    block_size: int,
+    num_windows: int,
+    device: torch.device = torch.device('cpu'),
+) -> Dict[str, EvalSet]:
+    return {
+        'train': EvalSet(train_data, block_size, num_windows).to(device),
+        'val':   EvalSet(val_data,   block_size, num_windows).to(device),
+    }
+
+
+@torch.no_grad()
+def estimate_loss(
+    model: torch.nn.Module,
+    eval_sets: Dict[str, EvalSet],
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+) -> Dict[str, float]:
+    """Mean per-token cross-entropy of `model` on each eval set."""
+    was_training = model.training
+    model.eval()
+
+    sums = []
+    for eval_set in eval_sets.values():
+        rows  = max(1, max_tokens // eval_set.x.shape[1])
+        total = torch.zeros((), device=eval_set.x.device)
+        for i in range(0, len(eval_set), rows):
+            x, y = eval_set.x[i:i + rows], eval_set.y[i:i + rows]
+            _, loss = model(x, y)
+            total += loss * y.numel()
+        sums.append(total / eval_set.num_tokens)
+
+    if was_training:
+        model.train()
+    losses = torch.stack(sums).tolist()   # the only host sync
+    return dict(zip(eval_sets, losses))
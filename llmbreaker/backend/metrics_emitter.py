@@ -2,13 +2,25 @@
 Metrics emitter: converts model outputs → JSON and emits via Socket.IO.
 
 All emission goes through this module so throttling and serialisation
-stay in one place.  The socketio instance is passed in at call time to
-avoid circular imports.
+stay in one place; the training loop emits through a per-session
+EmitQueue.  The socketio instance is passed in at call time to
+avoid circular imports.  Float arrays (attention, embeddings, token
+probabilities) may be NumPy arrays and are packed per `wire_format`
+(see wire_format.py); attention and embedding frames may be delta-encoded
+against the previous frame (DeltaEncoder); DeltaDecoder rebuilds them for
+the server's own copy of a worker session's history.
 """
 
+import itertools
+import threading
 import time
+from collections import OrderedDict
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, Hashable, List, Optional
+
+import numpy as np
+
+from wire_format import pack_array, unpack_array
 
 
 def _ts() -> int:
@@ -16,23 +28,284 @@ def _ts() -> int:
 
 
 # ---------------------------------------------------------------------------
-# Rate limiter (max 30 emits / second across all event types)
+# Per-session emit queue
 # ---------------------------------------------------------------------------
 
-class _RateLimiter:
-    def __init__(self, max_per_second: float = 30.0):
-        self._interval = 1.0 / max_per_second
-        self._last     = 0.0
+# Events that only matter as "the latest value": a pending one is replaced
+# by a newer one (latest wins) and each goes out at most `rate` times / s.
+# Every other event is delivered, in order, and never dropped.
+COALESCED_EVENTS = frozenset({'step_progress'})
+DEFAULT_EMIT_RATE = 10.0   # coalesced emits per second, per event type
+
+
+class EmitQueue:
+    """
+    Buffers one session's emits so the training loop never waits on socket
+    writes.  Stands in for the socketio object passed to the emit_*
+    functions: emit() only enqueues, and a background task drains the queue
+    to the real socketio.  Anything else (sleep, start_background_task) is
+    forwarded unchanged.
+
+    Counters, see stats(): depth (pending events), sent, and dropped
+    (coalesced events superseded before they were sent).
+    """
+
+    def __init__(self, socketio: Any, rate: float = DEFAULT_EMIT_RATE,
+                 coalesced: frozenset = COALESCED_EVENTS):
+        self._socketio  = socketio
+        self._interval  = 1.0 / rate if rate > 0 else 0.0
+        self._coalesced = coalesced
+        self._pending: 'OrderedDict[Any, tuple]' = OrderedDict()
+        self._last_sent: Dict[str, float] = {}
+        self._seq     = itertools.count()
+        self._cond    = threading.Condition()
+        self._closed  = False
+        self._done    = threading.Event()
+        self.sent     = 0
+        self.dropped  = 0
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._socketio, name)
+
+    def start(self) -> 'EmitQueue':
+        self._socketio.start_background_task(self._drain)
+        return self
+
+    def emit(self, event: str, payload: Dict, room: Optional[str] = None) -> None:
+        with self._cond:
+            if event in self._coalesced:
+                # Latest wins, and moves to the back so order stays causal
+                if self._pending.pop(event, None) is not None:
+                    self.dropped += 1
+                self._pending[event] = (event, payload, room)
+            else:
+                self._pending[next(self._seq)] = (event, payload, room)
+            self._cond.notify()
+
+    def stats(self) -> Dict[str, int]:
+        with self._cond:
+            return {'depth': len(self._pending), 'sent': self.sent, 'dropped': self.dropped}
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Deliver everything still pending (coalesced events included), then stop."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._done.wait(timeout)
+
+    # ── drain ──────────────────────────────────────────────────────────────
+
+    def _next_ready(self) -> Optional[tuple]:
+        """Pop the first sendable event; None if all pending are rate-held."""
+        now = time.monotonic()
+        for key, item in self._pending.items():
+            event = item[0]
+            if (event in self._coalesced and not self._closed
+                    and now - self._last_sent.get(event, 0.0) < self._interval):
+                continue
+            del self._pending[key]
+            if event in self._coalesced:
+                self._last_sent[event] = now
+            return item
+        return None
 
-    def allow(self) -> bool:
+    def _wait_time(self) -> Optional[float]:
+        if not self._pending:
+            return None
         now = time.monotonic()
-        if now - self._last >= self._interval:
-            self._last = now
-            return True
-        return False
+        return max(0.0, min(self._last_sent.get(item[0], 0.0) + self._interval - now
+                            for item in self._pending.values()))
+
+    def _drain(self) -> None:
+        try:
+            while True:
+                with self._cond:
+                    item = self._next_ready()
+                    while item is None:
+                        if self._closed and not self._pending:
+                            return
+                        self._cond.wait(self._wait_time())
+                        item = self._next_ready()
+                event, payload, room = item
+                self._socketio.emit(event, payload, room=room)
+                self.sent += 1
+        finally:
+            self._done.set()
+
+
+# ---------------------------------------------------------------------------
+# Delta encoding of attention / embedding frames
+# ---------------------------------------------------------------------------
+
+KEYFRAME_INTERVAL = 10   # frames per stream between full keyframes
+
+
+class DeltaEncoder:
+    """
+    Keyframes plus quantized deltas, per stream (one attention head, or the
+    embedding cloud).  Each encoded frame adds to the payload
+
+        'frame': {'seq': n, 'key': True}                  + the full array under
+                                                            its usual field
+        'frame': {'seq': n, 'key': False, 'ref_seq': n-1} + 'delta': {shape, scale,
+                                                            values[, indices]}
+
+    A delta is (frame − what the client holds) quantized to int8 with one
+    scale per frame — sparse (uint32 indices + int8 values) when fewer than
+    a fifth of the entries changed, dense int8 otherwise.  The reference is
+    updated with the dequantized delta, exactly as the client applies it,
+    so quantization error never accumulates; keyframes reset it anyway.
+
+    Streams start with a keyframe and after every `keyframe_interval`
+    frames; reset() forces one on every stream (a client (re)joined).
+    frontend/src/utils/deltaDecoder.js rebuilds the full frames.
+    """
+
+    def __init__(self, wire_format: str = 'json', keyframe_interval: int = KEYFRAME_INTERVAL):
+        self._wire_format = wire_format
+        self._interval    = max(1, keyframe_interval)
+        self._refs: Dict[Hashable, np.ndarray] = {}
+        self._seqs: Dict[Hashable, int] = {}
+        self._since_key: Dict[Hashable, int] = {}
+
+    def reset(self) -> None:
+        self._refs.clear()
 
+    def encode(self, stream: Hashable, values: Any, field: str) -> Dict:
+        """Payload entries for the next frame of `stream` (array under `field` if key)."""
+        arr = np.asarray(values, dtype=np.float32)
+        seq = self._seqs.get(stream, -1) + 1
+        self._seqs[stream] = seq
+        ref = self._refs.get(stream)
 
-_limiter = _RateLimiter(max_per_second=30.0)
+        if ref is None or ref.shape != arr.shape or self._since_key[stream] + 1 >= self._interval:
+            packed = pack_array(arr, self._wire_format)
+            self._refs[stream] = unpack_array(packed)
+            self._since_key[stream] = 0
+            return {'frame': {'seq': seq, 'key': True}, field: packed}
+
+        diff  = arr - ref
+        peak  = float(np.abs(diff).max()) if diff.size else 0.0
+        scale = peak / 127.0 or 1.0
+        q = np.rint(diff / scale).astype(np.int8).ravel()
+        delta = {'shape': list(arr.shape), 'scale': scale}
+        changed = np.flatnonzero(q)
+        if changed.size * 5 < q.size:   # 4-byte index + 1-byte value per change
+            delta['indices'] = changed.astype('<u4').tobytes()
+            delta['values']  = q[changed].tobytes()
+        else:
+            delta['values'] = q.tobytes()
+        # Mirror the client: float64 maths, float32 storage
+        self._refs[stream] = (ref + q.reshape(arr.shape).astype(np.float64) * scale).astype(np.float32)
+        self._since_key[stream] += 1
+        return {'frame': {'seq': seq, 'key': False, 'ref_seq': seq - 1}, 'delta': delta}
+
+
+class DeltaDecoder:
+    """
+    Server-side counterpart of frontend/src/utils/deltaDecoder.js: rebuilds
+    full frames from DeltaEncoder payloads, with the same arithmetic, so
+    the server holds exactly what its clients hold.
+    """
+
+    def __init__(self):
+        self._refs: Dict[Hashable, tuple] = {}   # stream → (seq, float32 frame)
+
+    def decode(self, stream: Hashable, payload: Dict, field: str) -> Optional[np.ndarray]:
+        """
+        Full frame for `payload[field]`, or None when a delta does not follow
+        the frame held for `stream` (it arrives again after the next keyframe).
+        """
+        frame = payload.get('frame')
+        if frame is None:
+            return unpack_array(payload[field])
+        ref = self._refs.get(stream)
+        if ref is not None and ref[0] == frame['seq']:
+            return ref[1]   # the same frame as an event and in an eval_frame
+        if frame['key']:
+            arr = unpack_array(payload[field])
+        else:
+            if ref is None or ref[0] != frame['ref_seq']:
+                return None
+            delta = payload['delta']
+            q = np.frombuffer(delta['values'], dtype=np.int8).astype(np.float64)
+            step = np.zeros(ref[1].size, dtype=np.float64)
+            if 'indices' in delta:
+                step[np.frombuffer(delta['indices'], dtype='<u4')] = q
+            else:
+                step[:] = q
+            arr = (ref[1] + step.reshape(ref[1].shape) * delta['scale']).astype(np.float32)
+        self._refs[stream] = (frame['seq'], arr)
+        return arr
+
+
+# ---------------------------------------------------------------------------
+# Bundled eval frames
+# ---------------------------------------------------------------------------
+
+EVAL_FRAME_VERSION = 1
+EVAL_EVENT_MODES   = ('events', 'frame', 'both')
+
+# Per-eval events → their section in an eval_frame
+EVAL_FRAME_SECTIONS = {
+    'training_metrics':    'metrics',
+    'generated_sample':    'sample',
+    'token_probabilities': 'token_probabilities',
+    'embedding_snapshot':  'embedding',
+    'attention_snapshot':  'attention',
+}
+_ENVELOPE = ('session_id', 'step', 'timestamp')
+
+
+class EvalFrame:
+    """
+    Collects one eval interval's events into a single 'eval_frame' event:
+
+        {'version': 1, 'session_id', 'step', 'timestamp',
+         'metrics':             {train_loss, val_loss},
+         'sample':              {text, prompt},
+         'token_probabilities': {tokens, probs, logits, generated_token, temperature},
+         'embedding':           {coords | frame + delta, labels},
+         'attention':           {tokens, heads: [{layer, head, matrix | frame + delta}]}}
+
+    Every section is optional and holds its event's payload without the
+    envelope.  Stands in for socketio in the emit_* calls of one eval;
+    send() emits the frame.  With forward=True the individual events are
+    emitted too (mode 'both'), for clients that do not read frames.
+    """
+
+    def __init__(self, socketio: Any, session_id: str, step: int, forward: bool = False):
+        self._socketio   = socketio
+        self._session_id = session_id
+        self._step       = step
+        self._forward    = forward
+        self._sections: Dict[str, Any] = {}
+
+    def emit(self, event: str, payload: Dict, room: Optional[str] = None) -> None:
+        name = EVAL_FRAME_SECTIONS.get(event)
+        if name is None or self._forward:
+            self._socketio.emit(event, payload, room=room)
+        if name is None:
+            return
+        section = {k: v for k, v in payload.items() if k not in _ENVELOPE}
+        if name == 'attention':
+            # All heads share the probe tokens; send them once
+            attention = self._sections.setdefault(
+                'attention', {'tokens': section.pop('tokens'), 'heads': []})
+            section.pop('tokens', None)
+            attention['heads'].append(section)
+        else:
+            self._sections[name] = section
+
+    def send(self) -> None:
+        payload = {
+            'version':    EVAL_FRAME_VERSION,
+            'session_id': self._session_id,
+            'step':       self._step,
+            'timestamp':  _ts(),
+            **self._sections,
+        }
+        self._socketio.emit('eval_frame', payload, room=self._session_id)
 
 
 # ---------------------------------------------------------------------------
@@ -81,13 +354,16 @@ def emit_attention_snapshot(
     step: int,
     layer: int,
     head: int,
-    matrix: List[List[float]],
+    matrix: Any,
     tokens: List[str],
+    wire_format: str = 'json',
+    encoder: Optional[DeltaEncoder] = None,
 ) -> None:
     """
-    Emit one attention matrix.
+    Emit one attention matrix, as a full frame or (with `encoder`) a
+    keyframe / delta on the (layer, head) stream.
 
-    `matrix` must already be a plain Python list-of-lists (not a tensor).
+    `matrix` is a list-of-lists or a (T, T) array (not a tensor).
     No per-emit throttle — these are already gated by eval_interval in the
     training loop (e.g. 16 heads × once every 100 steps = very low volume).
     """
@@ -96,10 +372,13 @@ def emit_attention_snapshot(
         'step':       step,
         'layer':      layer,
         'head':       head,
-        'matrix':     matrix,
         'tokens':     tokens,
         'timestamp':  _ts(),
     }
+    if encoder is not None:
+        payload.update(encoder.encode(('attention', layer, head), matrix, 'matrix'))
+    else:
+        payload['matrix'] = pack_array(matrix, wire_format)
     socketio.emit('attention_snapshot', payload, room=session_id)
 
 
@@ -125,12 +404,17 @@ def emit_vocab_info(
     vocab: List[str],
     char_to_idx: Dict[str, int],
     text_preview: str = '',
+    tokenizer: Optional[Dict] = None,
 ) -> None:
-    """Emit vocabulary mapping once at training start."""
+    """
+    Emit vocabulary mapping once at training start.  `tokenizer` is the
+    tokenizer spec (tokenizer.tokenizer_from_spec); vocab holds token labels.
+    """
     payload = {
         'session_id':   session_id,
         'vocab':        vocab,
         'char_to_idx':  char_to_idx,
+        'tokenizer':    tokenizer or {'type': 'char', 'vocab': vocab},
         'text_preview': text_preview[:500],
         'timestamp':    _ts(),
     }
@@ -141,17 +425,25 @@ def emit_embedding_snapshot(
     socketio: Any,
     session_id: str,
     step: int,
-    coords: List[List[float]],
+    coords: Any,
     labels: List[str],
+    wire_format: str = 'json',
+    encoder: Optional[DeltaEncoder] = None,
 ) -> None:
-    """Emit 3D-reduced embedding coordinates."""
+    """
+    Emit 3D-reduced embedding coordinates ((V, 3) list or array), as a
+    full frame or (with `encoder`) a keyframe / delta.
+    """
     payload = {
         'session_id': session_id,
         'step':       step,
-        'coords':     coords,
         'labels':     labels,
         'timestamp':  _ts(),
     }
+    if encoder is not None:
+        payload.update(encoder.encode('embedding', coords, 'coords'))
+    else:
+        payload['coords'] = pack_array(coords, wire_format)
     socketio.emit('embedding_snapshot', payload, room=session_id)
 
 
@@ -159,17 +451,27 @@ def emit_token_probabilities(
     socketio: Any,
     session_id: str,
     step: int,
+    tokens: List[str],
+    probs: List[float],
     logits: List[float],
     generated_token: str,
-    vocab: List[str],
+    temperature: float,
+    wire_format: str = 'json',
 ) -> None:
-    """Emit raw logits for the last generated token (frontend applies temperature)."""
+    """
+    Emit the top-k next-token candidates for the last generated token.
+
+    `probs` are at the sampling `temperature`; `logits` are raw so the
+    frontend can re-apply its own temperature across the candidates.
+    """
     payload = {
         'session_id':      session_id,
         'step':            step,
-        'logits':          logits,
+        'tokens':          tokens,
+        'probs':           pack_array(probs, wire_format),
+        'logits':          pack_array(logits, wire_format),
         'generated_token': generated_token,
-        'vocab':           vocab,
+        'temperature':     temperature,
         'timestamp':       _ts(),
     }
     socketio.emit('token_probabilities', payload, room=session_id)
@@ -179,16 +481,24 @@ def emit_step_progress(
     socketio: Any,
     session_id: str,
     step: int,
+    steps_per_second: Optional[float] = None,
+    speed_mode: Optional[str] = None,
 ) -> None:
     """
     Emit a lightweight step progress update.
 
     This is separate from full metrics emission to allow more frequent
     updates without the overhead of loss estimation and text generation.
+    Throughput and speed mode ('slow' | 'normal' | 'turbo') are included
+    when known.
     """
     payload = {
         'session_id': session_id,
         'step':       step,
         'timestamp':  _ts(),
     }
+    if steps_per_second is not None:
+        payload['steps_per_second'] = round(float(steps_per_second), 2)
+    if speed_mode is not None:
+        payload['speed_mode'] = speed_mode
     socketio.emit('step_progress', payload, room=session_id)
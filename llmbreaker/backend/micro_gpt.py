@@ -12,7 +12,7 @@ Architecture (per design doc Section 4):
   - Positional embeddings: block_size × n_embd   (64 × 16 = 1,024)
   - 2 × TransformerBlock:
       LayerNorm1  (32)
-      MultiHeadAttention (2 heads × 384 Q/K/V + 256 proj = 1,024)
+      MultiHeadAttention (fused Q/K/V 768 + 256 proj = 1,024)
       LayerNorm2  (32)
       FeedForward (16→64→16, 2,048)
   - Final LayerNorm: 32
@@ -21,73 +21,161 @@ Architecture (per design doc Section 4):
 """
 
 import math
+import re
+from contextlib import contextmanager
+from typing import Sequence
+
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from sampling import sample_next_token
+
+
+class KVCache:
+    """
+    Per-layer keys and values from earlier decoding steps.
+
+    Each entry of `layers` is a mutable [keys, values] pair of shape
+    (B, n_head, T_past, head_size), appended to by the attention module of
+    the matching block.  Positions are absolute, so a cache is only valid
+    while the whole sequence fits in block_size.
+    """
+
+    def __init__(self, n_layer: int):
+        self.layers: list[list[torch.Tensor | None]] = [
+            [None, None] for _ in range(n_layer)
+        ]
+
+    def __len__(self) -> int:
+        keys = self.layers[0][0]
+        return 0 if keys is None else keys.shape[2]
 
-class Head(nn.Module):
-    """Single causal self-attention head."""
 
-    def __init__(self, n_embd: int, head_size: int, block_size: int, dropout: float):
+class MultiHeadAttention(nn.Module):
+    """
+    Causal self-attention with every head batched into one set of matmuls.
+
+    A single fused projection produces Q, K and V for all heads at once;
+    heads live in a batch dimension rather than separate modules.
+
+    Unless attention capture is on, the scores → mask → softmax → matmul
+    chain runs through PyTorch's fused `scaled_dot_product_attention`, which
+    never materialises the (T, T) weights.  Capture needs those weights, so
+    it switches to the explicit path.
+    """
+
+    # Set False to force the explicit path everywhere (parity checks, benchmarks)
+    use_fused_kernel: bool = True
+
+    def __init__(self, n_embd: int, n_head: int, block_size: int, dropout: float):
         super().__init__()
-        self.query = nn.Linear(n_embd, head_size, bias=False)
-        self.key   = nn.Linear(n_embd, head_size, bias=False)
-        self.value = nn.Linear(n_embd, head_size, bias=False)
+        assert n_embd % n_head == 0, "n_embd must be divisible by n_head"
+        self.n_head    = n_head
+        self.head_size = n_embd // n_head
 
-        # Lower-triangular causal mask (not a parameter)
+        # Q, K, V for all heads in one projection: (n_embd → 3 × n_embd)
+        self.qkv  = nn.Linear(n_embd, 3 * n_embd, bias=False)
+        self.proj = nn.Linear(n_embd, n_embd, bias=False)
+
+        # Lower-triangular causal mask (not a parameter, not checkpointed)
         self.register_buffer(
             'tril',
-            torch.tril(torch.ones(block_size, block_size))
+            torch.tril(torch.ones(block_size, block_size)),
+            persistent=False,
         )
-        self.dropout = nn.Dropout(dropout)
+        self.attn_dropout = nn.Dropout(dropout)
+        self.dropout      = nn.Dropout(dropout)
 
-        # Captured after each forward pass for visualization
+        # Captured for visualization only while `capture` is set
+        # (see MicroGPT.capture_attention): (B, n_head, T, T)
+        self.capture = False
         self.last_attention: torch.Tensor | None = None
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
+    def forward(
+        self,
+        x: torch.Tensor,
+        layer_cache: list | None = None,
+        attn_mask: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        """
+        `attn_mask` (B, 1, T, P+T) bool, True = may attend, replaces the plain
+        causal mask when rows are left-padded (see MicroGPT.generate_batch).
+        """
         B, T, C = x.shape
-        q = self.query(x)   # (B, T, head_size)
-        k = self.key(x)     # (B, T, head_size)
-        v = self.value(x)   # (B, T, head_size)
+        q, k, v = self.qkv(x).split(C, dim=-1)                          # 3 × (B, T, C)
+        q = q.view(B, T, self.n_head, self.head_size).transpose(1, 2)   # (B, nh, T, hs)
+        k = k.view(B, T, self.n_head, self.head_size).transpose(1, 2)   # (B, nh, T, hs)
+        v = v.view(B, T, self.n_head, self.head_size).transpose(1, 2)   # (B, nh, T, hs)
+
+        # Incremental decoding: prepend cached keys/values, then store the result
+        if layer_cache is not None:
+            past_k, past_v = layer_cache
+            if past_k is not None:
+                k = torch.cat([past_k, k], dim=2)                       # (B, nh, P+T, hs)
+                v = torch.cat([past_v, v], dim=2)
+            layer_cache[0], layer_cache[1] = k, v
+        P = k.shape[2] - T   # number of cached positions before this chunk
+
+        if self.use_fused_kernel and not self.capture:
+            out = self._fused_attention(q, k, v, P, attn_mask)          # (B, nh, T, hs)
+        else:
+            out = self._explicit_attention(q, k, v, P, attn_mask)       # (B, nh, T, hs)
+
+        # Re-assemble heads side by side along the embedding dim
+        out = out.transpose(1, 2).contiguous().view(B, T, C)            # (B, T, C)
+        return self.dropout(self.proj(out))
+
+    def _fused_attention(
+        self,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        P: int,
+        attn_mask: torch.Tensor | None,
+    ) -> torch.Tensor:
+        T = q.shape[2]
+        dropout_p = self.attn_dropout.p if self.training else 0.0
+        if attn_mask is not None:
+            return F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, dropout_p=dropout_p)
+        if P == 0:
+            return F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p, is_causal=True)
+        if T == 1:
+            # Single new token attends to every cached position: no mask needed
+            return F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+        # is_causal aligns the mask top-left, so chunks after a cache need an explicit one
+        mask = self.tril[P:P + T, :P + T].bool()
+        return F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=dropout_p)
+
+    def _explicit_attention(
+        self,
+        q: torch.Tensor,
+        k: torch.Tensor,
+        v: torch.Tensor,
+        P: int,
+        attn_mask: torch.Tensor | None,
+    ) -> torch.Tensor:
+        T = q.shape[2]
 
-        head_size = q.shape[-1]
         # Scaled dot-product attention scores
-        scores = q @ k.transpose(-2, -1) * (head_size ** -0.5)  # (B, T, T)
+        scores = q @ k.transpose(-2, -1) * (self.head_size ** -0.5)    # (B, nh, T, P+T)
 
-        # Apply causal mask
-        scores = scores.masked_fill(self.tril[:T, :T] == 0, float('-inf'))
+        # Apply causal mask (rows are absolute positions P … P+T-1)
+        if attn_mask is not None:
+            scores = scores.masked_fill(~attn_mask, float('-inf'))
+        else:
+            scores = scores.masked_fill(self.tril[P:P + T, :P + T] == 0, float('-inf'))
 
         # Softmax → attention weights
-        attn_weights = F.softmax(scores, dim=-1)  # (B, T, T)
+        attn_weights = F.softmax(scores, dim=-1)                        # (B, nh, T, P+T)
 
         # Capture for visualization (detach from graph, move to CPU)
-        self.last_attention = attn_weights.detach().cpu()
-
-        attn_weights = self.dropout(attn_weights)
-        out = attn_weights @ v  # (B, T, head_size)
-        return out
-
+        if self.capture:
+            self.last_attention = attn_weights.detach().cpu()
 
-class MultiHeadAttention(nn.Module):
-    """Multiple attention heads in parallel, then projected."""
-
-    def __init__(self, n_embd: int, n_head: int, block_size: int, dropout: float):
-        super().__init__()
-        assert n_embd % n_head == 0, "n_embd must be divisible by n_head"
-        head_size = n_embd // n_head
-        self.heads = nn.ModuleList([
-            Head(n_embd, head_size, block_size, dropout)
-            for _ in range(n_head)
-        ])
-        self.proj    = nn.Linear(n_embd, n_embd, bias=False)
-        self.dropout = nn.Dropout(dropout)
-
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        # Run all heads, concatenate along embedding dim
-        out = torch.cat([h(x) for h in self.heads], dim=-1)  # (B, T, n_embd)
-        return self.dropout(self.proj(out))
+        attn_weights = self.attn_dropout(attn_weights)
+        return attn_weights @ v                                         # (B, nh, T, hs)
 
 
 class FeedForward(nn.Module):
@@ -116,8 +204,13 @@ class TransformerBlock(nn.Module):
         self.ln2 = nn.LayerNorm(n_embd)
         self.ff  = FeedForward(n_embd, dropout)
 
-    def forward(self, x: torch.Tensor) -> torch.Tensor:
-        x = x + self.sa(self.ln1(x))
+    def forward(
+        self,
+        x: torch.Tensor,
+        layer_cache: list | None = None,
+        attn_mask: torch.Tensor | None = None,
+    ) -> torch.Tensor:
+        x = x + self.sa(self.ln1(x), layer_cache, attn_mask)
         x = x + self.ff(self.ln2(x))
         return x
 
@@ -180,29 +273,56 @@ class MicroGPT(nn.Module):
         self,
         idx: torch.Tensor,
         targets: torch.Tensor | None = None,
+        kv_cache: KVCache | None = None,
+        pad: torch.Tensor | None = None,
     ) -> tuple[torch.Tensor, torch.Tensor | None]:
         """
         Args:
-            idx:     (B, T) token indices
-            targets: (B, T) next-token targets (optional)
+            idx:      (B, T) token indices
+            targets:  (B, T) next-token targets (optional)
+            kv_cache: keys/values of earlier positions (optional); `idx` is
+                      then treated as the continuation and the cache is
+                      extended in place
+            pad:      (B,) number of left-padding columns per row, counted
+                      from the start of the cache (optional).  Each row's
+                      positions start at its first real token and padding
+                      is never attended to.
 
         Returns:
             logits: (B, T, vocab_size)
             loss:   scalar cross-entropy loss (None if no targets)
         """
         B, T = idx.shape
-        assert T <= self.block_size, \
-            f"Sequence length {T} exceeds block_size {self.block_size}"
+        P = len(kv_cache) if kv_cache is not None else 0
+        assert P + T <= self.block_size, \
+            f"Sequence length {P + T} exceeds block_size {self.block_size}"
 
         device = idx.device
+        cols = torch.arange(P, P + T, device=device)                      # absolute columns
+        attn_mask = None
+        if pad is not None:
+            positions = (cols[None, :] - pad[:, None]).clamp(min=0)       # (B, T)
+            keys = torch.arange(P + T, device=device)
+            # Causal, and never a padding key — except a padding query's own
+            # column, so no row of the mask is empty (softmax would give NaN)
+            attn_mask = (
+                (keys[None, None, :] <= cols[None, :, None])
+                & ((keys[None, None, :] >= pad[:, None, None])
+                   | (keys[None, None, :] == cols[None, :, None]))
+            )[:, None]                                                     # (B, 1, T, P+T)
+        else:
+            positions = cols                                               # (T,)
+
         tok_emb = self.token_embedding_table(idx)                         # (B, T, C)
-        pos_emb = self.position_embedding_table(
-            torch.arange(T, device=device)
-        )                                                                  # (T, C)
+        pos_emb = self.position_embedding_table(positions)                # (T, C) or (B, T, C)
         x = tok_emb + pos_emb                                             # (B, T, C)
 
-        for block in self.blocks:
-            x = block(x)
+        for i, block in enumerate(self.blocks):
+            x = block(
+                x,
+                kv_cache.layers[i] if kv_cache is not None else None,
+                attn_mask,
+            )
 
         x = self.ln_f(x)
         logits = self.lm_head(x)                                          # (B, T, vocab_size)
@@ -211,7 +331,7 @@ class MicroGPT(nn.Module):
         if targets is not None:
             loss = F.cross_entropy(
                 logits.view(-1, self.vocab_size),
-                targets.view(-1),
+                targets.reshape(-1),   # targets may be a strided view
             )
 
         return logits, loss
@@ -223,42 +343,168 @@ class MicroGPT(nn.Module):
         max_new_tokens: int,
         temperature: float = 1.0,
         return_last_logits: bool = False,
+        use_cache: bool = True,
+        top_k: int | None = None,
+        top_p: float | None = None,
     ) -> torch.Tensor | tuple[torch.Tensor, torch.Tensor]:
         """
         Autoregressively generate `max_new_tokens` tokens.
 
+        With `use_cache`, keys and values are cached per layer so each step
+        only runs the newest token through the model.  Once the sequence
+        outgrows block_size the window slides and every position embedding
+        shifts, which invalidates the cache; from then on each step is a
+        full forward over the cropped window, exactly as without the cache.
+
         Args:
             idx:                (1, T) seed context
             max_new_tokens:     number of tokens to generate
             temperature:        sampling temperature (>1 = more random)
             return_last_logits: if True, also return raw logits for the last token
+            use_cache:          reuse keys/values across steps (same output)
+            top_k, top_p:       optional filtering (see sampling.sample_next_token)
 
         Returns:
             (1, T + max_new_tokens) token tensor
             If return_last_logits: tuple of (token_tensor, raw_logits)
         """
         last_raw_logits = None
+        cache = KVCache(self.n_layer) if use_cache else None
         for _ in range(max_new_tokens):
-            # Crop to block_size
-            idx_cond = idx[:, -self.block_size:]
-            logits, _ = self.forward(idx_cond)
+            if cache is not None and idx.shape[1] <= self.block_size:
+                # Only feed tokens the cache has not seen (whole seed at first)
+                logits, _ = self.forward(idx[:, len(cache):], kv_cache=cache)
+            else:
+                # Crop to block_size; positions shifted, so the cache is stale
+                cache = None
+                idx_cond = idx[:, -self.block_size:]
+                logits, _ = self.forward(idx_cond)
             # Take logits at the last time step
             raw = logits[:, -1, :]                          # (1, vocab_size)
             last_raw_logits = raw
-            scaled = raw / temperature                      # (1, vocab_size)
-            probs  = F.softmax(scaled, dim=-1)
-            idx_next = torch.multinomial(probs, num_samples=1)  # (1, 1)
+            sample = sample_next_token(raw, temperature, top_k=top_k, top_p=top_p)
+            idx_next = sample.tokens[:, None]               # (1, 1)
             idx = torch.cat([idx, idx_next], dim=1)
         if return_last_logits:
             return idx, last_raw_logits[0]                  # (vocab_size,)
         return idx
 
     @torch.no_grad()
-    def extract_embeddings_3d(self) -> list[list[float]]:
+    def generate_batch(
+        self,
+        prompts: Sequence[Sequence[int]],
+        max_new_tokens: int,
+        temperature: float | Sequence[float] = 1.0,
+        stop_tokens: int | Sequence[int | None] | None = None,
+        return_last_logits: bool = False,
+        top_k: int | None = None,
+        top_p: float | None = None,
+    ) -> list[list[int]] | tuple[list[list[int]], torch.Tensor]:
+        """
+        Generate continuations for several prompts in one batched pass.
+
+        Prompts may differ in length: they are left-padded, and each row
+        gets its own positions and padding mask so it samples exactly as it
+        would alone.  Rows stop independently when they emit their stop
+        token; the loop ends early once every row has stopped.
+
+        Args:
+            prompts:            N non-empty token-index lists
+            max_new_tokens:     upper bound on tokens generated per row
+            temperature:        one value for all rows, or one per row
+            stop_tokens:        token index ending a row (kept in the output),
+                                one for all rows or one per row (None = never)
+            return_last_logits: if True, also return each row's raw logits
+                                at its final generated step
+            top_k, top_p:       optional filtering (see sampling.sample_next_token)
+
+        Returns:
+            N lists of prompt + generated token indices
+            If return_last_logits: tuple of (token_lists, (N, vocab_size) logits)
+        """
+        assert prompts and all(len(p) > 0 for p in prompts), "prompts must be non-empty"
+        device = next(self.parameters()).device
+        N = len(prompts)
+        T0 = max(len(p) for p in prompts)
+
+        pad = torch.tensor([T0 - len(p) for p in prompts], device=device)
+        idx = torch.zeros((N, T0), dtype=torch.long, device=device)
+        for row, p in enumerate(prompts):
+            idx[row, T0 - len(p):] = torch.as_tensor(list(p), dtype=torch.long)
+
+        if stop_tokens is None or isinstance(stop_tokens, int):
+            stop_tokens = [stop_tokens] * N
+        stops = torch.tensor(
+            [-1 if t is None else t for t in stop_tokens], device=device,
+        )                                                                  # (N,)
+
+        finished    = torch.zeros(N, dtype=torch.bool, device=device)
+        n_generated = torch.zeros(N, dtype=torch.long, device=device)
+        last_raw_logits = torch.zeros((N, self.vocab_size), device=device)
+        cache = KVCache(self.n_layer)
+
+        for _ in range(max_new_tokens):
+            if cache is not None and idx.shape[1] <= self.block_size:
+                logits, _ = self.forward(idx[:, len(cache):], kv_cache=cache, pad=pad)
+            else:
+                # Window slid: crop and recompute with the padding that remains
+                cache = None
+                crop = idx.shape[1] - self.block_size
+                logits, _ = self.forward(
+                    idx[:, crop:], pad=(pad - crop).clamp(min=0),
+                )
+            raw   = logits[:, -1, :]                                       # (N, vocab_size)
+            sample = sample_next_token(raw, temperature, top_k=top_k, top_p=top_p)
+            idx_next = sample.tokens[:, None]                              # (N, 1)
+
+            # Finished rows keep repeating a filler token and their last logits
+            active = ~finished
+            idx_next = torch.where(active[:, None], idx_next, idx[:, -1:])
+            last_raw_logits = torch.where(active[:, None], raw, last_raw_logits)
+            n_generated += active.long()
+            idx = torch.cat([idx, idx_next], dim=1)
+
+            finished |= idx_next[:, 0] == stops
+            if bool(finished.all()):
+                break
+
+        results = [
+            idx[row, T0 - len(p): T0 + int(n_generated[row])].tolist()
+            for row, p in enumerate(prompts)
+        ]
+        if return_last_logits:
+            return results, last_raw_logits
+        return results
+
+    @contextmanager
+    def capture_attention(self):
+        """
+        Record attention weights for forward passes run inside the block.
+
+            with model.capture_attention():
+                model(x)
+            snapshots = model.extract_attention_weights()
+
+        Outside the block attention modules copy nothing, so training and
+        loss estimation pay no capture cost.
+        """
+        modules = [block.sa for block in self.blocks]
+        for sa in modules:
+            sa.capture = True
+            sa.last_attention = None
+        try:
+            yield self
+        finally:
+            for sa in modules:
+                sa.capture = False
+
+    @torch.no_grad()
+    def extract_embeddings_3d(self, as_array: bool = False) -> list[list[float]] | np.ndarray:
         """
         Extract token embeddings, reduce to 3D via PCA.
 
-        Returns list of [x, y, z] coordinates, one per vocab token.
+        Returns list of [x, y, z] coordinates, one per vocab token
+        (a (V, 3) float32 array if as_array).
         """
         emb = self.token_embedding_table.weight.detach().cpu().numpy()  # (V, D)
         # Centre
@@ -271,25 +517,77 @@ class MicroGPT(nn.Module):
         mx = np.abs(coords).max()
         if mx > 0:
             coords = coords / mx
+        if as_array:
+            return coords.astype(np.float32)
         return coords.tolist()
 
-    def extract_attention_weights(self) -> list[dict]:
+    def extract_attention_weights(self, as_arrays: bool = False) -> list[dict]:
         """
         Return the most recently captured attention matrices from all heads.
 
+        Only forwards run under `capture_attention()` are recorded.
+
         Returns list of dicts:
             {'layer': int, 'head': int, 'matrix': List[List[float]]}
+        with each matrix a (T, T) float32 array instead if as_arrays.
         """
         snapshots = []
         for layer_idx, block in enumerate(self.blocks):
-            for head_idx, head in enumerate(block.sa.heads):
-                if head.last_attention is None:
-                    continue
+            captured = block.sa.last_attention
+            if captured is None:
+                continue
+            for head_idx in range(captured.shape[1]):
                 # Take the first example in the batch: (T, T)
-                matrix = head.last_attention[0].numpy().tolist()
+                matrix = captured[0, head_idx].numpy()
+                matrix = matrix.astype(np.float32) if as_arrays else matrix.tolist()
                 snapshots.append({
                     'layer':  layer_idx,
                     'head':   head_idx,
                     'matrix': matrix,
                 })
         return snapshots
+
+
+# ---------------------------------------------------------------------------
+# Legacy checkpoint conversion
+# ---------------------------------------------------------------------------
+
+# Older checkpoints stored one Head module per attention head:
+#   blocks.{i}.sa.heads.{h}.query.weight / key.weight / value.weight / tril
+_LEGACY_HEAD_KEY = re.compile(
+    r'^(?P<prefix>.+\.sa)\.heads\.(?P<head>\d+)\.(?:(?P<name>query|key|value)\.weight|tril)$'
+)
+
+
+def convert_legacy_state_dict(state_dict: dict) -> dict:
+    """
+    Rewrite a per-head attention state_dict into the fused QKV layout.
+
+    Each layer's per-head query/key/value weights (head_size × n_embd) are
+    stacked into a single `sa.qkv.weight` of shape (3·n_embd × n_embd),
+    ordered Q heads, then K heads, then V heads — the same column layout the
+    old `torch.cat` over heads fed into `proj`.  Per-head `tril` buffers are
+    dropped.  State dicts already in the fused layout are returned unchanged.
+    """
+    if not any(_LEGACY_HEAD_KEY.match(k) for k in state_dict):
+        return state_dict
+
+    converted: dict = {}
+    legacy: dict = {}   # prefix → {'query'|'key'|'value': {head: weight}}
+    for key, value in state_dict.items():
+        m = _LEGACY_HEAD_KEY.match(key)
+        if m is None:
+            converted[key] = value
+            continue
+        if m.group('name') is None:
+            continue  # per-head causal mask, rebuilt by the model
+        parts = legacy.setdefault(m.group('prefix'), {})
+        parts.setdefault(m.group('name'), {})[int(m.group('head'))] = value
+
+    for prefix, parts in legacy.items():
+        converted[f'{prefix}.qkv.weight'] = torch.cat([
+            parts[name][h]
+            for name in ('query', 'key', 'value')
+            for h in sorted(parts[name])
+        ], dim=0)
+    return converted
@@ -3,6 +3,8 @@ from datetime import datetime
 from typing import Dict, List, Optional
 from enum import Enum
 
+from history_store import HistoryStore
+
 
 class SessionStatus(Enum):
     IDLE = "idle"
@@ -59,17 +61,20 @@ class TrainingSession:
     vocab: List[str] = field(default_factory=list)
     char_to_idx: Dict[str, int] = field(default_factory=dict)
     idx_to_char: Dict[int, str] = field(default_factory=dict)
+    tokenizer: Optional[object] = None   # CharTokenizer / BPETokenizer once the vocab is built
 
     # Runtime state
     current_iter: int = 0
     speed_multiplier: float = 1.0
+    steps_per_second: float = 0.0
+    num_threads: int = 0          # torch intra-op threads (0 = torch default)
+    emit_stats: Dict = field(default_factory=dict)   # EmitQueue depth / sent / dropped
+    keyframe_requested: bool = False   # next delta-encoded frames must be keyframes
     model_instance: Optional[object] = None
     optimizer: Optional[object] = None
 
-    # Metrics history
-    loss_history: List[Dict] = field(default_factory=list)
-    attention_snapshots: List[Dict] = field(default_factory=list)
-    generated_samples: List[Dict] = field(default_factory=list)
+    # Metrics history: bounded loss curve, samples and eval frames (replayed to late joiners)
+    history: HistoryStore = field(default_factory=HistoryStore)
 
     # Timestamps
     created_at: datetime = field(default_factory=datetime.now)
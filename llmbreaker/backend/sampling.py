@@ -0,0 +1,145 @@
+"""
+sampling.py — Vectorised next-token sampling for MicroGPT.
+
+One call applies repetition penalty, temperature, top-k and nucleus (top-p)
+filtering to a batch of logits, samples one token per row, and returns the
+top candidates with their probabilities — without ever leaving tensor land
+or building full-vocab Python lists.
+
+Public API
+----------
+sample_next_token(logits, ...)   →  SampleResult   sampled tokens + top-k table
+top_k_table(logits, ...)         →  SampleResult   top-k table only (tokens=None)
+"""
+
+from dataclasses import dataclass
+from typing import Optional, Sequence, Union
+
+import torch
+import torch.nn.functional as F
+
+Temperature = Union[float, Sequence[float], torch.Tensor]
+
+
+@dataclass
+class SampleResult:
+    """
+    Output of one sampling step.  Shapes are (B, ...) for batched logits and
+    drop the batch dim when a single (vocab_size,) vector was passed in.
+
+        tokens       – sampled token indices, (B,) (None from top_k_table)
+        top_indices  – most probable token indices, descending, (B, k)
+        top_probs    – their probabilities after filtering, (B, k)
+        top_logits   – their raw (unscaled, unpenalised) logits, (B, k)
+    """
+    tokens:      Optional[torch.Tensor]
+    top_indices: torch.Tensor
+    top_probs:   torch.Tensor
+    top_logits:  torch.Tensor
+
+
+def _filtered_probs(
+    logits: torch.Tensor,
+    temperature: Temperature,
+    top_k: Optional[int],
+    top_p: Optional[float],
+    repetition_penalty: float,
+    context: Optional[torch.Tensor],
+) -> torch.Tensor:
+    """(B, V) raw logits → (B, V) sampling distribution."""
+    logits = logits.float()
+
+    # Repetition penalty (CTRL-style): push down every token already in context
+    if repetition_penalty != 1.0 and context is not None:
+        seen = torch.zeros_like(logits, dtype=torch.bool)
+        seen.scatter_(1, context, True)
+        penalised = torch.where(
+            logits > 0, logits / repetition_penalty, logits * repetition_penalty,
+        )
+        logits = torch.where(seen, penalised, logits)
+
+    temps = torch.as_tensor(temperature, dtype=logits.dtype, device=logits.device)
+    logits = logits / temps.reshape(-1, 1).clamp(min=1e-5)
+
+    if top_k is not None and 0 < top_k < logits.shape[-1]:
+        kth = torch.topk(logits, top_k, dim=-1).values[:, -1:]
+        logits = logits.masked_fill(logits < kth, float('-inf'))
+
+    if top_p is not None and 0.0 < top_p < 1.0:
+        sorted_logits, sorted_idx = torch.sort(logits, dim=-1, descending=True)
+        sorted_probs = F.softmax(sorted_logits, dim=-1)
+        # Drop a token once the mass *before* it already reaches top_p
+        # (the most probable token is always kept)
+        drop_sorted = (sorted_probs.cumsum(dim=-1) - sorted_probs) >= top_p
+        drop = drop_sorted.scatter(1, sorted_idx, drop_sorted)
+        logits = logits.masked_fill(drop, float('-inf'))
+
+    return F.softmax(logits, dim=-1)
+
+
+def _sample(
+    logits: torch.Tensor,
+    temperature: Temperature,
+    top_k: Optional[int],
+    top_p: Optional[float],
+    repetition_penalty: float,
+    context: Optional[torch.Tensor],
+    table_size: int,
+    draw: bool,
+) -> SampleResult:
+    single = logits.dim() == 1
+    if single:
+        logits = logits.unsqueeze(0)
+        if context is not None:
+            context = context.reshape(1, -1)
+
+    probs = _filtered_probs(logits, temperature, top_k, top_p, repetition_penalty, context)
+    tokens = torch.multinomial(probs, num_samples=1)[:, 0] if draw else None
+    top_probs, top_indices = torch.topk(probs, min(table_size, probs.shape[-1]), dim=-1)
+    top_logits = logits.gather(1, top_indices)
+
+    if single:
+        return SampleResult(
+            tokens      = tokens[0] if tokens is not None else None,
+            top_indices = top_indices[0],
+            top_probs   = top_probs[0],
+            top_logits  = top_logits[0],
+        )
+    return SampleResult(tokens, top_indices, top_probs, top_logits)
+
+
+def sample_next_token(
+    logits: torch.Tensor,
+    temperature: Temperature = 1.0,
+    top_k: Optional[int] = None,
+    top_p: Optional[float] = None,
+    repetition_penalty: float = 1.0,
+    context: Optional[torch.Tensor] = None,
+    table_size: int = 10,
+) -> SampleResult:
+    """
+    Sample the next token and report the top candidates in one pass.
+
+    Args:
+        logits:             (B, vocab_size) or (vocab_size,) raw logits
+        temperature:        one value, or one per row
+        top_k:              keep only the k most likely tokens (None = all)
+        top_p:              keep the smallest set whose mass reaches p (None = all)
+        repetition_penalty: >1 discourages tokens already present in `context`
+        context:            (B, T) or (T,) token indices for the penalty
+        table_size:         number of candidates in the returned table
+    """
+    return _sample(logits, temperature, top_k, top_p, repetition_penalty,
+                   context, table_size, draw=True)
+
+
+def top_k_table(
+    logits: torch.Tensor,
+    temperature: Temperature = 1.0,
+    top_k: Optional[int] = None,
+    top_p: Optional[float] = None,
+    table_size: int = 10,
+) -> SampleResult:
+    """Same candidate table as sample_next_token, without drawing a sample."""
+    return _sample(logits, temperature, top_k, top_p, 1.0,
+                   None, table_size, draw=False)
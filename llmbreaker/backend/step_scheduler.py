@@ -0,0 +1,109 @@
+"""
+step_scheduler.py — Cooperative yielding for the training loop.
+
+The training loop runs as a green thread on the eventlet hub, so it must
+yield for REST and WebSocket traffic to be served.  Rather than sleeping a
+fixed 10 ms after every step, StepScheduler yields once per time budget of
+compute, shrinks that budget when the hub has work waiting and grows it
+when the hub is idle.  It also implements session.speed_multiplier:
+
+    speed < 1   slow motion – fixed SLOW_MOTION_BASE_RATE × speed steps/s
+    speed == 1  normal      – adaptive budget, MIN_BUDGET … NORMAL_MAX_BUDGET
+    speed > 1   turbo       – budget floor raised to NORMAL_MAX_BUDGET and the
+                              ceiling scaled by speed, up to TURBO_MAX_BUDGET
+"""
+
+import time
+from typing import Any, Callable
+
+MIN_BUDGET            = 0.005   # s of compute between yields, lower bound
+NORMAL_MAX_BUDGET     = 0.05    # s, ceiling at speed 1
+TURBO_MAX_BUDGET      = 0.5     # s, ceiling at any speed
+SLOW_MOTION_BASE_RATE = 50.0    # steps/s at speed 1 (slow motion scales this)
+PRESSURE_LAG          = 0.005   # a yield returning later than this ⇒ hub is busy
+RATE_SMOOTHING        = 0.1     # EMA factor for steps_per_second
+
+
+def speed_mode(speed_multiplier: float) -> str:
+    """'slow' | 'normal' | 'turbo' for a speed multiplier."""
+    if speed_multiplier < 1.0:
+        return 'slow'
+    if speed_multiplier > 1.0:
+        return 'turbo'
+    return 'normal'
+
+
+class StepScheduler:
+    """Call step_done() once after every training step."""
+
+    def __init__(
+        self,
+        socketio: Any,
+        session: Any,
+        clock: Callable[[], float] = time.perf_counter,
+    ):
+        self._socketio = socketio
+        self._session  = session
+        self._clock    = clock
+        self._budget   = 2 * MIN_BUDGET
+        self._last_yield = self._last_step = clock()
+        self.steps_per_second = 0.0
+
+    @property
+    def mode(self) -> str:
+        return speed_mode(self._speed())
+
+    def reset_clock(self) -> None:
+        """Forget time spent outside the loop (e.g. while paused)."""
+        self._last_yield = self._last_step = self._clock()
+
+    def step_done(self) -> None:
+        start = self._clock()
+        speed = self._speed()
+
+        if speed < 1.0:
+            # Slow motion: pad every step out to a fixed interval
+            interval = 1.0 / (SLOW_MOTION_BASE_RATE * speed)
+            self._socketio.sleep(max(0.0, interval - (start - self._last_step)))
+            self._last_yield = self._clock()
+        else:
+            floor, ceiling = self._budget_bounds(speed)
+            self._budget = min(max(self._budget, floor), ceiling)
+            if start - self._last_yield >= self._budget:
+                self._yield(floor, ceiling)
+
+        end = self._clock()
+        self._record_rate(end - self._last_step)
+        self._last_step = end
+        self._session.steps_per_second = round(self.steps_per_second, 2)
+
+    # ── internals ──────────────────────────────────────────────────────────
+
+    def _speed(self) -> float:
+        return max(float(self._session.speed_multiplier), 1e-3)
+
+    @staticmethod
+    def _budget_bounds(speed: float) -> tuple[float, float]:
+        if speed > 1.0:
+            return NORMAL_MAX_BUDGET, min(TURBO_MAX_BUDGET, NORMAL_MAX_BUDGET * speed)
+        return MIN_BUDGET, NORMAL_MAX_BUDGET
+
+    def _yield(self, floor: float, ceiling: float) -> None:
+        before = self._clock()
+        self._socketio.sleep(0)
+        lag = self._clock() - before
+        # Late return means other greenlets were waiting: yield more often
+        if lag > PRESSURE_LAG:
+            self._budget = max(floor, self._budget / 2)
+        else:
+            self._budget = min(ceiling, self._budget * 1.25)
+        self._last_yield = self._clock()
+
+    def _record_rate(self, step_seconds: float) -> None:
+        if step_seconds <= 0:
+            return
+        rate = 1.0 / step_seconds
+        if self.steps_per_second == 0.0:
+            self.steps_per_second = rate
+        else:
+            self.steps_per_second += RATE_SMOOTHING * (rate - self.steps_per_second)
@@ -21,14 +21,24 @@ curl -s -X POST "$BASE_URL/api/generate-next-token" \
   -d '{"session_id": "fake-session-123", "context": "Hello", "temperature": 1.0}' | jq '.'
 echo ""
 
-# Test 3: Valid request with real session (requires a running training session)
-echo "Test 3: Valid request (requires active session with trained model)"
+# Test 3: Batch endpoint without contexts (should return 400)
+echo "Test 3: Batch request with empty contexts (expect 400)"
+curl -s -X POST "$BASE_URL/api/generate-next-token/batch" \
+  -H "Content-Type: application/json" \
+  -d '{"session_id": "fake-session-123", "contexts": [], "temperature": 1.0}' | jq '.'
+echo ""
+
+# Test 4: Valid request with real session (requires a running training session)
+echo "Test 4: Valid request (requires active session with trained model)"
 echo "To test this:"
 echo "  1. Start a training session via the UI"
 echo "  2. Copy the session_id"
 echo "  3. Run: curl -X POST $BASE_URL/api/generate-next-token \\"
 echo "       -H 'Content-Type: application/json' \\"
 echo "       -d '{\"session_id\": \"YOUR_SESSION_ID\", \"context\": \"Hello wor\", \"temperature\": 1.0}'"
+echo "  4. Batch: curl -X POST $BASE_URL/api/generate-next-token/batch \\"
+echo "       -H 'Content-Type: application/json' \\"
+echo "       -d '{\"session_id\": \"YOUR_SESSION_ID\", \"contexts\": [\"Hello wor\", \"To be\"], \"temperature\": [0.8, 1.2]}'"
 echo ""
 
 echo "=== Expected Response Format ==="
@@ -0,0 +1,305 @@
+"""
+tokenizer.py — Character-level and byte-level BPE tokenizers.
+
+CharTokenizer (the default) uses NumPy lookup tables.  Text is converted to
+code points in bulk (one str.encode('utf-32-le') call viewed as uint32), and
+tokens are found with a single table gather: the encode table maps every
+code point up to the largest one in the vocab to its token id, with a
+trailing -1 slot that every out-of-range code point is clamped onto.
+Unknown characters therefore need no per-character branch — they come out
+as -1 and are dropped or reported with one mask.  Decoding gathers code
+points for the ids and decodes them back in one go.
+
+BPETokenizer is the optional subword mode: 256 byte tokens plus merges
+learned from the session corpus, so one token covers several characters
+and a block_size window holds several times more text.  Text is pre-split
+into words (a leading space stays with its word) and merges never cross a
+word boundary; encoding is cached per distinct word.  Being byte-level it
+has no unknown characters.  Token labels (vocab, id_to_token) are the
+token's bytes decoded as UTF-8, with stray bytes of a split multi-byte
+character shown as \\xNN escapes.
+
+Both share the interface below, and serialise to a small `spec` dict that
+the corpus cache stores and the training worker sends to the server.
+
+Public API
+----------
+CharTokenizer(vocab)               tables built once per vocab
+BPETokenizer(merges)               merges: list of (left_id, right_id) pairs
+BPETokenizer.train(texts, vocab_size)
+    .encode(text)           →  np.ndarray of token ids (unknown chars dropped)
+    .unknown_chars(text)    →  sorted list of characters not in the vocab
+    .decode(ids)            →  str (ids outside the vocab are skipped)
+    .id_to_token(ids)       →  list of token label strings
+    .char_to_idx / .idx_to_char   dict views for the JSON payloads
+    .spec                   →  JSON-able dict, see tokenizer_from_spec
+tokenizer_from_spec(spec)   →  CharTokenizer / BPETokenizer
+word_aligned(chunks)        →  the same text, re-cut so no word spans two chunks
+"""
+
+import re
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+
+import numpy as np
+
+Ids = Union[Sequence[int], np.ndarray]
+
+TOKENIZER_KINDS        = ('char', 'bpe')
+DEFAULT_BPE_VOCAB_SIZE = 512
+
+_UNKNOWN = -1
+
+
+def _code_points(text: str) -> np.ndarray:
+    return np.frombuffer(text.encode('utf-32-le', errors='surrogatepass'), dtype=np.uint32)
+
+
+class CharTokenizer:
+    """Character vocab ↔ token ids, one id per character."""
+
+    kind = 'char'
+    start_id = 0   # first token of unprompted samples
+
+    def __init__(self, vocab: Sequence[str]):
+        self.vocab: List[str] = list(vocab)
+        self._code_points = np.array([ord(ch) for ch in self.vocab], dtype=np.uint32)
+
+        size = int(self._code_points.max()) + 1 if self.vocab else 0
+        # Slot `size` is the catch-all for unknown / out-of-range code points
+        self._encode_table = np.full(size + 1, _UNKNOWN, dtype=np.int32)
+        self._encode_table[self._code_points] = np.arange(len(self.vocab), dtype=np.int32)
+
+    @classmethod
+    def from_char_to_idx(cls, char_to_idx: Dict[str, int]) -> 'CharTokenizer':
+        return cls(sorted(char_to_idx, key=char_to_idx.__getitem__))
+
+    def __len__(self) -> int:
+        return len(self.vocab)
+
+    @property
+    def char_to_idx(self) -> Dict[str, int]:
+        return {ch: i for i, ch in enumerate(self.vocab)}
+
+    @property
+    def idx_to_char(self) -> Dict[int, str]:
+        return dict(enumerate(self.vocab))
+
+    @property
+    def spec(self) -> Dict:
+        return {'type': self.kind, 'vocab': self.vocab}
+
+    # ── encode ─────────────────────────────────────────────────────────────
+
+    def _lookup(self, text: str) -> np.ndarray:
+        cps = np.minimum(_code_points(text), len(self._encode_table) - 1)
+        return self._encode_table[cps]
+
+    def encode(self, text: str) -> np.ndarray:
+        """Token ids (int32) for `text`; characters not in the vocab are skipped."""
+        ids = self._lookup(text)
+        return ids[ids != _UNKNOWN]
+
+    def unknown_chars(self, text: str) -> List[str]:
+        unknown = _code_points(text)[self._lookup(text) == _UNKNOWN]
+        return [chr(cp) for cp in np.unique(unknown)]
+
+    # ── decode ─────────────────────────────────────────────────────────────
+
+    def _valid(self, ids: Ids) -> np.ndarray:
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        return ids[(ids >= 0) & (ids < len(self.vocab))]
+
+    def decode(self, ids: Ids) -> str:
+        cps = self._code_points[self._valid(ids)]
+        return cps.tobytes().decode('utf-32-le', errors='surrogatepass')
+
+    def id_to_token(self, ids: Ids) -> List[str]:
+        """One string per id, for per-token UI payloads."""
+        return [self.vocab[i] for i in self._valid(ids).tolist()]
+
+
+# ---------------------------------------------------------------------------
+# Byte-level BPE
+# ---------------------------------------------------------------------------
+
+# Words: optional leading space + letters/digits, or + punctuation, or runs of
+# whitespace (leaving the last space to prefix the next word)
+_WORD_RE = re.compile(r' ?\w+| ?[^\w\s]+|\s+(?!\S)|\s+')
+_SPACE_RE = re.compile(r'\s')
+
+# A chunk whose carried-over tail grows past this is cut anyway (a run this
+# long with no whitespace in it may then be split into two words)
+MAX_CARRY_CHARS = 1 << 20
+
+
+def _split_last_word(text: str) -> Tuple[str, str]:
+    """
+    (head, tail) with head + tail == text, cut before the last whitespace
+    character that precedes a non-space one.  _WORD_RE always starts a word
+    there, and the words of head come out the same whatever follows, so
+    tail is all that can still join up with the next chunk.
+    """
+    body = text.rstrip()
+    last = _SPACE_RE.search(body[::-1])
+    if last is None:
+        return '', text
+    cut = len(body) - 1 - last.start()
+    return text[:cut], text[cut:]
+
+
+def word_aligned(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    The text of `chunks`, re-cut so that encoding (or counting the words of)
+    each piece gives the same result as doing so on the concatenated text.
+    """
+    carry = ''
+    for chunk in chunks:
+        head, carry = _split_last_word(carry + chunk)
+        if len(carry) > MAX_CARRY_CHARS:
+            head, carry = head + carry, ''
+        if head:
+            yield head
+    if carry:
+        yield carry
+
+Pair = Tuple[int, int]
+
+
+def _utf8(text: str) -> bytes:
+    return text.encode('utf-8', errors='surrogatepass')
+
+
+def _merge(ids: List[int], pair: Pair, new_id: int) -> List[int]:
+    out, i = [], 0
+    while i < len(ids):
+        if i + 1 < len(ids) and ids[i] == pair[0] and ids[i + 1] == pair[1]:
+            out.append(new_id)
+            i += 2
+        else:
+            out.append(ids[i])
+            i += 1
+    return out
+
+
+class BPETokenizer:
+    """Byte-level BPE: 256 byte tokens, then one token per learned merge."""
+
+    kind = 'bpe'
+    start_id = ord('\n')
+
+    def __init__(self, merges: Sequence[Pair]):
+        self.merges: List[Pair] = [(int(a), int(b)) for a, b in merges]
+        self._ranks: Dict[Pair, int] = {pair: i for i, pair in enumerate(self.merges)}
+        self._bytes: List[bytes] = [bytes([b]) for b in range(256)]
+        for a, b in self.merges:
+            self._bytes.append(self._bytes[a] + self._bytes[b])
+        self.vocab: List[str] = [t.decode('utf-8', errors='backslashreplace') for t in self._bytes]
+        self._word_cache: Dict[str, List[int]] = {}
+
+    @classmethod
+    def train(cls, texts: Iterable[str], vocab_size: int = DEFAULT_BPE_VOCAB_SIZE) -> 'BPETokenizer':
+        """
+        Learn up to vocab_size - 256 merges from `texts` (any chunking).
+        Ties between equally frequent pairs go to the smallest pair, so the
+        same corpus always yields the same tokenizer.
+        """
+        word_counts: Counter = Counter()
+        for text in texts:
+            word_counts.update(_WORD_RE.findall(text))
+        words = [list(_utf8(w)) for w in word_counts]
+        freqs = list(word_counts.values())
+
+        # Pair counts over distinct words, and which words contain each pair
+        pair_counts: Counter = Counter()
+        where: Dict[Pair, set] = defaultdict(set)
+        for i, ids in enumerate(words):
+            for pair in zip(ids, ids[1:]):
+                pair_counts[pair] += freqs[i]
+                where[pair].add(i)
+
+        merges: List[Pair] = []
+        for new_id in range(256, vocab_size):
+            if not pair_counts:
+                break
+            pair = max(pair_counts, key=lambda p: (pair_counts[p], -p[0], -p[1]))
+            if pair_counts[pair] < 2:
+                break
+            merges.append(pair)
+            for i in where.pop(pair):
+                ids, f = words[i], freqs[i]
+                merged = _merge(ids, pair, new_id)
+                if len(merged) == len(ids):
+                    continue   # stale entry: an earlier merge already consumed the pair
+                for p in zip(ids, ids[1:]):
+                    pair_counts[p] -= f
+                    if pair_counts[p] <= 0:
+                        del pair_counts[p]
+                for p in zip(merged, merged[1:]):
+                    pair_counts[p] += f
+                    where[p].add(i)
+                words[i] = merged
+        return cls(merges)
+
+    def __len__(self) -> int:
+        return len(self._bytes)
+
+    @property
+    def char_to_idx(self) -> Dict[str, int]:
+        return {label: i for i, label in enumerate(self.vocab)}
+
+    @property
+    def idx_to_char(self) -> Dict[int, str]:
+        return dict(enumerate(self.vocab))
+
+    @property
+    def spec(self) -> Dict:
+        return {'type': self.kind, 'merges': [list(pair) for pair in self.merges]}
+
+    # ── encode ─────────────────────────────────────────────────────────────
+
+    def _encode_word(self, word: str) -> List[int]:
+        ids = self._word_cache.get(word)
+        if ids is not None:
+            return ids
+        ids = list(_utf8(word))
+        while len(ids) > 1:
+            pair = min(zip(ids, ids[1:]), key=lambda p: self._ranks.get(p, len(self._ranks)))
+            rank = self._ranks.get(pair)
+            if rank is None:
+                break
+            ids = _merge(ids, pair, 256 + rank)
+        self._word_cache[word] = ids
+        return ids
+
+    def encode(self, text: str) -> np.ndarray:
+        """Token ids (int32) for `text`."""
+        ids: List[int] = []
+        for word in _WORD_RE.findall(text):
+            ids.extend(self._encode_word(word))
+        return np.array(ids, dtype=np.int32)
+
+    def unknown_chars(self, text: str) -> List[str]:
+        return []   # every string is some sequence of bytes
+
+    # ── decode ─────────────────────────────────────────────────────────────
+
+    def _valid(self, ids: Ids) -> List[int]:
+        ids = np.asarray(ids, dtype=np.int64).ravel()
+        return ids[(ids >= 0) & (ids < len(self._bytes))].tolist()
+
+    def decode(self, ids: Ids) -> str:
+        return b''.join(self._bytes[i] for i in self._valid(ids)).decode('utf-8', errors='replace')
+
+    def id_to_token(self, ids: Ids) -> List[str]:
+        """One label per id, for per-token UI payloads."""
+        return [self.vocab[i] for i in self._valid(ids)]
+
+
+def tokenizer_from_spec(spec: Dict) -> Union[CharTokenizer, BPETokenizer]:
+    """Rebuild a tokenizer from its `spec` dict."""
+    if spec['type'] == 'char':
+        return CharTokenizer(spec['vocab'])
+    if spec['type'] == 'bpe':
+        return BPETokenizer(spec['merges'])
+    raise ValueError(f"Unknown tokenizer type: {spec['type']}")
@@ -2,23 +2,37 @@
 trainer.py — Real MicroGPT training loop.
 
 Run as a Socket.IO background task (socketio.start_background_task).
-Replaces the stub loop in app.py.
+Replaces the stub loop in app.py.  Eval-interval work (loss estimate,
+sample, embeddings, attention) runs in an EvalObserver beside the loop.
 """
 
 import math
+import os
+import threading
 import torch
 import torch.nn as nn
 
 from models import SessionStatus, TrainingSession
 from micro_gpt import MicroGPT
+from sampling import top_k_table
+from eval_observer import EvalObserver
+from step_scheduler import StepScheduler
+from batch_prefetcher import BatchPrefetcher
+from loss_estimator import DEFAULT_MAX_TOKENS, build_eval_sets, estimate_loss
+from corpus_cache import DEFAULT_CACHE_DIR, prepare_cached_dataset, prepare_cached_file_dataset
+from tokenizer import DEFAULT_BPE_VOCAB_SIZE
+from wire_format import WIRE_FORMATS
 from dataset_loader import (
-    prepare_dataset,
-    load_dataset,
+    bundled_dataset_path,
     load_from_file,
-    get_batch,
-    decode,
 )
 from metrics_emitter import (
+    DEFAULT_EMIT_RATE,
+    KEYFRAME_INTERVAL,
+    EVAL_EVENT_MODES,
+    DeltaEncoder,
+    EmitQueue,
+    EvalFrame,
     emit_training_metrics,
     emit_generated_sample,
     emit_attention_snapshot,
@@ -32,6 +46,12 @@ from metrics_emitter import (
 # Path to pre-bundled datasets directory (set by app.py before first use)
 DATASETS_DIR: str = ''
 
+# Tokenized corpora shared across sessions (see corpus_cache.py)
+CORPUS_CACHE_DIR: str = DEFAULT_CACHE_DIR
+
+# Candidates sent to the probability tower per eval
+TOKEN_TABLE_SIZE = 16
+
 
 # ---------------------------------------------------------------------------
 # Learning-rate schedule
@@ -53,34 +73,6 @@ def _get_lr(step: int, warmup_steps: int, max_iters: int, lr: float) -> float:
     return lr / 10.0 + cosine * (lr - lr / 10.0)
 
 
-# ---------------------------------------------------------------------------
-# Loss estimation (no-grad, runs on train and val splits)
-# ---------------------------------------------------------------------------
-
-@torch.no_grad()
-def _estimate_loss(
-    model: MicroGPT,
-    train_data: torch.Tensor,
-    val_data:   torch.Tensor,
-    block_size: int,
-    batch_size: int,
-    eval_iters: int,
-    device:     torch.device,
-) -> tuple[float, float]:
-    model.eval()
-    losses = {}
-    for split, data in (('train', train_data), ('val', val_data)):
-        total = 0.0
-        iters = min(eval_iters, max(1, (len(data) - block_size) // batch_size))
-        for _ in range(iters):
-            x, y = get_batch(data, block_size, batch_size, device)
-            _, loss = model(x, y)
-            total += loss.item()
-        losses[split] = total / iters
-    model.train()
-    return losses['train'], losses['val']
-
-
 # ---------------------------------------------------------------------------
 # Main training entry point
 # ---------------------------------------------------------------------------
@@ -89,18 +81,36 @@ def run_training(session: TrainingSession, socketio) -> None:
     """
     Full training loop for one session.  Called as a background task.
 
-    Reads all config from `session`, emits events via `socketio`.
+    Reads all config from `session`, emits events via `socketio` — through
+    a per-session EmitQueue, so a slow client never stalls the loop.
     """
+    emits = EmitQueue(
+        socketio, rate=session.training_config.get('emit_rate', DEFAULT_EMIT_RATE),
+    ).start()
+    try:
+        _run_training(session, emits)
+    finally:
+        emits.close()
+        session.emit_stats = emits.stats()
+
+
+def _run_training(session: TrainingSession, socketio: EmitQueue) -> None:
     session_id = session.session_id
 
     # ── 1. Load / prepare dataset ──────────────────────────────────────────
+    # .txt corpora (bundled and uploaded) are streamed, never read whole
+    text, path = None, None
     try:
         if session.text_corpus:
             text = session.text_corpus
+        elif session.dataset_path.lower().endswith('.txt'):
+            path = session.dataset_path
         elif session.dataset_path:
             text = load_from_file(session.dataset_path)
         else:
-            text = load_dataset(session.dataset_name, DATASETS_DIR)
+            path = bundled_dataset_path(session.dataset_name, DATASETS_DIR)
+        if path is not None and not os.path.isfile(path):
+            raise FileNotFoundError(f'Dataset file not found: {path}')
     except Exception as e:
         session.status = SessionStatus.ERROR
         session.error_message = str(e)
@@ -108,7 +118,17 @@ def run_training(session: TrainingSession, socketio) -> None:
         return
 
     try:
-        ds = prepare_dataset(text, block_size=session.model_config['block_size'])
+        block_size = session.model_config['block_size']
+        # 'char' (default) or 'bpe': subword tokens, more text per block_size
+        tokenization = {
+            'cache_dir':      CORPUS_CACHE_DIR,
+            'tokenizer':      session.training_config.get('tokenizer', 'char'),
+            'bpe_vocab_size': session.training_config.get('bpe_vocab_size', DEFAULT_BPE_VOCAB_SIZE),
+        }
+        if path is not None:
+            ds = prepare_cached_file_dataset(path, block_size, **tokenization)
+        else:
+            ds = prepare_cached_dataset(text, block_size, **tokenization)
     except Exception as e:
         session.status = SessionStatus.ERROR
         session.error_message = str(e)
@@ -119,6 +139,7 @@ def run_training(session: TrainingSession, socketio) -> None:
     session.vocab       = ds['vocab']
     session.char_to_idx = ds['char_to_idx']
     session.idx_to_char = ds['idx_to_char']
+    session.tokenizer   = ds['tokenizer']
     session.model_config['vocab_size'] = ds['vocab_size']
 
     train_data = ds['train_data']
@@ -128,7 +149,16 @@ def run_training(session: TrainingSession, socketio) -> None:
     device = torch.device('cpu')
 
     try:
-        model = MicroGPT(session.model_config).to(device)
+        seed = session.training_config.get('seed')
+        # A seeded run also gets the same initial weights, without touching
+        # the global RNG other in-process sessions draw from
+        with torch.random.fork_rng(devices=[]):
+            if seed is not None:
+                torch.manual_seed(seed)
+            model = MicroGPT(session.model_config).to(device)
+        # Held for each optimizer step; RPCs (training_worker) take it to use
+        # the model between steps, from another thread in a worker process
+        session._model_lock = model_lock = threading.Lock()
         session.model_instance = model
         # Restore weights if this session was loaded from a saved checkpoint
         resume_ckpt = getattr(session, '_resume_checkpoint', None)
@@ -147,17 +177,30 @@ def run_training(session: TrainingSession, socketio) -> None:
     warmup_steps  = tc.get('warmup_steps',   50)
     grad_clip     = tc.get('grad_clip',      1.0)
     temperature   = tc.get('temperature',    0.8)
-    eval_iters    = 20   # how many batches to average when estimating loss
+    eval_iters    = 20   # eval set size, in batches per split
+    # Float arrays in eval events: JSON lists, or binary (see wire_format.py)
+    wire_format   = tc.get('wire_format', 'json')
+    if wire_format not in WIRE_FORMATS:
+        wire_format = 'json'
+    # Attention / embedding frames as keyframes + deltas (see DeltaEncoder)
+    encoder = None
+    if tc.get('delta_frames'):
+        encoder = DeltaEncoder(wire_format, tc.get('keyframe_interval', KEYFRAME_INTERVAL))
+    # Per-eval events: separate ('events'), one eval_frame ('frame'), or both
+    eval_events = tc.get('eval_events', 'events')
+    if eval_events not in EVAL_EVENT_MODES:
+        eval_events = 'events'
 
     optimizer = torch.optim.AdamW(model.parameters(), lr=lr, weight_decay=0.0)
     session.optimizer = optimizer
 
     if resume_ckpt:
-        model.load_state_dict(resume_ckpt['model_state'])
-        try:
-            optimizer.load_state_dict(resume_ckpt['optimizer_state'])
-        except Exception:
-            pass  # optimizer state mismatch is non-fatal (e.g. different param groups)
+        with model_lock:
+            model.load_state_dict(resume_ckpt['model_state'])
+            try:
+                optimizer.load_state_dict(resume_ckpt['optimizer_state'])
+            except Exception:
+                pass  # optimizer state mismatch is non-fatal (e.g. different param groups)
         session.current_iter = getattr(session, '_resume_from_step', 0)
         session._resume_checkpoint = None  # free memory
 
@@ -166,112 +209,137 @@ def run_training(session: TrainingSession, socketio) -> None:
         socketio, session_id,
         vocab=ds['vocab'],
         char_to_idx=ds['char_to_idx'],
-        text_preview=text[:500],
+        text_preview=ds['preview'],
+        tokenizer=ds['tokenizer'].spec,
+    )
+
+    # ── 2c. Eval observer: loss, sample, embeddings, attention off the loop ──
+    # Fixed windows, picked once, so every interval scores the same text.
+    # A split too short for one window surfaces as an eval_error each interval.
+    try:
+        eval_sets = build_eval_sets(
+            train_data, val_data, block_size,
+            num_windows=tc.get('eval_windows', eval_iters * batch_size),
+            device=device,
+        )
+        eval_set_error = None
+    except ValueError as e:
+        eval_sets, eval_set_error = None, e
+    eval_max_tokens = tc.get('eval_max_tokens', DEFAULT_MAX_TOKENS)
+
+    def compute_eval(eval_model: MicroGPT, job: dict) -> dict:
+        if eval_set_error is not None:
+            raise eval_set_error
+        losses = estimate_loss(eval_model, eval_sets, eval_max_tokens)
+        train_loss, val_loss = losses['train'], losses['val']
+        sample_text, last_logits, last_token = _generate_sample(
+            eval_model, ds['tokenizer'], device,
+            temperature=temperature, return_logits=True,
+        )
+        table = None
+        if last_logits is not None:
+            table = top_k_table(last_logits, temperature, table_size=TOKEN_TABLE_SIZE)
+        return {
+            'train_loss': train_loss,
+            'val_loss':   val_loss,
+            'sample':     sample_text,
+            'last_token': last_token,
+            'table':      table,
+            'coords':     eval_model.extract_embeddings_3d(as_array=True),
+            'attention':  _probe_attention(eval_model, job['probe']),
+        }
+
+    def publish_eval(job: dict, result: dict) -> None:
+        if eval_events == 'events':
+            _publish_eval(socketio, session, ds, job, result, temperature, wire_format, encoder)
+            return
+        frame = EvalFrame(socketio, session_id, job['step'], forward=eval_events == 'both')
+        _publish_eval(frame, session, ds, job, result, temperature, wire_format, encoder)
+        frame.send()
+
+    def on_eval_error(job: dict, exc: Exception) -> None:
+        emit_error(socketio, session_id, 'eval_error', f'step {job["step"]}: {exc}')
+
+    observer = EvalObserver(
+        socketio,
+        model_factory=lambda: MicroGPT(session.model_config).to(device),
+        compute=compute_eval,
+        publish=publish_eval,
+        on_error=on_eval_error,
+        max_pending=tc.get('eval_max_pending', 1),
     )
 
     # ── 3. Training loop ───────────────────────────────────────────────────
     model.train()
+    # Batches are sampled ahead on a background thread; x / y live in a
+    # reused ring slot and are valid until the next batches.next() only
+    batches = BatchPrefetcher(
+        train_data, block_size, batch_size, device,
+        depth=tc.get('prefetch_depth', 2),
+        seed=tc.get('seed'),
+    ).start()
+    scheduler = StepScheduler(socketio, session)
+
+    # The prefetcher thread and the observer are shut down however the loop
+    # ends: completion, stop, or an exception from a step or an eval
+    observer.start()
+    try:
+        for step in range(session.current_iter, max_iters):
+
+            # ── pause / stop checks ──
+            was_paused = session.status == SessionStatus.PAUSED
+            while session.status == SessionStatus.PAUSED:
+                if getattr(session, '_step_once', False):
+                    session._step_once = False
+                    break
+                socketio.sleep(0.05)
+            if was_paused:
+                scheduler.reset_clock()
+
+            if session.status in (SessionStatus.STOPPED, SessionStatus.ERROR):
+                return
+
+            session.current_iter = step + 1
+
+            # ── lightweight step progress every 5 steps ──
+            if (step + 1) % 5 == 0:
+                emit_step_progress(
+                    socketio, session_id, step + 1,
+                    steps_per_second=scheduler.steps_per_second,
+                    speed_mode=scheduler.mode,
+                )
+                session.emit_stats = socketio.stats()
 
-    for step in range(session.current_iter, max_iters):
+            # ── learning-rate update ──
+            current_lr = _get_lr(step, warmup_steps, max_iters, lr)
+            for pg in optimizer.param_groups:
+                pg['lr'] = current_lr
 
-        # ── pause / stop checks ──
-        while session.status == SessionStatus.PAUSED:
-            if getattr(session, '_step_once', False):
-                session._step_once = False
-                break
-            socketio.sleep(0.05)
+            # ── forward + backward ──
+            x, y = batches.next()
+            with model_lock:
+                _, loss = model(x, y)
 
-        if session.status in (SessionStatus.STOPPED, SessionStatus.ERROR):
-            return
+                optimizer.zero_grad(set_to_none=True)
+                loss.backward()
 
-        session.current_iter = step + 1
-
-        # ── lightweight step progress every 5 steps ──
-        if (step + 1) % 5 == 0:
-            emit_step_progress(socketio, session_id, step + 1)
-
-        # ── learning-rate update ──
-        current_lr = _get_lr(step, warmup_steps, max_iters, lr)
-        for pg in optimizer.param_groups:
-            pg['lr'] = current_lr
-
-        # ── forward + backward ──
-        x, y = get_batch(train_data, block_size, batch_size, device)
-        _, loss = model(x, y)
-
-        optimizer.zero_grad(set_to_none=True)
-        loss.backward()
-
-        if grad_clip > 0:
-            torch.nn.utils.clip_grad_norm_(model.parameters(), grad_clip)
-
-        optimizer.step()
-
-        # ── eval + emit every eval_interval steps (and on step 1) ──
-        if (step + 1) % eval_interval == 0 or step == 0:
-            train_loss, val_loss = _estimate_loss(
-                model, train_data, val_data,
-                block_size, batch_size, eval_iters, device,
-            )
-
-            # Store in session history
-            record = {
-                'step':       step + 1,
-                'train_loss': round(train_loss, 4),
-                'val_loss':   round(val_loss,   4),
-            }
-            session.loss_history.append(record)
-
-            # Emit loss metrics
-            emit_training_metrics(
-                socketio, session_id,
-                step + 1, train_loss, val_loss,
-            )
-
-            # Generate a text sample (with logits for probability tower)
-            sample_text, last_logits = _generate_sample(
-                model, ds['idx_to_char'], device,
-                temperature=temperature, return_logits=True,
-            )
-            sample_record = {
-                'step':   step + 1,
-                'text':   sample_text,
-                'prompt': '',
-            }
-            session.generated_samples.append(sample_record)
-            emit_generated_sample(
-                socketio, session_id,
-                step + 1, sample_text,
-            )
-
-            # Emit token probabilities for the last generated character
-            if last_logits is not None:
-                gen_char = sample_text[-1] if sample_text else ''
-                emit_token_probabilities(
-                    socketio, session_id,
-                    step + 1,
-                    logits=last_logits,
-                    generated_token=gen_char,
-                    vocab=ds['vocab'],
-                )
+                if grad_clip > 0:
+                    torch.nn.utils.clip_grad_norm_(model.parameters(), grad_clip)
+
+                optimizer.step()
 
-            # Emit embedding snapshot (3D-reduced)
-            coords_3d = model.extract_embeddings_3d()
-            emit_embedding_snapshot(
-                socketio, session_id,
-                step + 1,
-                coords=coords_3d,
-                labels=ds['vocab'],
-            )
+            # ── hand eval work to the observer every eval_interval steps (and on step 1) ──
+            if (step + 1) % eval_interval == 0 or step == 0:
+                observer.submit(step + 1, model, probe=x[:1].clone())
 
-            # Extract and emit attention snapshots
-            _emit_attention(
-                socketio, session_id, model, step + 1,
-                x, ds['idx_to_char'],
-            )
+            # Yield to the event loop per time budget / speed setting
+            scheduler.step_done()
 
-        # Yield briefly so the event loop can emit WebSocket events (10ms)
-        socketio.sleep(0.01)
+        # Publish the last eval results before reporting final losses
+        observer.close()
+    finally:
+        batches.close()
+        observer.close(drain=False)   # no-op after the drain above
 
     # ── 4. Completion ──────────────────────────────────────────────────────
     from datetime import datetime
@@ -279,7 +347,7 @@ def run_training(session: TrainingSession, socketio) -> None:
     session.status       = SessionStatus.COMPLETED
     session.completed_at = datetime.now()
 
-    final = session.loss_history[-1] if session.loss_history else {}
+    final = session.history.last_metrics or {}
     elapsed = (
         round((session.completed_at - session.started_at).total_seconds(), 2)
         if session.started_at else None
@@ -303,19 +371,19 @@ def run_training(session: TrainingSession, socketio) -> None:
 
 def _generate_sample(
     model: MicroGPT,
-    idx_to_char: dict,
+    tokenizer,
     device: torch.device,
     max_new_tokens: int = 100,
     temperature: float = 0.8,
     return_logits: bool = False,
-) -> str | tuple[str, list[float] | None]:
+) -> str | tuple[str, torch.Tensor | None, str]:
     """Generate a short text sample from the current model weights.
 
-    If return_logits is True, also returns raw logits for the last token
-    as a plain Python list (for the probability tower feature).
+    If return_logits is True, also returns the raw (vocab_size,) logits for
+    the last token and that token's label (for the probability tower feature).
     """
     model.eval()
-    seed = torch.zeros((1, 1), dtype=torch.long, device=device)
+    seed = torch.full((1, 1), tokenizer.start_id, dtype=torch.long, device=device)
     with torch.no_grad():
         result = model.generate(
             seed, max_new_tokens=max_new_tokens,
@@ -326,36 +394,83 @@ def _generate_sample(
 
     if return_logits:
         out, raw_logits = result
-        tokens = out[0].tolist()
-        text = decode(tokens, idx_to_char)
-        return text, raw_logits.numpy().tolist()
+        ids = out[0].cpu().numpy()
+        return tokenizer.decode(ids), raw_logits, tokenizer.id_to_token(ids[-1:])[0]
     else:
-        tokens = result[0].tolist()
-        return decode(tokens, idx_to_char)
+        return tokenizer.decode(result[0].cpu().numpy())
 
 
-def _emit_attention(
-    socketio,
-    session_id: str,
-    model: MicroGPT,
-    step: int,
-    x: torch.Tensor,
-    idx_to_char: dict,
-) -> None:
+def _probe_attention(model: MicroGPT, x: torch.Tensor) -> list[dict]:
     """
-    Run one forward pass in eval mode to capture attention weights,
-    then emit one snapshot per (layer, head).
+    Run one forward pass in eval mode to capture attention weights.
+
+    Returns one snapshot per (layer, head), see extract_attention_weights;
+    matrices are float32 arrays, packed for the wire by the emitter.
     """
     model.eval()
-    with torch.no_grad():
-        model(x[:1])   # single example, populates last_attention on every Head
+    with torch.no_grad(), model.capture_attention():
+        model(x[:1])   # single example, populates last_attention in every block
     model.train()
+    return model.extract_attention_weights(as_arrays=True)
 
-    # Decode the token context used (first example, first block_size tokens)
-    token_indices = x[0].tolist()
-    tokens = [idx_to_char.get(i, '?') for i in token_indices]
 
-    for snap in model.extract_attention_weights():
+def _publish_eval(
+    socketio,
+    session: TrainingSession,
+    ds: dict,
+    job: dict,
+    result: dict,
+    temperature: float,
+    wire_format: str = 'json',
+    encoder: DeltaEncoder | None = None,
+) -> None:
+    """Record one eval result on the session and emit it, tagged with its step."""
+    session_id = session.session_id
+    if encoder is not None and session.keyframe_requested:
+        # A client (re)joined: everything it gets next must be a keyframe
+        session.keyframe_requested = False
+        encoder.reset()
+    step       = job['step']
+    tokenizer  = ds['tokenizer']
+    train_loss, val_loss = result['train_loss'], result['val_loss']
+
+    # Store in session history
+    history = session.history
+    history.record_metrics(step, round(train_loss, 4), round(val_loss, 4))
+    emit_training_metrics(socketio, session_id, step, train_loss, val_loss)
+
+    sample_text = result['sample']
+    history.record_sample(step, sample_text)
+    emit_generated_sample(socketio, session_id, step, sample_text)
+
+    # Top candidates for the last generated token
+    table = result['table']
+    if table is not None:
+        probs = {
+            'tokens':          tokenizer.id_to_token(table.top_indices.numpy()),
+            'probs':           table.top_probs.numpy(),
+            'logits':          table.top_logits.numpy(),
+            'generated_token': result['last_token'],
+            'temperature':     temperature,
+        }
+        history.record_token_probs(step, probs)
+        emit_token_probabilities(socketio, session_id, step, **probs, wire_format=wire_format)
+
+    # Embedding snapshot (3D-reduced)
+    history.record_embedding(step, result['coords'], ds['vocab'])
+    emit_embedding_snapshot(
+        socketio, session_id,
+        step,
+        coords=result['coords'],
+        labels=ds['vocab'],
+        wire_format=wire_format,
+        encoder=encoder,
+    )
+
+    # Attention snapshots over the probe context
+    tokens = tokenizer.id_to_token(job['probe'][0].numpy())
+    for snap in result['attention']:
+        history.record_attention(step, snap['layer'], snap['head'], snap['matrix'], tokens)
         emit_attention_snapshot(
             socketio,
             session_id   = session_id,
@@ -364,4 +479,6 @@ def _emit_attention(
             head         = snap['head'],
             matrix       = snap['matrix'],
             tokens       = tokens,
+            wire_format  = wire_format,
+            encoder      = encoder,
         )
@@ -1,15 +1,108 @@
+import os
 import uuid
 from datetime import datetime
-from typing import Dict, Optional
+from typing import Any, Dict, Optional
 
 from models import TrainingSession, SessionStatus, FeatureType
+from training_worker import RPC_METHODS, WorkerHandle, apply_command
+
+
+# Model size presets selectable via hyperparameters['model_size']
+MODEL_SIZE_CONFIGS: Dict[str, Dict] = {
+    'small':  {'n_embd': 32, 'n_layer': 3, 'n_head': 4, 'block_size': 96},
+    'medium': {'n_embd': 64, 'n_layer': 4, 'n_head': 4, 'block_size': 128},
+    'large':  {'n_embd': 96, 'n_layer': 6, 'n_head': 6, 'block_size': 256},
+}
+
+# Integer training_config keys accepted within [lo, hi] (None = unbounded);
+# out-of-range or non-integer values are ignored and the trainer's default used
+INT_TRAINING_KEYS: Dict[str, tuple] = {
+    'seed':             (0, 2**63 - 1),   # batch order and model init
+    'prefetch_depth':   (1, 16),          # batches sampled ahead
+    'eval_windows':     (1, None),        # windows in the fixed eval set, per split
+    'eval_max_tokens':  (1, None),        # tokens per eval forward
+    'eval_max_pending': (1, 16),          # eval snapshots waiting for the observer
+}
+
+
+def _checked_int(value: Any, lo: int, hi: Optional[int]) -> Optional[int]:
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    if isinstance(value, float) and not value.is_integer():   # also NaN / inf
+        return None
+    value = int(value)
+    if value < lo or (hi is not None and value > hi):
+        return None
+    return value
+
+
+# Sessions that hold a share of the CPU thread budget
+_ACTIVE_STATUSES = (SessionStatus.RUNNING, SessionStatus.PAUSED)
+
+
+def default_thread_budget() -> int:
+    """Threads available to training workers: every core but one for the server."""
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS / Windows
+        cores = os.cpu_count() or 1
+    return max(1, cores - 1)
+
+
+def thread_weight(model_config: Dict) -> float:
+    """Relative CPU demand of a model (n_layer × n_embd: small 1 : medium 2.7 : large 6)."""
+    return model_config.get('n_layer', 4) * model_config.get('n_embd', 64)
+
+
+def allocate_threads(weights: Dict[str, float], budget: int) -> Dict[str, int]:
+    """
+    Split `budget` threads across sessions in proportion to their weights.
+
+    Every session gets at least one thread (so the budget is exceeded only
+    when there are more sessions than threads); the rest is shared out by
+    largest remainder.
+    """
+    if not weights:
+        return {}
+    allocation = {sid: 1 for sid in weights}
+    spare = budget - len(weights)
+    if spare <= 0:
+        return allocation
+
+    total  = sum(weights.values())
+    shares = {sid: spare * w / total for sid, w in weights.items()}
+    for sid, share in shares.items():
+        allocation[sid] += int(share)
+    leftover = budget - sum(allocation.values())
+    by_remainder = sorted(shares, key=lambda sid: shares[sid] - int(shares[sid]), reverse=True)
+    for sid in by_remainder[:leftover]:
+        allocation[sid] += 1
+    return allocation
 
 
 class TrainingManager:
-    """Manages all active training sessions."""
+    """
+    Manages all active training sessions.
 
-    def __init__(self):
+    With `use_processes` (the default) each session trains in its own worker
+    process (see training_worker.py); the TrainingSession kept here is the
+    server's mirror of it.  Without, training runs as a background task on
+    `socketio` in this process, as before.
+
+    Workers share a CPU budget of `thread_budget` torch threads, split by
+    model size across running and paused sessions and rebalanced whenever
+    a session starts or finishes (see allocate_threads).  In-process mode
+    has a single torch thread pool, so no budget is applied there.
+    """
+
+    def __init__(self, socketio: Any = None, use_processes: bool = True,
+                 datasets_dir: str = '', thread_budget: Optional[int] = None):
         self.sessions: Dict[str, TrainingSession] = {}
+        self.workers: Dict[str, WorkerHandle] = {}
+        self.thread_budget  = thread_budget or default_thread_budget()
+        self._socketio      = socketio
+        self._use_processes = use_processes
+        self._datasets_dir  = datasets_dir
 
     def create_session(self, feature_type: str, dataset_id: str,
                        hyperparameters: Optional[Dict] = None) -> str:
@@ -29,13 +122,8 @@ class TrainingManager:
         if hyperparameters:
             # Apply model size preset first
             model_size = hyperparameters.get('model_size', 'medium')
-            model_size_configs = {
-                'small':  {'n_embd': 32, 'n_layer': 3, 'n_head': 4, 'block_size': 96},
-                'medium': {'n_embd': 64, 'n_layer': 4, 'n_head': 4, 'block_size': 128},
-                'large':  {'n_embd': 96, 'n_layer': 6, 'n_head': 6, 'block_size': 256},
-            }
-            if model_size in model_size_configs:
-                for key, value in model_size_configs[model_size].items():
+            if model_size in MODEL_SIZE_CONFIGS:
+                for key, value in MODEL_SIZE_CONFIGS[model_size].items():
                     session.model_config[key] = value
 
             # Allow overriding individual model_config keys
@@ -45,9 +133,15 @@ class TrainingManager:
 
             # Apply training_config keys
             for key in ('batch_size', 'max_iters', 'learning_rate', 'eval_interval',
-                        'warmup_steps', 'grad_clip', 'temperature'):
+                        'warmup_steps', 'grad_clip', 'temperature',
+                        'tokenizer', 'bpe_vocab_size', 'wire_format', 'emit_rate',
+                        'delta_frames', 'keyframe_interval', 'eval_events'):
                 if key in hyperparameters:
                     session.training_config[key] = hyperparameters[key]
+            for key, (lo, hi) in INT_TRAINING_KEYS.items():
+                value = _checked_int(hyperparameters.get(key), lo, hi)
+                if value is not None:
+                    session.training_config[key] = value
 
         self.sessions[session_id] = session
         return session_id
@@ -63,40 +157,128 @@ class TrainingManager:
         session.started_at = datetime.now()
         return True
 
-    def pause_training(self, session_id: str) -> bool:
-        session = self.get_session(session_id)
-        if not session or session.status != SessionStatus.RUNNING:
+    def launch_training(self, session_id: str) -> bool:
+        """Mark the session running and start its training loop."""
+        # A restarted session gets a fresh worker; the old one is gone before
+        # the session is marked running, so its exit cannot be mistaken for a crash
+        old = self.workers.pop(session_id, None)
+        if old:
+            old.shutdown()
+        if not self.start_training(session_id):
             return False
-        session.status = SessionStatus.PAUSED
+        session = self.sessions[session_id]
+
+        if not self._use_processes:
+            import trainer
+            self._socketio.start_background_task(trainer.run_training, session, self._socketio)
+            return True
+
+        worker = WorkerHandle(session, self._socketio, self._datasets_dir,
+                              on_status_change=lambda _: self.rebalance_threads())
+        self.workers[session_id] = worker
+        # Sets session.num_threads before start() so the worker boots with it
+        self.rebalance_threads()
+        worker.start()
         return True
 
+    def pause_training(self, session_id: str) -> bool:
+        return self._command(session_id, 'pause')
+
     def resume_training(self, session_id: str) -> bool:
-        session = self.get_session(session_id)
-        if not session or session.status != SessionStatus.PAUSED:
-            return False
-        session.status = SessionStatus.RUNNING
-        return True
+        return self._command(session_id, 'resume')
 
     def stop_training(self, session_id: str) -> bool:
-        session = self.get_session(session_id)
-        if not session:
-            return False
-        session.status = SessionStatus.STOPPED
-        return True
+        return self._command(session_id, 'stop')
+
+    def step_training(self, session_id: str) -> bool:
+        """Run a single step of a paused session, then pause again."""
+        return self._command(session_id, 'step')
 
     def set_speed(self, session_id: str, speed_multiplier: float) -> bool:
+        try:
+            speed_multiplier = float(speed_multiplier)
+        except (TypeError, ValueError):
+            return False
+        if speed_multiplier <= 0:
+            return False
+        return self._command(session_id, 'set_speed', speed_multiplier=speed_multiplier)
+
+    def resync(self, session_id: str) -> bool:
+        """Make the session's next attention / embedding frames keyframes."""
+        return self._command(session_id, 'resync')
+
+    def model_ready(self, session_id: str) -> bool:
+        """True once the session's model exists (wherever it lives)."""
         session = self.get_session(session_id)
         if not session:
             return False
-        session.speed_multiplier = float(speed_multiplier)
-        return True
+        worker = self.workers.get(session_id)
+        if worker:
+            return worker.alive and worker.model_ready
+        return session.model_instance is not None
+
+    def call(self, session_id: str, method: str, **kwargs) -> Any:
+        """
+        Run a model-side operation (training_worker.RPC_METHODS) for a session.
+        Raises KeyError for an unknown session, RuntimeError if it fails.
+        """
+        session = self.sessions[session_id]
+        worker = self.workers.get(session_id)
+        if worker:
+            return worker.call(method, **kwargs)
+        try:
+            return RPC_METHODS[method](session, **kwargs)
+        except Exception as e:
+            raise RuntimeError(str(e)) from e
 
     def cleanup_session(self, session_id: str) -> bool:
+        worker = self.workers.pop(session_id, None)
+        if worker:
+            worker.shutdown()
+            self.rebalance_threads()
         if session_id in self.sessions:
             del self.sessions[session_id]
             return True
         return False
 
+    def rebalance_threads(self) -> Dict[str, int]:
+        """Recompute the thread allocation and push changes to the workers."""
+        active = {
+            sid: thread_weight(self.sessions[sid].model_config)
+            for sid, worker in self.workers.items()
+            if self.sessions[sid].status in _ACTIVE_STATUSES
+        }
+        allocation = allocate_threads(active, self.thread_budget)
+        for sid in self.workers:
+            session = self.sessions[sid]
+            threads = allocation.get(sid, 0)
+            if threads and threads != session.num_threads:
+                self._command(sid, 'set_threads', num_threads=threads)
+            elif not threads:
+                session.num_threads = 0
+        return allocation
+
+    def get_thread_allocation(self) -> Dict:
+        return {
+            'thread_budget': self.thread_budget,
+            'allocations': {
+                sid: self.sessions[sid].num_threads
+                for sid in self.workers if self.sessions[sid].num_threads
+            },
+        }
+
+    def _command(self, session_id: str, name: str, **args) -> bool:
+        """Apply a control command locally and forward it to the worker."""
+        session = self.get_session(session_id)
+        if not session or not apply_command(session, name, args):
+            return False
+        worker = self.workers.get(session_id)
+        if worker:
+            worker.command(name, **args)
+        if name == 'stop' and worker:
+            self.rebalance_threads()
+        return True
+
     def get_all_sessions(self) -> Dict[str, Dict]:
         result = {}
         for sid, session in self.sessions.items():
@@ -106,5 +288,8 @@ class TrainingManager:
                 'status': session.status.value,
                 'current_iter': session.current_iter,
                 'max_iters': session.training_config.get('max_iters', 500),
+                'speed_multiplier': session.speed_multiplier,
+                'steps_per_second': session.steps_per_second,
+                'num_threads': session.num_threads or None,
             }
         return result
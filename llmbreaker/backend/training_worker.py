@@ -0,0 +1,534 @@
+"""
+training_worker.py — Runs one training session in its own OS process.
+
+The Flask-SocketIO server stays on the eventlet hub; every session's torch
+work runs in a separate interpreter started as
+
+    python training_worker.py <fd>
+
+where <fd> is the child end of a multiprocessing.Pipe.  (A fresh
+interpreter rather than multiprocessing spawn/fork: spawn would re-import
+app.py and monkey-patch the worker, fork would inherit the hub.)
+
+Wire protocol — pickled tuples:
+
+    server → worker   ('init', payload)              always the first message
+                      ('command', (name, args))      pause / resume / stop / step /
+                                                     set_speed / set_threads / resync
+                      ('call', (call_id, method, kwargs))
+                      ('shutdown', None)
+    worker → server   ('emit', (event, payload, room), state)
+                      ('reply', (call_id, ok, result), state)
+                      ('state', None, state)
+
+`state` is a small snapshot of the worker's session (status, step, ...)
+that the server mirrors onto its own TrainingSession.
+
+Model-side operations used by the REST API (next-token generation, saving
+a checkpoint) live in RPC_METHODS so TrainingManager can run them either
+in the worker or, with processes disabled, in-process.
+"""
+
+import dataclasses
+import io
+import itertools
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, Optional
+
+import torch
+
+import checkpoint_manager as _ckpt
+from history_store import HistoryStore
+from metrics_emitter import DeltaDecoder, emit_error
+from models import SessionStatus, TrainingSession
+from sampling import sample_next_token, top_k_table
+from tokenizer import tokenizer_from_spec
+from wire_format import unpack_array
+
+WORKER_SCRIPT = os.path.abspath(__file__)
+
+
+# ---------------------------------------------------------------------------
+# Model-side operations (run wherever the model lives)
+# ---------------------------------------------------------------------------
+
+@contextmanager
+def _model_between_steps(session: TrainingSession):
+    """
+    The session's model, in eval mode, while no optimizer step runs.
+
+    In a worker these RPCs run on the listener thread, beside the training
+    loop; the trainer holds session._model_lock for each step.
+    """
+    model = session.model_instance
+    with getattr(session, '_model_lock', nullcontext()):
+        was_training = model.training
+        model.eval()   # no dropout in generation
+        try:
+            yield model
+        finally:
+            model.train(was_training)
+
+
+def rpc_next_token(
+    session: TrainingSession,
+    context: str,
+    temperature: float = 1.0,
+    top_k: Optional[int] = None,
+    top_p: Optional[float] = None,
+    repetition_penalty: float = 1.0,
+) -> Dict:
+    """Sample the next token after `context` and return the top-10 table."""
+    tokenizer = session.tokenizer
+    with _model_between_steps(session) as model:
+        # Convert the context window (last block_size tokens) to a tensor
+        ids = tokenizer.encode(context)[-model.block_size:]
+        context_used = tokenizer.decode(ids)
+        device = next(model.parameters()).device
+        idx = torch.as_tensor(ids, dtype=torch.long, device=device).unsqueeze(0)
+
+        # One forward for the next-token logits, then sample + top-10 in one call
+        with torch.no_grad():
+            logits, _ = model(idx)
+    sample = sample_next_token(
+        logits[0, -1],
+        temperature=temperature,
+        top_k=top_k,
+        top_p=top_p,
+        repetition_penalty=repetition_penalty,
+        context=idx[0],
+        table_size=10,
+    )
+
+    return {
+        'next_token': tokenizer.id_to_token([int(sample.tokens)])[0],
+        'probabilities': [
+            {'token': token, 'prob': p}
+            for token, p in zip(tokenizer.id_to_token(sample.top_indices.cpu().numpy()),
+                                sample.top_probs.tolist())
+        ],
+        'context_used': context_used,
+    }
+
+
+def rpc_next_token_batch(
+    session: TrainingSession,
+    contexts: list,
+    temperature: Any = 1.0,
+    top_k: Optional[int] = None,
+    top_p: Optional[float] = None,
+) -> list:
+    """rpc_next_token for several contexts in one batched forward pass."""
+    tokenizer = session.tokenizer
+    with _model_between_steps(session) as model:
+        block_size = model.block_size
+        prompts = [tokenizer.encode(context)[-block_size:].tolist() for context in contexts]
+        tokens, logits = model.generate_batch(
+            prompts,
+            max_new_tokens=1,
+            temperature=temperature,
+            return_last_logits=True,
+            top_k=top_k,
+            top_p=top_p,
+        )
+
+    table = top_k_table(logits, temperature, top_k=top_k, top_p=top_p, table_size=10)
+    results = []
+    for prompt, row, row_probs, row_indices in zip(
+        prompts, tokens, table.top_probs.tolist(), table.top_indices.cpu().numpy(),
+    ):
+        results.append({
+            'next_token': tokenizer.id_to_token(row[-1:])[0],
+            'probabilities': [
+                {'token': token, 'prob': float(p)}
+                for token, p in zip(tokenizer.id_to_token(row_indices), row_probs)
+            ],
+            'context_used': tokenizer.decode(prompt),
+        })
+    return results
+
+
+def rpc_save_checkpoint(session: TrainingSession, name: str) -> Dict:
+    """Save the session's model + optimizer to the model library."""
+    if not session.model_instance or not session.optimizer:
+        raise RuntimeError('No model in session yet')
+    last = session.history.last_metrics
+    last_loss = last['train_loss'] if last else None
+    with _model_between_steps(session) as model:
+        return _ckpt.save_checkpoint(
+            model           = model,
+            optimizer       = session.optimizer,
+            model_config    = dict(session.model_config),
+            training_config = dict(session.training_config),
+            feature_type    = session.feature_type.value,
+            step            = session.current_iter,
+            train_loss      = last_loss,
+            name            = name,
+        )
+
+
+RPC_METHODS: Dict[str, Callable] = {
+    'next_token':       rpc_next_token,
+    'next_token_batch': rpc_next_token_batch,
+    'save_checkpoint':  rpc_save_checkpoint,
+}
+
+
+def apply_command(session: TrainingSession, name: str, args: Dict) -> bool:
+    """Apply a control command to a session.  Returns False if it was a no-op."""
+    if name == 'pause':
+        if session.status != SessionStatus.RUNNING:
+            return False
+        session.status = SessionStatus.PAUSED
+    elif name == 'resume':
+        if session.status != SessionStatus.PAUSED:
+            return False
+        session.status = SessionStatus.RUNNING
+    elif name == 'stop':
+        session.status = SessionStatus.STOPPED
+    elif name == 'step':
+        if session.status != SessionStatus.PAUSED:
+            return False
+        # Signal the training loop to execute one step then re-pause
+        session.status = SessionStatus.RUNNING
+        session._step_once = True
+    elif name == 'set_speed':
+        session.speed_multiplier = float(args['speed_multiplier'])
+    elif name == 'set_threads':
+        session.num_threads = int(args['num_threads'])
+    elif name == 'resync':
+        session.keyframe_requested = True
+    else:
+        raise ValueError(f'Unknown command: {name}')
+    return True
+
+
+def _session_state(session: TrainingSession) -> Dict:
+    return {
+        'status':           session.status.value,
+        'current_iter':     session.current_iter,
+        'steps_per_second': session.steps_per_second,
+        'emit_stats':       session.emit_stats,
+        'error_message':    session.error_message,
+        'completed_at':     session.completed_at,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Server side
+# ---------------------------------------------------------------------------
+
+class WorkerHandle:
+    """Server-side handle for one worker process."""
+
+    def __init__(self, session: TrainingSession, socketio: Any, datasets_dir: str,
+                 on_status_change: Optional[Callable[[TrainingSession], None]] = None):
+        self.session   = session
+        self._socketio = socketio
+        self._datasets_dir = datasets_dir
+        self._on_status_change = on_status_change
+
+        self._conn: Optional[Connection] = None
+        self._proc: Optional[subprocess.Popen] = None
+        self._send_lock = threading.Lock()
+        self._call_ids  = itertools.count(1)
+        self._replies: Dict[int, tuple] = {}
+        self._frames = DeltaDecoder()   # full frames for the session's history
+
+        self.alive       = False
+        self.model_ready = False
+        self.retired     = False   # shut down: no longer mirrors into the session
+
+    # ── lifecycle ──────────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        parent_conn, child_conn = multiprocessing.Pipe()
+        # Messages are read only once poll() reports data, so plain blocking
+        # reads are fine and don't depend on how eventlet patched os.read
+        os.set_blocking(parent_conn.fileno(), True)
+        try:
+            self._proc = subprocess.Popen(
+                [sys.executable, WORKER_SCRIPT, str(child_conn.fileno())],
+                pass_fds=(child_conn.fileno(),),
+                cwd=os.path.dirname(WORKER_SCRIPT),
+            )
+        finally:
+            child_conn.close()
+        self._conn = parent_conn
+        self.alive = True
+        self._send(('init', self._init_payload()))
+        self._socketio.start_background_task(self._pump)
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """
+        Ask the worker to exit; kill it if it does not within `timeout`.
+
+        The handle retires first, so a session restarted with a new worker
+        never sees this one's late state, events or exit.
+        """
+        self.retired = True
+        if self.alive:
+            try:
+                self._send(('shutdown', None))
+            except OSError:
+                pass
+        if self._proc is None:
+            return
+        deadline = time.monotonic() + timeout
+        while self._proc.poll() is None and time.monotonic() < deadline:
+            self._socketio.sleep(0.05)
+        if self._proc.poll() is None:
+            self._proc.kill()
+
+    # ── commands and calls ─────────────────────────────────────────────────
+
+    def command(self, name: str, **args) -> None:
+        if self.alive:
+            self._send(('command', (name, args)))
+
+    def call(self, method: str, timeout: float = 30.0, **kwargs) -> Any:
+        """Run RPC_METHODS[method] in the worker and wait for its result."""
+        if not self.alive:
+            raise RuntimeError('Training worker is not running')
+        call_id = next(self._call_ids)
+        self._send(('call', (call_id, method, kwargs)))
+        deadline = time.monotonic() + timeout
+        while call_id not in self._replies:
+            if not self.alive:
+                raise RuntimeError('Training worker exited')
+            if time.monotonic() > deadline:
+                raise RuntimeError(f'Training worker did not answer {method!r} in {timeout}s')
+            self._socketio.sleep(0.01)
+        ok, result = self._replies.pop(call_id)
+        if not ok:
+            raise RuntimeError(result)
+        return result
+
+    # ── internals ──────────────────────────────────────────────────────────
+
+    def _init_payload(self) -> Dict:
+        session = self.session
+        resume = getattr(session, '_resume_checkpoint', None)
+        resume_bytes = None
+        if resume:
+            # Tensors go through torch.save, not the connection's pickler
+            buf = io.BytesIO()
+            torch.save(resume, buf)
+            resume_bytes = buf.getvalue()
+            session._resume_checkpoint = None  # free memory
+        return {
+            # A fresh history: eval frames are replayed from the server's
+            # mirror, the worker keeps the losses only
+            'session': dataclasses.replace(
+                session, model_instance=None, optimizer=None,
+                history=HistoryStore(max_points=session.history.max_points, max_frame_bytes=0),
+            ),
+            'resume_checkpoint': resume_bytes,
+            'resume_from_step':  getattr(session, '_resume_from_step', 0),
+            'datasets_dir':      self._datasets_dir,
+        }
+
+    def _send(self, message: tuple) -> None:
+        with self._send_lock:
+            self._conn.send(message)
+
+    def _pump(self) -> None:
+        """Relay worker messages onto the real Socket.IO server."""
+        while True:
+            try:
+                if not self._conn.poll(0):
+                    self._socketio.sleep(0.02)
+                    continue
+                kind, data, state = self._conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if not self.retired:
+                self._mirror_state(state)
+                if kind == 'emit':
+                    event, payload, room = data
+                    self._mirror_event(event, payload)
+                    self._socketio.emit(event, payload, room=room)
+            if kind == 'reply':
+                call_id, ok, result = data
+                self._replies[call_id] = (ok, result)
+
+        self.alive = False
+        self._conn.close()
+        if self.retired:
+            return
+        session = self.session
+        if session.status in (SessionStatus.RUNNING, SessionStatus.PAUSED):
+            session.status = SessionStatus.ERROR
+            session.error_message = 'Training worker exited unexpectedly'
+            emit_error(self._socketio, session.session_id,
+                       'worker_exited', session.error_message)
+            if self._on_status_change:
+                self._on_status_change(session)
+
+    def _mirror_state(self, state: Dict) -> None:
+        session = self.session
+        previous = session.status
+        session.status           = SessionStatus(state['status'])
+        session.current_iter     = state['current_iter']
+        session.steps_per_second = state['steps_per_second']
+        session.emit_stats       = state['emit_stats']
+        session.error_message    = state['error_message']
+        session.completed_at     = state['completed_at']
+        if session.status != previous and self._on_status_change:
+            self._on_status_change(session)
+
+    def _mirror_event(self, event: str, payload: Dict) -> None:
+        """Keep the server's copy of vocab and history in step with the worker."""
+        session = self.session
+        if event == 'vocab_info':
+            session.vocab       = payload['vocab']
+            session.char_to_idx = payload['char_to_idx']
+            session.idx_to_char = {i: ch for ch, i in payload['char_to_idx'].items()}
+            session.tokenizer   = tokenizer_from_spec(payload['tokenizer'])
+            session.model_config['vocab_size'] = len(payload['vocab'])
+            self.model_ready = True
+        elif event == 'training_metrics':
+            session.history.record_metrics(payload['step'], payload['train_loss'], payload['val_loss'])
+        elif event == 'generated_sample':
+            session.history.record_sample(payload['step'], payload['text'], payload['prompt'])
+        elif event in ('token_probabilities', 'embedding_snapshot', 'attention_snapshot'):
+            self._record_section(event, payload['step'], payload)
+        elif event == 'eval_frame':
+            step = payload['step']
+            if 'metrics' in payload:
+                metrics = payload['metrics']
+                session.history.record_metrics(step, metrics['train_loss'], metrics['val_loss'])
+            if 'sample' in payload:
+                session.history.record_sample(step, payload['sample']['text'], payload['sample']['prompt'])
+            if 'token_probabilities' in payload:
+                self._record_section('token_probabilities', step, payload['token_probabilities'])
+            if 'embedding' in payload:
+                self._record_section('embedding_snapshot', step, payload['embedding'])
+            if 'attention' in payload:
+                tokens = payload['attention']['tokens']
+                for head in payload['attention']['heads']:
+                    self._record_section('attention_snapshot', step, {**head, 'tokens': tokens})
+
+    # In 'both' eval-event mode a step arrives as events and in a frame; the
+    # history skips repeats and DeltaDecoder returns the frame it already has
+    def _record_section(self, event: str, step: int, data: Dict) -> None:
+        history = self.session.history
+        if event == 'token_probabilities':
+            history.record_token_probs(step, {
+                **data, 'probs': unpack_array(data['probs']), 'logits': unpack_array(data['logits']),
+            })
+        elif event == 'embedding_snapshot':
+            coords = self._frames.decode('embedding', data, 'coords')
+            if coords is not None:
+                history.record_embedding(step, coords, data['labels'])
+        else:
+            layer, head = data['layer'], data['head']
+            matrix = self._frames.decode(('attention', layer, head), data, 'matrix')
+            if matrix is not None:
+                history.record_attention(step, layer, head, matrix, data['tokens'])
+
+
+# ---------------------------------------------------------------------------
+# Worker side
+# ---------------------------------------------------------------------------
+
+class _WorkerSocketIO:
+    """
+    Stands in for the Flask-SocketIO server inside a worker: emits are sent
+    back over the channel, background tasks are plain threads.
+    """
+
+    def __init__(self, conn: Connection, session: TrainingSession):
+        self._conn    = conn
+        self._session = session
+        self._lock    = threading.Lock()
+
+    def emit(self, event: str, payload: Dict, room: Optional[str] = None) -> None:
+        self.send('emit', (event, payload, room))
+
+    def sleep(self, seconds: float) -> None:
+        time.sleep(seconds)
+
+    def start_background_task(self, target: Callable, *args, **kwargs) -> threading.Thread:
+        thread = threading.Thread(target=target, args=args, kwargs=kwargs, daemon=True)
+        thread.start()
+        return thread
+
+    def send(self, kind: str, data: Any = None) -> None:
+        # State is captured under the lock so messages never carry stale state
+        with self._lock:
+            self._conn.send((kind, data, _session_state(self._session)))
+
+
+def _listen(conn: Connection, session: TrainingSession, proxy: _WorkerSocketIO,
+            done: threading.Event) -> None:
+    """Handle commands and calls from the server until shutdown."""
+    while True:
+        try:
+            kind, data = conn.recv()
+        except (EOFError, OSError):
+            break
+        if kind == 'command':
+            name, args = data
+            apply_command(session, name, args)
+            if name == 'set_threads':
+                torch.set_num_threads(session.num_threads)
+            proxy.send('state')
+        elif kind == 'call':
+            call_id, method, kwargs = data
+            try:
+                result = RPC_METHODS[method](session, **kwargs)
+                proxy.send('reply', (call_id, True, result))
+            except Exception as e:
+                proxy.send('reply', (call_id, False, str(e)))
+        elif kind == 'shutdown':
+            break
+    if session.status in (SessionStatus.RUNNING, SessionStatus.PAUSED):
+        session.status = SessionStatus.STOPPED
+    done.set()
+
+
+def _worker_main(fd: int) -> None:
+    import trainer
+
+    os.set_blocking(fd, True)
+    conn = Connection(fd)
+    _, init = conn.recv()
+
+    session = init['session']
+    if init['resume_checkpoint'] is not None:
+        session._resume_checkpoint = torch.load(
+            io.BytesIO(init['resume_checkpoint']), map_location='cpu', weights_only=False,
+        )
+        session._resume_from_step = init['resume_from_step']
+    trainer.DATASETS_DIR = init['datasets_dir']
+    if session.num_threads:
+        torch.set_num_threads(session.num_threads)
+
+    proxy = _WorkerSocketIO(conn, session)
+    done  = threading.Event()
+    threading.Thread(target=_listen, args=(conn, session, proxy, done), daemon=True).start()
+
+    try:
+        trainer.run_training(session, proxy)
+    except Exception as e:
+        session.status = SessionStatus.ERROR
+        session.error_message = str(e)
+        emit_error(proxy, session.session_id, 'training_error', str(e))
+    proxy.send('state')
+
+    # Keep the trained model around for generation / saving until shutdown
+    done.wait()
+    conn.close()
+
+
+if __name__ == '__main__':
+    _worker_main(int(sys.argv[1]))
@@ -0,0 +1,65 @@
+"""
+wire_format.py — How float arrays travel in Socket.IO payloads.
+
+Attention matrices, embedding coordinates and token probabilities are sent
+as JSON lists by default.  A session can opt into a binary format instead
+(training_config 'wire_format'); arrays are then packed as
+
+    {'dtype': 'float16', 'shape': [T, T], 'data': <bytes>}
+    {'dtype': 'uint8',   'shape': [T, T], 'data': <bytes>, 'min': lo, 'scale': s}
+
+and python-socketio ships each `data` as a binary attachment rather than as
+text.  float16 keeps ~3 significant digits; uint8 quantizes linearly over
+the array's own [min, max] (value ≈ min + q * scale), which is ample for
+heatmaps and 3-D scatter plots.  Both are little-endian and row-major.
+frontend/src/utils/wireFormat.js unpacks either form back to nested arrays.
+
+Public API
+----------
+WIRE_FORMATS                       ('json', 'float16', 'uint8')
+pack_array(values, wire_format)    →  nested list ('json') or packed dict
+unpack_array(packed)               →  float32 array, exactly as the client decodes it
+"""
+
+from typing import Dict, List, Union
+
+import numpy as np
+
+WIRE_FORMATS = ('json', 'float16', 'uint8')
+
+Packed = Union[List, Dict]
+
+
+def pack_array(values, wire_format: str = 'json') -> Packed:
+    """`values` (array-like of floats) in the session's wire format."""
+    if wire_format == 'json':
+        return values.tolist() if isinstance(values, np.ndarray) else values
+
+    arr = np.asarray(values, dtype=np.float32)
+    packed = {'dtype': wire_format, 'shape': list(arr.shape)}
+    if wire_format == 'float16':
+        packed['data'] = arr.astype('<f2').tobytes()
+    elif wire_format == 'uint8':
+        lo = float(arr.min()) if arr.size else 0.0
+        hi = float(arr.max()) if arr.size else 0.0
+        scale = (hi - lo) / 255.0 or 1.0
+        packed['data']  = np.rint((arr - lo) / scale).astype(np.uint8).tobytes()
+        packed['min']   = lo
+        packed['scale'] = scale
+    else:
+        raise ValueError(f'Unknown wire format: {wire_format}')
+    return packed
+
+
+def unpack_array(packed: Packed) -> np.ndarray:
+    """Inverse of pack_array, so the server can track what clients hold."""
+    if not isinstance(packed, dict):
+        return np.asarray(packed, dtype=np.float32)
+    shape = tuple(packed['shape'])
+    if packed['dtype'] == 'float16':
+        return np.frombuffer(packed['data'], dtype='<f2').astype(np.float32).reshape(shape)
+    if packed['dtype'] == 'uint8':
+        # Same arithmetic as the JS decoder: float64, then rounded to float32
+        q = np.frombuffer(packed['data'], dtype=np.uint8).astype(np.float64)
+        return (packed['min'] + q * packed['scale']).astype(np.float32).reshape(shape)
+    raise ValueError(f"Unknown wire dtype: {packed['dtype']}")
@@ -35,9 +35,10 @@ export default function ProbabilityTower({ tokenProbabilities = [], samples = []
 
   const top5 = useMemo(() => {
     if (!latest) return []
-    const { logits, vocab } = latest
+    // Backend sends only the top-k candidates; temperature is re-applied across them
+    const { logits, tokens } = latest
     const probs = softmax(logits, temperature)
-    const pairs = probs.map((p, i) => ({ char: vocab[i] ?? '?', prob: p, idx: i }))
+    const pairs = probs.map((p, i) => ({ char: tokens[i] ?? '?', prob: p, idx: i }))
     pairs.sort((a, b) => b.prob - a.prob)
     return pairs.slice(0, 5)
   }, [latest, temperature])
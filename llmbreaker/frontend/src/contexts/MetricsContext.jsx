@@ -16,6 +16,16 @@ import { createContext, useReducer } from 'react'
 
 const initialState = {}
 
+/** `existing` plus the `replayed` entries it lacks, ordered by step. */
+function mergeReplay(existing, replayed, keyOf = (e) => e.step) {
+  const seen = new Set(existing.map(keyOf))
+  const added = replayed.filter((e) => !seen.has(keyOf(e)))
+  if (!added.length) return existing
+  return [...existing, ...added].sort((a, b) => a.step - b.step)
+}
+
+const attentionKey = (s) => `${s.step}:${s.layer}:${s.head}`
+
 function makeEmpty() {
   return {
     lossHistory:          [],
@@ -24,7 +34,7 @@ function makeEmpty() {
     finalStats:           null,
     vocabInfo:            null,     // { vocab, charToIdx, textPreview }
     embeddingSnapshots:   [],      // [{ step, coords, labels }]
-    tokenProbabilities:   [],      // [{ step, logits, generatedToken, vocab }]
+    tokenProbabilities:   [],      // [{ step, tokens, probs, logits, generatedToken, temperature }] (top-k)
   }
 }
 
@@ -105,7 +115,7 @@ function reducer(state, action) {
     }
 
     case 'ADD_TOKEN_PROBS': {
-      const { session_id, step, logits, generated_token, vocab } = action.payload
+      const { session_id, step, tokens, probs, logits, generated_token, temperature } = action.payload
       const prev = state[session_id] ?? makeEmpty()
       return {
         ...state,
@@ -113,12 +123,58 @@ function reducer(state, action) {
           ...prev,
           tokenProbabilities: [
             ...prev.tokenProbabilities,
-            { step, logits, generatedToken: generated_token, vocab },
+            { step, tokens, probs, logits, generatedToken: generated_token, temperature },
           ],
         },
       }
     }
 
+    case 'ADD_EVAL_FRAME': {
+      // A whole eval interval in one dispatch (one render): payload.actions
+      // are the per-event actions above, applied in order
+      return action.payload.actions.reduce(reducer, state)
+    }
+
+    case 'REPLAY_HISTORY': {
+      // history_replay from the server after (re)joining a running session
+      const { session_id, loss, samples } = action.payload
+      const prev = state[session_id] ?? makeEmpty()
+      return {
+        ...state,
+        [session_id]: {
+          ...prev,
+          lossHistory: mergeReplay(prev.lossHistory, loss),
+          samples:     mergeReplay(prev.samples, samples),
+        },
+      }
+    }
+
+    case 'REPLAY_FRAMES': {
+      // A page of stored eval frames (GET /api/sessions/<id>/history/frames)
+      const { session_id, frames } = action.payload
+      const prev = state[session_id] ?? makeEmpty()
+      const attention = frames.flatMap(({ step, attention, tokens }) =>
+        attention.map(({ layer, head, matrix }) => ({ step, layer, head, matrix, tokens })))
+      const embedding = frames
+        .filter((f) => f.embedding)
+        .map(({ step, embedding }) => ({ step, ...embedding }))
+      const tokenProbs = frames
+        .filter((f) => f.token_probabilities)
+        .map(({ step, token_probabilities: t }) => ({
+          step, tokens: t.tokens, probs: t.probs, logits: t.logits,
+          generatedToken: t.generated_token, temperature: t.temperature,
+        }))
+      return {
+        ...state,
+        [session_id]: {
+          ...prev,
+          attentionSnapshots: mergeReplay(prev.attentionSnapshots, attention, attentionKey),
+          embeddingSnapshots: mergeReplay(prev.embeddingSnapshots, embedding),
+          tokenProbabilities: mergeReplay(prev.tokenProbabilities, tokenProbs),
+        },
+      }
+    }
+
     case 'SET_COMPLETED': {
       const { sessionId, final_train_loss, final_val_loss, total_time_seconds } = action.payload
       const prev = state[sessionId] ?? makeEmpty()
@@ -1,6 +1,11 @@
 import { useEffect, useCallback, useContext } from 'react'
 import { TrainingContext } from '../contexts/TrainingContext'
 import { MetricsContext } from '../contexts/MetricsContext'
+import { decodeTokenProbs } from '../utils/wireFormat'
+import { DeltaDecoder } from '../utils/deltaDecoder'
+import { getSessionHistoryFrames } from '../utils/apiClient'
+
+const REPLAY_FRAME_PAGE = 8   // stored eval frames fetched per request
 
 /**
  * Binds WebSocket events for a specific session and exposes control functions.
@@ -16,7 +21,43 @@ export function useTrainingSession(socket, sessionId) {
   useEffect(() => {
     if (!socket || !sessionId) return
 
-    socket.emit('join_session', { session_id: sessionId })
+    // Attention / embedding streams may arrive as keyframes + deltas
+    const decoder = new DeltaDecoder()
+    let keyframeRequested = false
+    const decodeFrame = (key, data, field) => {
+      if (data.frame?.key) keyframeRequested = false
+      const full = decoder.decode(key, data, field)
+      if (full === null && !keyframeRequested) {
+        keyframeRequested = true
+        socket.emit('request_keyframe', { session_id: sessionId })
+      }
+      return full
+    }
+
+    // Stored eval frames are paged in after a history_replay; a newer replay
+    // (or unmounting) abandons the previous paging
+    let replayId = 0
+    const pageFrames = async (id, steps) => {
+      let afterStep = -1
+      const last = steps[steps.length - 1]
+      while (id === replayId && afterStep < last) {
+        let frames
+        try {
+          frames = await getSessionHistoryFrames(sessionId, afterStep, REPLAY_FRAME_PAGE)
+        } catch {
+          return   // the live stream still fills in from here on
+        }
+        if (id !== replayId || !frames.length) return
+        metricsDispatch({ type: 'REPLAY_FRAMES', payload: { session_id: sessionId, frames } })
+        afterStep = frames[frames.length - 1].step
+      }
+    }
+
+    const join = () => {
+      decoder.reset()
+      socket.emit('join_session', { session_id: sessionId })
+    }
+    join()
 
     const onStarted = (data) => {
       trainingDispatch({ type: 'SESSION_STARTED', payload: data })
@@ -37,7 +78,8 @@ export function useTrainingSession(socket, sessionId) {
     }
     const onAttention = (data) => {
       if (data.session_id !== sessionId) return
-      metricsDispatch({ type: 'ADD_ATTENTION', payload: data })
+      const matrix = decodeFrame(`attention:${data.layer}:${data.head}`, data, 'matrix')
+      if (matrix) metricsDispatch({ type: 'ADD_ATTENTION', payload: { ...data, matrix } })
     }
     const onVocabInfo = (data) => {
       if (data.session_id !== sessionId) return
@@ -45,11 +87,55 @@ export function useTrainingSession(socket, sessionId) {
     }
     const onEmbedding = (data) => {
       if (data.session_id !== sessionId) return
-      metricsDispatch({ type: 'ADD_EMBEDDING', payload: data })
+      const coords = decodeFrame('embedding', data, 'coords')
+      if (coords) metricsDispatch({ type: 'ADD_EMBEDDING', payload: { ...data, coords } })
     }
     const onTokenProbs = (data) => {
       if (data.session_id !== sessionId) return
-      metricsDispatch({ type: 'ADD_TOKEN_PROBS', payload: data })
+      metricsDispatch({ type: 'ADD_TOKEN_PROBS', payload: decodeTokenProbs(data) })
+    }
+    // One event per eval interval (training_config.eval_events 'frame'),
+    // sections as in the separate events above; every section is optional
+    const onEvalFrame = (data) => {
+      if (data.session_id !== sessionId || data.version !== 1) return
+      const envelope = { session_id: data.session_id, step: data.step, timestamp: data.timestamp }
+      const actions = []
+      if (data.metrics) {
+        trainingDispatch({ type: 'UPDATE_STATUS', payload: { sessionId, status: 'running' } })
+        trainingDispatch({ type: 'UPDATE_ITER',   payload: { sessionId, currentIter: data.step } })
+        actions.push({ type: 'ADD_METRICS', payload: { ...envelope, ...data.metrics } })
+      }
+      if (data.sample) {
+        actions.push({ type: 'ADD_SAMPLE', payload: { ...envelope, ...data.sample } })
+      }
+      if (data.token_probabilities) {
+        actions.push({ type: 'ADD_TOKEN_PROBS', payload: decodeTokenProbs({ ...envelope, ...data.token_probabilities }) })
+      }
+      if (data.embedding) {
+        const coords = decodeFrame('embedding', data.embedding, 'coords')
+        if (coords) actions.push({ type: 'ADD_EMBEDDING', payload: { ...envelope, ...data.embedding, coords } })
+      }
+      for (const head of data.attention?.heads ?? []) {
+        const matrix = decodeFrame(`attention:${head.layer}:${head.head}`, head, 'matrix')
+        if (matrix) {
+          actions.push({
+            type: 'ADD_ATTENTION',
+            payload: { ...envelope, ...head, matrix, tokens: data.attention.tokens },
+          })
+        }
+      }
+      metricsDispatch({ type: 'ADD_EVAL_FRAME', payload: { actions } })
+    }
+    // Sent on join: what the session recorded before this client joined
+    const onHistoryReplay = (data) => {
+      if (data.session_id !== sessionId) return
+      trainingDispatch({ type: 'UPDATE_STATUS', payload: { sessionId, status: data.status, error: data.error } })
+      trainingDispatch({ type: 'UPDATE_ITER',   payload: { sessionId, currentIter: data.current_iter } })
+      if (data.vocab_info) {
+        metricsDispatch({ type: 'SET_VOCAB_INFO', payload: { session_id: sessionId, ...data.vocab_info } })
+      }
+      metricsDispatch({ type: 'REPLAY_HISTORY', payload: data })
+      if (data.frame_steps.length) pageFrames(++replayId, data.frame_steps)
     }
     const onPaused = (data) => {
       if (data.session_id !== sessionId) return
@@ -73,6 +159,7 @@ export function useTrainingSession(socket, sessionId) {
       trainingDispatch({ type: 'UPDATE_STATUS', payload: { sessionId, status: 'error', error: data.message } })
     }
 
+    socket.on('connect',            join)   // rooms do not survive a reconnect
     socket.on('training_started',   onStarted)
     socket.on('training_metrics',   onMetrics)
     socket.on('step_progress',      onStepProgress)
@@ -81,6 +168,8 @@ export function useTrainingSession(socket, sessionId) {
     socket.on('vocab_info',          onVocabInfo)
     socket.on('embedding_snapshot',  onEmbedding)
     socket.on('token_probabilities', onTokenProbs)
+    socket.on('eval_frame',          onEvalFrame)
+    socket.on('history_replay',      onHistoryReplay)
     socket.on('training_paused',     onPaused)
     socket.on('training_resumed',   onResumed)
     socket.on('training_stopped',   onStopped)
@@ -88,6 +177,8 @@ export function useTrainingSession(socket, sessionId) {
     socket.on('error',              onError)
 
     return () => {
+      replayId++
+      socket.off('connect',            join)
       socket.off('training_started',   onStarted)
       socket.off('training_metrics',   onMetrics)
       socket.off('step_progress',      onStepProgress)
@@ -96,6 +187,8 @@ export function useTrainingSession(socket, sessionId) {
       socket.off('vocab_info',          onVocabInfo)
       socket.off('embedding_snapshot',  onEmbedding)
       socket.off('token_probabilities', onTokenProbs)
+      socket.off('eval_frame',          onEvalFrame)
+      socket.off('history_replay',      onHistoryReplay)
       socket.off('training_paused',     onPaused)
       socket.off('training_resumed',   onResumed)
       socket.off('training_stopped',   onStopped)
@@ -64,7 +64,11 @@ export async function createSession({ feature_type, dataset_id, hyperparameters
   const { data } = await api.post('/api/sessions/create', {
     feature_type,
     dataset_id,
-    hyperparameters,
+    // One eval_frame per eval interval, snapshots as binary float16
+    // keyframes + deltas (utils/wireFormat.js, utils/deltaDecoder.js)
+    hyperparameters: {
+      wire_format: 'float16', delta_frames: true, eval_events: 'frame', ...hyperparameters,
+    },
   })
   return data
 }
@@ -78,6 +82,36 @@ export async function getSession(sessionId) {
   return data
 }
 
+/**
+ * What a session recorded before this client joined: the loss curve
+ * (downsampled server-side to at most maxPoints), recent samples and the
+ * steps that have stored eval frames.
+ * @param {string} sessionId
+ * @param {number} [maxPoints]
+ * @returns {Promise<Object>}
+ */
+export async function getSessionHistory(sessionId, maxPoints = 300) {
+  const { data } = await api.get(`/api/sessions/${sessionId}/history`, {
+    params: { max_points: maxPoints },
+  })
+  return data
+}
+
+/**
+ * One page of stored eval frames (attention, embedding, token
+ * probabilities) with step > afterStep, oldest first.
+ * @param {string} sessionId
+ * @param {number} [afterStep]
+ * @param {number} [limit]
+ * @returns {Promise<Object[]>}
+ */
+export async function getSessionHistoryFrames(sessionId, afterStep = -1, limit = 8) {
+  const { data } = await api.get(`/api/sessions/${sessionId}/history/frames`, {
+    params: { after_step: afterStep, limit },
+  })
+  return data.frames
+}
+
 /**
  * @param {string} sessionId
  * @returns {Promise<Object>}
@@ -114,4 +148,23 @@ export async function loadModelAsSession(recordId) {
   return data
 }
 
+// ── Generation ───────────────────────────────────────────────────────────────
+
+/**
+ * Score several candidate contexts in one request.
+ *
+ * @param {string} sessionId
+ * @param {string[]} contexts
+ * @param {number|number[]} [temperature]  one value, or one per context
+ * @returns {Promise<Array<{next_token: string, probabilities: Array, context_used: string}>>}
+ */
+export async function generateNextTokenBatch(sessionId, contexts, temperature = 1.0) {
+  const { data } = await api.post('/api/generate-next-token/batch', {
+    session_id: sessionId,
+    contexts,
+    temperature,
+  })
+  return data.results
+}
+
 export default api
@@ -0,0 +1,68 @@
+/**
+ * Delta decoder - Rebuilds full attention / embedding frames from the
+ * keyframes + deltas sent by metrics_emitter.DeltaEncoder.
+ *
+ * Each stream (one attention head, or the embedding cloud) keeps its last
+ * full frame as a Float32Array.  A delta is int8 values times one scale,
+ * either dense or at the given uint32 indices, added onto that frame.
+ * Payloads without a `frame` field are plain full frames.
+ */
+
+import { reshape, toFlat, unpackArray } from './wireFormat'
+
+function bytesOf(data) {
+  if (data instanceof ArrayBuffer) return new Uint8Array(data)
+  return new Uint8Array(data.buffer, data.byteOffset, data.byteLength)
+}
+
+function int8s(data) {
+  const b = bytesOf(data)
+  return new Int8Array(b.buffer, b.byteOffset, b.byteLength)
+}
+
+function uint32s(data) {
+  let b = bytesOf(data)
+  if (b.byteOffset % 4) b = b.slice()   // Uint32Array views must be aligned
+  return new Uint32Array(b.buffer, b.byteOffset, b.byteLength / 4)
+}
+
+export class DeltaDecoder {
+  constructor() {
+    this.streams = new Map()   // key → { seq, flat: Float32Array, shape }
+  }
+
+  /** Forget every stream (after a reconnect the server resends keyframes). */
+  reset() {
+    this.streams.clear()
+  }
+
+  /**
+   * Full nested-array frame for `data[field]`, or null when a delta does
+   * not follow the frame we hold (the caller should request a keyframe).
+   */
+  decode(key, data, field) {
+    const frame = data.frame
+    if (!frame) return unpackArray(data[field])
+
+    if (frame.key) {
+      const { flat, shape } = toFlat(data[field])
+      this.streams.set(key, { seq: frame.seq, flat, shape })
+      return reshape(flat, shape)
+    }
+
+    const stream = this.streams.get(key)
+    if (!stream || stream.seq !== frame.ref_seq) return null
+
+    const { scale, values, indices } = data.delta
+    const q = int8s(values)
+    const flat = stream.flat
+    if (indices) {
+      const idx = uint32s(indices)
+      for (let i = 0; i < idx.length; i++) flat[idx[i]] += q[i] * scale
+    } else {
+      for (let i = 0; i < q.length; i++) flat[i] += q[i] * scale
+    }
+    stream.seq = frame.seq
+    return reshape(flat, stream.shape)
+  }
+}
@@ -0,0 +1,86 @@
+/**
+ * Wire format - Unpacks float arrays sent by backend/wire_format.py.
+ *
+ * Sessions created with training_config.wire_format 'float16' or 'uint8'
+ * receive attention matrices, embedding coords and token probabilities as
+ *   { dtype, shape, data: ArrayBuffer, min?, scale? }
+ * (data arrives as a Socket.IO binary attachment).  JSON sessions receive
+ * plain arrays, which pass through unchanged.
+ */
+
+// float16 bits → float32 value
+function halfToFloat(h) {
+  const sign = h & 0x8000 ? -1 : 1
+  const exp  = (h >> 10) & 0x1f
+  const frac = h & 0x03ff
+  if (exp === 0)    return sign * 2 ** -14 * (frac / 1024)
+  if (exp === 0x1f) return frac ? NaN : sign * Infinity
+  return sign * 2 ** (exp - 15) * (1 + frac / 1024)
+}
+
+const HALF_TABLE = new Float32Array(65536)
+for (let h = 0; h < 65536; h++) HALF_TABLE[h] = halfToFloat(h)
+
+function toBytes(data) {
+  if (data instanceof ArrayBuffer) return new Uint8Array(data)
+  return new Uint8Array(data.buffer, data.byteOffset, data.byteLength)
+}
+
+/** Packed array → flat Float32Array. */
+function unpackFlat(packed) {
+  const bytes = toBytes(packed.data)
+  if (packed.dtype === 'float16') {
+    // Copy when the view is not 2-byte aligned
+    const src  = bytes.byteOffset % 2 ? bytes.slice() : bytes
+    const bits = new Uint16Array(src.buffer, src.byteOffset, src.byteLength / 2)
+    const out  = new Float32Array(bits.length)
+    for (let i = 0; i < bits.length; i++) out[i] = HALF_TABLE[bits[i]]
+    return out
+  }
+  if (packed.dtype === 'uint8') {
+    const out = new Float32Array(bytes.length)
+    for (let i = 0; i < bytes.length; i++) out[i] = packed.min + bytes[i] * packed.scale
+    return out
+  }
+  throw new Error(`Unknown wire dtype: ${packed.dtype}`)
+}
+
+/** Shape of a nested array, e.g. [[1,2],[3,4]] → [2, 2]. */
+function shapeOf(value) {
+  const shape = []
+  for (let v = value; Array.isArray(v); v = v[0]) shape.push(v.length)
+  return shape
+}
+
+/**
+ * { flat: Float32Array, shape } for a wire value, JSON or packed.
+ */
+export function toFlat(value) {
+  if (Array.isArray(value)) {
+    return { flat: Float32Array.from(value.flat(Infinity)), shape: shapeOf(value) }
+  }
+  return { flat: unpackFlat(value), shape: value.shape }
+}
+
+export function reshape(flat, shape, offset = 0) {
+  if (shape.length <= 1) return Array.from(flat.subarray(offset, offset + (shape[0] ?? flat.length)))
+  const [n, ...rest] = shape
+  const stride = rest.reduce((a, b) => a * b, 1)
+  const out = new Array(n)
+  for (let i = 0; i < n; i++) out[i] = reshape(flat, rest, offset + i * stride)
+  return out
+}
+
+/**
+ * Plain (nested) number array for a wire value: JSON arrays are returned
+ * as-is, packed arrays are decoded and reshaped.
+ */
+export function unpackArray(value) {
+  if (value == null || Array.isArray(value)) return value
+  return reshape(unpackFlat(value), value.shape)
+}
+
+/** Token-probability payload with its float arrays unpacked. */
+export function decodeTokenProbs(data) {
+  return { ...data, probs: unpackArray(data.probs), logits: unpackArray(data.logits) }
+}